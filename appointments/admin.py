@@ -1,10 +1,12 @@
 from django.contrib import admin
-from .models import Appointment, AppointmentFeedback
+from .models import Appointment, AppointmentFeedback, DoctorRatingStats
+from .search import search_appointments
 
 @admin.register(Appointment)
 class AppointmentAdmin(admin.ModelAdmin):
     list_display = ('id', 'patient', 'doctor', 'date_time', 'status', 'created_at')
     list_filter = ('status', 'date_time', 'doctor')
+    # Served from the search index; see get_search_results.
     search_fields = ('patient__username', 'doctor__username', 'notes')
     date_hierarchy = 'date_time'
     readonly_fields = ('created_at', 'updated_at')
@@ -18,6 +20,11 @@ class AppointmentAdmin(admin.ModelAdmin):
         }),
     )
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return search_appointments(queryset, search_term, rank=False), False
+
 @admin.register(AppointmentFeedback)
 class AppointmentFeedbackAdmin(admin.ModelAdmin):
     list_display = ('id', 'appointment', 'rating', 'created_at')
@@ -34,3 +41,8 @@ class AppointmentFeedbackAdmin(admin.ModelAdmin):
         }),
     )
 
+@admin.register(DoctorRatingStats)
+class DoctorRatingStatsAdmin(admin.ModelAdmin):
+    list_display = ('doctor', 'rating_count', 'average_rating', 'updated_at')
+    search_fields = ('doctor__username',)
+    readonly_fields = ('doctor', 'rating_count', 'rating_sum', 'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5', 'updated_at')
@@ -0,0 +1,156 @@
+import bisect
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Appointment
+
+User = get_user_model()
+
+
+class SlotConflict(Exception):
+    """The requested time overlaps an appointment the doctor already has."""
+    def __init__(self, message='The doctor already has an appointment at this time.'):
+        super().__init__(message)
+
+
+def slot_length():
+    return timedelta(minutes=settings.APPOINTMENT_SLOT_MINUTES)
+
+
+def booked_appointments(doctor_ids, start, end, exclude=None):
+    """
+    Active appointments of the given doctors whose slot overlaps [start, end).
+    Served by a range scan on the (doctor, date_time) index.
+    """
+    slot = slot_length()
+    queryset = Appointment.objects.filter(
+        doctor_id__in=doctor_ids,
+        date_time__gt=start - slot,
+        date_time__lt=end,
+    ).exclude(status='CANCELLED')
+    if exclude:
+        queryset = queryset.exclude(pk__in=exclude)
+    return queryset
+
+
+def lock_doctors(doctor_ids):
+    """
+    Serialize bookings for the given doctors until the end of the
+    transaction, so that two concurrent requests cannot both pass the
+    conflict check.
+    """
+    if connection.features.has_select_for_update:
+        list(User.objects.select_for_update().filter(pk__in=sorted(doctor_ids)).values_list('pk', flat=True))
+
+
+def ensure_slot_available(doctor_id, date_time, exclude=None):
+    """
+    Raise SlotConflict if date_time overlaps one of the doctor's bookings.
+    Must run inside a transaction to be race-free.
+    """
+    lock_doctors([doctor_id])
+    if booked_appointments([doctor_id], date_time, date_time + slot_length(), exclude=exclude).exists():
+        raise SlotConflict()
+
+
+class DoctorSchedule:
+    """
+    Sorted interval index of one doctor's booked slots within a window.
+
+    The bookings are loaded with a single query; conflict checks are then a
+    binary search over the sorted start times, so checking many candidate
+    slots (free slot listing, bulk operations) never goes back to the DB.
+    """
+    def __init__(self, doctor_id, starts=()):
+        self.doctor_id = doctor_id
+        self.slot = slot_length()
+        self.starts = sorted(starts)
+
+    @classmethod
+    def for_doctors(cls, doctor_ids, start, end, exclude=None):
+        """Schedules of several doctors over [start, end), loaded in one query."""
+        schedules = {doctor_id: cls(doctor_id) for doctor_id in doctor_ids}
+        booked = (
+            booked_appointments(schedules, start, end, exclude=exclude)
+            .order_by('date_time')
+            .values_list('doctor_id', 'date_time')
+        )
+        for doctor_id, date_time in booked:
+            schedules[doctor_id].starts.append(date_time)
+        return schedules
+
+    @classmethod
+    def around(cls, bookings):
+        """
+        Schedules holding only the bookings that could collide with the given
+        (doctor_id, date_time) pairs, loaded in one query. Used by the bulk
+        endpoints, whose items may be scattered over a long period.
+        """
+        slot = slot_length()
+        schedules = {}
+        windows = Q()
+        for doctor_id, date_time in bookings:
+            schedules.setdefault(doctor_id, cls(doctor_id))
+            windows |= Q(doctor_id=doctor_id, date_time__gt=date_time - slot, date_time__lt=date_time + slot)
+        if not schedules:
+            return schedules
+        booked = (
+            Appointment.objects.filter(windows)
+            .exclude(status='CANCELLED')
+            .order_by('date_time')
+            .values_list('doctor_id', 'date_time')
+        )
+        for doctor_id, date_time in booked:
+            schedules[doctor_id].starts.append(date_time)
+        return schedules
+
+    def conflicts(self, date_time):
+        index = bisect.bisect_right(self.starts, date_time - self.slot)
+        return index < len(self.starts) and self.starts[index] < date_time + self.slot
+
+    def book(self, date_time):
+        if self.conflicts(date_time):
+            raise SlotConflict()
+        self.add(date_time)
+
+    def add(self, date_time):
+        bisect.insort(self.starts, date_time)
+
+    def release(self, date_time):
+        index = bisect.bisect_left(self.starts, date_time)
+        if index < len(self.starts) and self.starts[index] == date_time:
+            del self.starts[index]
+
+    def free_slots(self, start_date, end_date, now=None):
+        """
+        Slot start times within working hours between start_date and end_date
+        (inclusive) that are in the future and do not overlap a booking.
+        """
+        now = now or timezone.now()
+        tz = timezone.get_current_timezone()
+        day_start = time.fromisoformat(settings.APPOINTMENT_DAY_START)
+        day_end = time.fromisoformat(settings.APPOINTMENT_DAY_END)
+
+        slots = []
+        day = start_date
+        while day <= end_date:
+            cursor = timezone.make_aware(datetime.combine(day, day_start), tz)
+            closing = timezone.make_aware(datetime.combine(day, day_end), tz)
+            while cursor + self.slot <= closing:
+                if cursor >= now and not self.conflicts(cursor):
+                    slots.append(cursor)
+                cursor += self.slot
+            day += timedelta(days=1)
+        return slots
+
+    @classmethod
+    def for_dates(cls, doctor_id, start_date, end_date):
+        tz = timezone.get_current_timezone()
+        start = timezone.make_aware(datetime.combine(start_date, time.min), tz)
+        end = timezone.make_aware(datetime.combine(end_date + timedelta(days=1), time.min), tz)
+        return cls.for_doctors([doctor_id], start, end)[doctor_id]
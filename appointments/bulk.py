@@ -0,0 +1,186 @@
+"""
+Bulk appointment writes.
+
+Every operation validates all of its items up front, checks permissions for
+the whole set with one scoped query, checks slot conflicts against in-memory
+DoctorSchedules and writes the accepted rows with a single bulk_create or
+bulk_update inside one transaction. Items that fail are reported
+individually and do not stop the others.
+
+bulk_create/bulk_update bypass model signals, so the patient notifications
+are queued here as one batch instead of once per row, and search_text and
+the response cache are maintained explicitly.
+"""
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+from notifications.outbox import enqueue_emails
+from . import cache as response_cache
+from .availability import DoctorSchedule, SlotConflict, lock_doctors
+from .models import Appointment
+from .serializers import BulkAppointmentCreateSerializer, BulkAppointmentRescheduleSerializer
+from .signals import appointment_notification
+
+User = get_user_model()
+
+
+def item_error(index, errors, pk=None):
+    return {'index': index, 'id': pk, 'status': 'error', 'errors': errors}
+
+
+def item_result(index, appointment, result):
+    return {'index': index, 'id': appointment.pk, 'status': result}
+
+
+def notify(appointments, created):
+    enqueue_emails([
+        appointment_notification(appointment, created)
+        for appointment in appointments
+        if appointment.patient.email
+    ])
+
+
+def create_appointments(patient, items):
+    """Book a list of {doctor_id, date_time, notes} items for the patient."""
+    results = [None] * len(items)
+    valid = []
+    for index, item in enumerate(items):
+        serializer = BulkAppointmentCreateSerializer(data=item)
+        if serializer.is_valid():
+            valid.append((index, serializer.validated_data))
+        else:
+            results[index] = item_error(index, serializer.errors)
+
+    with transaction.atomic():
+        doctors = User.objects.filter(is_doctor=True).in_bulk({data['doctor_id'] for _, data in valid})
+        lock_doctors(doctors)
+        schedules = DoctorSchedule.around(
+            (data['doctor_id'], data['date_time']) for _, data in valid if data['doctor_id'] in doctors
+        )
+
+        accepted = []
+        for index, data in valid:
+            doctor = doctors.get(data['doctor_id'])
+            if doctor is None:
+                results[index] = item_error(index, {'doctor_id': ['Doctor not found.']})
+                continue
+            try:
+                schedules[doctor.pk].book(data['date_time'])
+            except SlotConflict as e:
+                results[index] = item_error(index, {'date_time': [str(e)]})
+                continue
+            appointment = Appointment(patient=patient, doctor=doctor, date_time=data['date_time'], notes=data.get('notes'))
+            appointment.search_text = appointment.build_search_text()
+            accepted.append((index, appointment))
+
+        booked = [appointment for _, appointment in accepted]
+        Appointment.objects.bulk_create(booked)
+        notify(booked, created=True)
+        response_cache.invalidate_appointments(booked)
+
+    for index, appointment in accepted:
+        results[index] = item_result(index, appointment, 'created')
+    return results
+
+
+def cancel_appointments(queryset, ids):
+    """Cancel the appointments with the given ids that are visible in queryset."""
+    results = [None] * len(ids)
+    wanted = {}
+    seen = set()
+    for index, value in enumerate(ids):
+        try:
+            pk = serializers.IntegerField().to_internal_value(value)
+        except serializers.ValidationError as e:
+            results[index] = item_error(index, {'id': e.detail})
+            continue
+        if pk in seen:
+            results[index] = item_error(index, {'id': ['Duplicate id.']}, pk)
+            continue
+        seen.add(pk)
+        wanted[index] = pk
+
+    with transaction.atomic():
+        found = queryset.select_for_update(of=('self',)).in_bulk(seen)
+        now = timezone.now()
+        cancelled = []
+        for index, pk in wanted.items():
+            appointment = found.get(pk)
+            if appointment is None:
+                results[index] = item_error(index, {'id': ['Not found.']}, pk)
+            elif appointment.status == 'CANCELLED':
+                results[index] = item_error(index, {'status': ['Appointment is already cancelled.']}, pk)
+            else:
+                appointment.status = 'CANCELLED'
+                appointment.updated_at = now
+                appointment.search_text = appointment.build_search_text()
+                cancelled.append(appointment)
+                results[index] = item_result(index, appointment, 'cancelled')
+
+        Appointment.objects.bulk_update(cancelled, ['status', 'updated_at', 'search_text'])
+        notify(cancelled, created=False)
+        response_cache.invalidate_appointments(cancelled)
+    return results
+
+
+def reschedule_appointments(queryset, changes):
+    """
+    Move appointments visible in queryset according to a list of
+    {id, new_date_time} items. Items are applied in order, so an appointment
+    may move into a slot freed by an earlier item of the same request.
+    """
+    results = [None] * len(changes)
+    valid = []
+    seen = set()
+    for index, item in enumerate(changes):
+        serializer = BulkAppointmentRescheduleSerializer(data=item)
+        if not serializer.is_valid():
+            results[index] = item_error(index, serializer.errors)
+        elif serializer.validated_data['id'] in seen:
+            results[index] = item_error(index, {'id': ['Duplicate id.']}, serializer.validated_data['id'])
+        else:
+            seen.add(serializer.validated_data['id'])
+            valid.append((index, serializer.validated_data))
+
+    with transaction.atomic():
+        found = queryset.select_for_update(of=('self',)).in_bulk(seen)
+        lock_doctors({appointment.doctor_id for appointment in found.values()})
+        bookings = []
+        for _, data in valid:
+            appointment = found.get(data['id'])
+            if appointment is not None:
+                bookings.append((appointment.doctor_id, appointment.date_time))
+                bookings.append((appointment.doctor_id, data['new_date_time']))
+        schedules = DoctorSchedule.around(bookings)
+
+        now = timezone.now()
+        moved = []
+        for index, data in valid:
+            appointment = found.get(data['id'])
+            if appointment is None:
+                results[index] = item_error(index, {'id': ['Not found.']}, data['id'])
+                continue
+            schedule = schedules[appointment.doctor_id]
+            # A cancelled appointment holds no slot, but moving it is still
+            # checked against the doctor's bookings like the single endpoint.
+            active = appointment.status != 'CANCELLED'
+            if active:
+                schedule.release(appointment.date_time)
+            if schedule.conflicts(data['new_date_time']):
+                if active:
+                    schedule.add(appointment.date_time)
+                results[index] = item_error(index, {'new_date_time': [str(SlotConflict())]}, appointment.pk)
+                continue
+            if active:
+                schedule.add(data['new_date_time'])
+            appointment.date_time = data['new_date_time']
+            appointment.updated_at = now
+            moved.append(appointment)
+            results[index] = item_result(index, appointment, 'rescheduled')
+
+        Appointment.objects.bulk_update(moved, ['date_time', 'updated_at'])
+        notify(moved, created=False)
+        response_cache.invalidate_appointments(moved)
+    return results
@@ -0,0 +1,235 @@
+"""
+Versioned response cache for the appointment read endpoints.
+
+Cached responses are keyed by user, role, action, the full request URL and
+the current values of the generation counters the response depends on:
+one per patient, one per doctor and one for staff (who see every
+appointment). Writes bump the affected counters after commit, which orphans
+every stale entry at once; nothing is ever looked up by pattern or deleted.
+Orphans simply expire. Payloads embed both participants, so a change to a
+user bumps the counters of everyone they share an appointment with.
+
+Counters are seeded with the current time in nanoseconds rather than 1, so
+a counter that was evicted can never come back at a value that old entries
+are still stored under.
+"""
+import functools
+import hashlib
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils.http import parse_http_date_safe
+from rest_framework.response import Response
+
+from config import async_cache
+from config.replicas import cache_timeout
+from config.timing import count_cache
+
+from . import conditional
+from .models import Appointment
+
+KEY_PREFIX = 'appointments:cache'
+STATS_KEYS = {'hit': f'{KEY_PREFIX}:stats:hits', 'miss': f'{KEY_PREFIX}:stats:misses'}
+
+
+def generation_key(scope, pk=None):
+    return f'{KEY_PREFIX}:gen:{scope}' if pk is None else f'{KEY_PREFIX}:gen:{scope}:{pk}'
+
+
+def scopes_for(user):
+    """Generation counters that a user's view of appointments depends on."""
+    if user.is_staff:
+        scope = generation_key('all')
+    elif user.is_patient:
+        scope = generation_key('patient', user.pk)
+    elif user.is_doctor:
+        scope = generation_key('doctor', user.pk)
+    else:
+        return None
+    return [scope]
+
+
+def role_of(user):
+    if user.is_staff:
+        return 'staff'
+    return 'patient' if user.is_patient else 'doctor'
+
+
+def get_generations(keys):
+    values = cache.get_many(keys)
+    for key in keys:
+        if key not in values:
+            seed = time.time_ns()
+            values[key] = seed if cache.add(key, seed, None) else cache.get(key)
+    return [values[key] for key in keys]
+
+
+async def aget_generations(keys):
+    values = await async_cache.aget_many(keys)
+    for key in keys:
+        if key not in values:
+            seed = time.time_ns()
+            values[key] = seed if await async_cache.aadd(key, seed, None) else await async_cache.aget(key)
+    return [values[key] for key in keys]
+
+
+def bump(keys):
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+
+
+def bump_on_commit(keys):
+    """
+    Bump the counters once the surrounding transaction commits, so a
+    concurrent read cannot cache pre-commit data under the new generation.
+    """
+    keys = set(keys)
+    if keys:
+        transaction.on_commit(lambda: bump(keys))
+
+
+def appointment_scopes(patient_ids=(), doctor_ids=()):
+    keys = [generation_key('all')]
+    keys += [generation_key('patient', pk) for pk in patient_ids if pk is not None]
+    keys += [generation_key('doctor', pk) for pk in doctor_ids if pk is not None]
+    return keys
+
+
+def invalidate_appointments(appointments):
+    """Invalidate cached responses after writes that bypass model signals."""
+    bump_on_commit(appointment_scopes(
+        {appointment.patient_id for appointment in appointments},
+        {appointment.doctor_id for appointment in appointments},
+    ))
+
+
+def invalidate_participant(user_id):
+    """Invalidate the cached responses that embed a user's details."""
+    pairs = (
+        Appointment.objects.filter(Q(patient_id=user_id) | Q(doctor_id=user_id))
+        .order_by().values_list('patient_id', 'doctor_id').distinct()
+    )
+    patient_ids, doctor_ids = set(), set()
+    for patient_id, doctor_id in pairs:
+        patient_ids.add(patient_id)
+        doctor_ids.add(doctor_id)
+    # Without appointments the user appears in no cached response.
+    if patient_ids:
+        bump_on_commit(appointment_scopes(patient_ids, doctor_ids))
+
+
+def record(outcome):
+    count_cache('appointments', outcome == 'hit')
+    key = STATS_KEYS[outcome]
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+async def arecord(outcome):
+    count_cache('appointments', outcome == 'hit')
+    await async_cache.aincr_or_create(STATS_KEYS[outcome])
+
+
+def get_stats():
+    values = cache.get_many(STATS_KEYS.values())
+    return {outcome: values.get(key) or 0 for outcome, key in STATS_KEYS.items()}
+
+
+def reset_stats():
+    cache.delete_many(STATS_KEYS.values())
+
+
+def response_key(view, request, scopes, generations=None):
+    digest = hashlib.sha1()
+    digest.update(request.build_absolute_uri().encode())
+    digest.update(request.META.get('HTTP_ACCEPT', '').encode())
+    if generations is None:
+        generations = get_generations(scopes)
+    generations = '.'.join(str(value) for value in generations)
+    return (
+        f'{KEY_PREFIX}:response:{view.basename}:{view.action}:'
+        f'{request.user.pk}:{role_of(request.user)}:{generations}:{digest.hexdigest()}'
+    )
+
+
+def cached_entry_response(request, entry):
+    etag = entry['etag']
+    if etag is None:
+        return Response(entry['data'])
+    last_modified = entry['last_modified']
+    if last_modified is not None:
+        last_modified = datetime.fromtimestamp(last_modified, tz=timezone.utc)
+    response = None
+    if conditional.is_conditional(request):
+        response = conditional.not_modified(request, etag, last_modified)
+    if response is None:
+        response = Response(entry['data'])
+    return conditional.set_validators(response, etag, last_modified)
+
+
+def response_entry(response):
+    return {
+        'data': response.data,
+        'etag': response.get('ETag'),
+        'last_modified': parse_http_date_safe(response.get('Last-Modified') or ''),
+    }
+
+
+def cached_response(view_method):
+    """
+    Serve a viewset action from the response cache. Successful responses are
+    stored together with their validators, so a cached entry can also answer
+    conditional requests with a 304 without touching the database.
+    """
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        timeout = settings.APPOINTMENT_CACHE_TIMEOUT
+        scopes = scopes_for(request.user) if timeout else None
+        if not scopes:
+            return view_method(self, request, *args, **kwargs)
+
+        key = response_key(self, request, scopes)
+        entry = cache.get(key)
+        if entry is not None:
+            record('hit')
+            return cached_entry_response(request, entry)
+
+        record('miss')
+        response = view_method(self, request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response_entry(response), cache_timeout(timeout))
+        return response
+    return wrapper
+
+
+def acached_response(view_method):
+    """cached_response for async viewset actions, sharing its entries."""
+    @functools.wraps(view_method)
+    async def wrapper(self, request, *args, **kwargs):
+        timeout = settings.APPOINTMENT_CACHE_TIMEOUT
+        scopes = scopes_for(request.user) if timeout else None
+        if not scopes:
+            return await view_method(self, request, *args, **kwargs)
+
+        key = response_key(self, request, scopes, await aget_generations(scopes))
+        entry = await async_cache.aget(key)
+        if entry is not None:
+            await arecord('hit')
+            return cached_entry_response(request, entry)
+
+        await arecord('miss')
+        response = await view_method(self, request, *args, **kwargs)
+        if response.status_code == 200:
+            await async_cache.aset(key, response_entry(response), cache_timeout(timeout))
+        return response
+    return wrapper
@@ -0,0 +1,49 @@
+"""
+Conditional GET helpers.
+
+Validators are built from the rows that make up a response (ids and
+updated_at timestamps) rather than from the rendered body, so an unchanged
+resource can be answered with a 304 before anything is serialized.
+"""
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+
+def is_conditional(request):
+    return 'HTTP_IF_NONE_MATCH' in request.META or 'HTTP_IF_MODIFIED_SINCE' in request.META
+
+
+def make_etag(request, rows, *extra):
+    """
+    Weak ETag over the given rows, any extra values, and everything else the
+    representation depends on: the full URL (filters, cursor, host of
+    absolute links), the negotiated format and the requesting user.
+    """
+    digest = hashlib.sha1()
+    digest.update(request.build_absolute_uri().encode())
+    digest.update(request.META.get('HTTP_ACCEPT', '').encode())
+    digest.update(str(request.user.pk).encode())
+    for row in sorted(rows):
+        digest.update(repr(row).encode())
+    for value in extra:
+        digest.update(repr(value).encode())
+    return f'W/"{digest.hexdigest()}"'
+
+
+def not_modified(request, etag, last_modified=None):
+    """Return a 304 response if the client's validators still match, else None."""
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    return get_conditional_response(request._request, etag=etag, last_modified=timestamp)
+
+
+def set_validators(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    # Representations are per user; shared caches must not reuse them and
+    # clients have to revalidate on every poll.
+    patch_cache_control(response, private=True, no_cache=True)
+    patch_vary_headers(response, ('Authorization', 'Cookie'))
+    return response
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from appointments.cache import get_stats, reset_stats
+
+
+class Command(BaseCommand):
+    help = "Show hit/miss counters of the appointment response cache."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Reset the counters after printing them.')
+
+    def handle(self, *args, **options):
+        stats = get_stats()
+        total = stats['hit'] + stats['miss']
+        ratio = f"{stats['hit'] / total:.1%}" if total else 'n/a'
+        self.stdout.write(f"hits: {stats['hit']}  misses: {stats['miss']}  hit ratio: {ratio}")
+        if options['reset']:
+            reset_stats()
+            self.stdout.write(self.style.SUCCESS('Counters reset.'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from appointments.ratings import rebuild_rating_stats
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per-doctor rating totals from existing appointment feedback."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctor', type=int, action='append', dest='doctor_ids', help='Only rebuild this doctor (repeatable).')
+
+    def handle(self, *args, **options):
+        count = rebuild_rating_stats(options['doctor_ids'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rating stats for {count} doctor(s).'))
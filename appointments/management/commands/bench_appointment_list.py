@@ -0,0 +1,149 @@
+import io
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.urls import reverse
+from django.utils import timezone
+
+from appointments.models import Appointment
+from users.tokens import RefreshToken
+
+User = get_user_model()
+
+# Environment for each connection strategy; see config/database.py.
+MODES = {
+    'per-request': {'DATABASE_POOL': 'false', 'DATABASE_CONN_MAX_AGE': '0'},
+    'persistent': {'DATABASE_POOL': 'false', 'DATABASE_CONN_MAX_AGE': '600'},
+    'pooled': {'DATABASE_POOL': 'true'},
+}
+PATIENT = 'bench-list-patient'
+DOCTOR = 'bench-list-doctor'
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure requests/sec on the appointment list through the WSGI handler with a new "
+        "connection per request, persistent connections and a connection pool. Each strategy "
+        "runs in its own process against DATABASE_URL, which should be a local PostgreSQL."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument('--warmup', type=int, default=50)
+        parser.add_argument('--appointments', type=int, default=20, help='Appointments on the listed page.')
+        parser.add_argument('--modes', nargs='+', choices=list(MODES), default=list(MODES))
+        parser.add_argument('--run', choices=list(MODES), help='Internal: measure one strategy in this process.')
+
+    def handle(self, *args, **options):
+        if options['run']:
+            return self.measure(options)
+        if connection.vendor != 'postgresql':
+            raise CommandError("Point DATABASE_URL at a PostgreSQL database to compare connection strategies.")
+
+        self.seed(options['appointments'])
+        try:
+            results = {mode: self.run_mode(mode, options) for mode in options['modes']}
+        finally:
+            User.objects.filter(username__in=[PATIENT, DOCTOR]).delete()
+
+        baseline = results.get('per-request')
+        for mode, rate in results.items():
+            line = f'{mode:>12}: {rate:8.1f} req/s'
+            if baseline and mode != 'per-request':
+                line += f' ({rate / baseline:.2f}x per-request)'
+            self.stdout.write(line)
+
+    def seed(self, count):
+        patient = User.objects.create_user(username=PATIENT, email=f'{PATIENT}@example.com', is_patient=True)
+        doctor = User.objects.create_user(username=DOCTOR, email=f'{DOCTOR}@example.com', is_doctor=True)
+        start = timezone.now() + timedelta(days=1)
+        appointments = [
+            Appointment(patient=patient, doctor=doctor, date_time=start + timedelta(hours=index))
+            for index in range(count)
+        ]
+        for appointment in appointments:
+            appointment.search_text = appointment.build_search_text()
+        Appointment.objects.bulk_create(appointments)
+
+    def run_mode(self, mode, options):
+        env = {**os.environ, **MODES[mode], 'WEB_THREADS': str(options['threads'])}
+        command = [
+            sys.executable, sys.argv[0], 'bench_appointment_list', '--run', mode,
+            '--requests', str(options['requests']), '--threads', str(options['threads']),
+            '--warmup', str(options['warmup']),
+        ]
+        result = subprocess.run(command, env=env, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise CommandError(f'{mode} run failed:\n{result.stderr}')
+        measured = json.loads(result.stdout.strip().splitlines()[-1])
+        return measured['requests'] / measured['seconds']
+
+    def measure(self, options):
+        handler = get_wsgi_application()
+        # Each request goes through the WSGI handler, so connections are
+        # opened, kept or returned to the pool exactly as under gunicorn.
+        connection.close()
+        token = str(RefreshToken.for_user(User.objects.get(username=PATIENT)).access_token)
+        connection.close()
+        host = next((h.lstrip('.') for h in settings.ALLOWED_HOSTS if h != '*'), 'localhost')
+        path = reverse('appointment-list')
+        lock = threading.Lock()
+        failures = []
+
+        def request(number):
+            environ = {
+                'REQUEST_METHOD': 'GET',
+                'PATH_INFO': path,
+                # A distinct URL per request bypasses the response cache.
+                'QUERY_STRING': f'bench={number}',
+                'SERVER_NAME': host,
+                'SERVER_PORT': '80',
+                'HTTP_HOST': host,
+                'HTTP_AUTHORIZATION': f'Bearer {token}',
+                'REMOTE_ADDR': '127.0.0.1',
+                'wsgi.url_scheme': 'http',
+                'wsgi.input': io.BytesIO(),
+                'wsgi.errors': sys.stderr,
+            }
+            statuses = []
+            response = handler(environ, lambda status, headers, exc_info=None: statuses.append(status))
+            try:
+                b''.join(response)
+            finally:
+                response.close()
+            if not statuses[0].startswith('200'):
+                failures.append(statuses[0])
+
+        def worker(numbers):
+            while True:
+                with lock:
+                    number = next(numbers, None)
+                if number is None:
+                    return
+                request(number)
+
+        def run(numbers):
+            threads = [threading.Thread(target=worker, args=(numbers,)) for _ in range(options['threads'])]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        run(iter(range(options['warmup'])))
+        start = time.perf_counter()
+        run(iter(range(options['warmup'], options['warmup'] + options['requests'])))
+        elapsed = time.perf_counter() - start
+        if failures:
+            raise CommandError(f'{len(failures)} request(s) failed, first: {failures[0]}')
+        self.stdout.write(json.dumps({'requests': options['requests'], 'seconds': elapsed}))
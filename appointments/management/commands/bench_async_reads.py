@@ -0,0 +1,162 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+from django.utils import timezone
+
+from appointments.models import Appointment
+from users.tokens import RefreshToken
+
+User = get_user_model()
+
+PATIENT = 'bench-async-patient'
+DOCTOR = 'bench-async-doctor'
+# The same read through the synchronous and the async route.
+ENDPOINTS = {
+    'list': ('appointment-list', 'async-appointment-list'),
+    'profile': ('user-profile', 'async-user-profile'),
+}
+SERVERS = {
+    'wsgi': ['gunicorn', 'config.wsgi:application', '--worker-class', 'sync', '--threads', '1',
+             '--bind', '127.0.0.1:{port}', '--workers', '{workers}'],
+    'asgi': ['uvicorn', 'config.asgi:application', '--no-access-log',
+             '--host', '127.0.0.1', '--port', '{port}', '--workers', '{workers}'],
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare throughput and latency of the read endpoints under gunicorn sync workers (WSGI) "
+        "and their async versions under uvicorn (ASGI), with the same number of worker processes "
+        "and concurrent clients."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=50, help='Concurrent clients.')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds to measure each server.')
+        parser.add_argument('--workers', type=int, default=1, help='Worker processes per server.')
+        parser.add_argument('--appointments', type=int, default=20, help='Appointments on the listed page.')
+        parser.add_argument('--endpoint', choices=list(ENDPOINTS), default='list')
+
+    def handle(self, *args, **options):
+        patient = self.seed(options['appointments'])
+        token = str(RefreshToken.for_user(patient).access_token)
+        sync_name, async_name = ENDPOINTS[options['endpoint']]
+        try:
+            results = {
+                'wsgi': self.run_server('wsgi', reverse(sync_name), token, options),
+                'asgi': self.run_server('asgi', reverse(async_name), token, options),
+            }
+        finally:
+            User.objects.filter(username__in=[PATIENT, DOCTOR]).delete()
+
+        for server, (rate, p50, p99, errors) in results.items():
+            self.stdout.write(
+                f'{server}: {rate:8.1f} req/s  p50 {p50 * 1000:7.1f} ms  p99 {p99 * 1000:7.1f} ms  errors {errors}'
+            )
+
+    def seed(self, count):
+        patient = User.objects.create_user(username=PATIENT, email=f'{PATIENT}@example.com', is_patient=True)
+        doctor = User.objects.create_user(username=DOCTOR, email=f'{DOCTOR}@example.com', is_doctor=True)
+        start = timezone.now() + timedelta(days=1)
+        appointments = [
+            Appointment(patient=patient, doctor=doctor, date_time=start + timedelta(hours=index))
+            for index in range(count)
+        ]
+        for appointment in appointments:
+            appointment.search_text = appointment.build_search_text()
+        Appointment.objects.bulk_create(appointments)
+        return patient
+
+    def run_server(self, server, path, token, options):
+        port = free_port()
+        command = [arg.format(port=port, workers=options['workers']) for arg in SERVERS[server]]
+        # A file rather than a pipe: a server blocked on a full pipe would stall the run.
+        with tempfile.TemporaryFile() as log:
+            process = subprocess.Popen(command, env=os.environ.copy(), stdout=log, stderr=subprocess.STDOUT)
+            try:
+                self.wait_for(process, port, log)
+                return asyncio.run(self.load(port, path, token, options))
+            finally:
+                process.terminate()
+                process.wait()
+
+    def wait_for(self, process, port, log, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                log.seek(0)
+                raise CommandError(f'Server exited:\n{log.read().decode()}')
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                return
+            except OSError:
+                time.sleep(0.1)
+        raise CommandError(f'Server did not start on port {port}.')
+
+    async def load(self, port, path, token, options):
+        host = next((h.lstrip('.') for h in settings.ALLOWED_HOSTS if h != '*'), 'localhost')
+        latencies = []
+        errors = 0
+        counter = iter(range(sys.maxsize))
+
+        async def request():
+            # A distinct URL per request bypasses the response cache. Each
+            # request has its own connection: gunicorn's sync workers close
+            # it after every response anyway.
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            try:
+                writer.write((
+                    f'GET {path}?bench={next(counter)} HTTP/1.1\r\nHost: {host}\r\n'
+                    f'Authorization: Bearer {token}\r\nConnection: close\r\n\r\n'
+                ).encode())
+                await writer.drain()
+                response = await reader.read()
+            finally:
+                writer.close()
+            return response.split(b' ', 2)[1] == b'200'
+
+        async def client(until):
+            nonlocal errors
+            while time.perf_counter() < until:
+                start = time.perf_counter()
+                try:
+                    ok = await request()
+                except OSError:
+                    ok = False
+                if ok:
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    errors += 1
+
+        await asyncio.gather(*(client(time.perf_counter() + 1) for _ in range(options['concurrency'])))
+        latencies.clear()
+        errors = 0
+        start = time.perf_counter()
+        until = start + options['duration']
+        await asyncio.gather(*(client(until) for _ in range(options['concurrency'])))
+        elapsed = time.perf_counter() - start
+        if not latencies:
+            raise CommandError(f'All {errors} request(s) failed.')
+        latencies.sort()
+        return (
+            len(latencies) / elapsed,
+            latencies[len(latencies) // 2],
+            latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+            errors,
+        )
@@ -0,0 +1,165 @@
+import random
+import re
+from datetime import timedelta
+from urllib.parse import parse_qs, urlparse
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from appointments.models import Appointment, AppointmentFeedback
+from appointments.views import AppointmentViewSet, AppointmentFeedbackViewSet
+
+User = get_user_model()
+
+# Plan lines that mean a table is read end to end.
+FULL_SCAN_PATTERNS = {
+    'sqlite': re.compile(r'\bSCAN (\w+)\b(?! USING| VIRTUAL TABLE)'),
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+}
+SORT_PATTERNS = {
+    'sqlite': re.compile(r'USE TEMP B-TREE FOR ORDER BY'),
+    'postgresql': re.compile(r'^\s*(?:->\s*)?Sort\b', re.MULTILINE),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway dataset, run EXPLAIN on the querysets built by the appointment "
+        "and feedback viewsets, and fail if any of them falls back to a full table scan."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctors', type=int, default=50)
+        parser.add_argument('--patients', type=int, default=1000)
+        parser.add_argument('--appointments', type=int, default=20000)
+        parser.add_argument('--no-seed', action='store_true', help='Explain against the existing data only.')
+        parser.add_argument('--keep', action='store_true', help='Keep the seeded rows instead of rolling them back.')
+        parser.add_argument('--strict', action='store_true', help='Also fail on plans that sort instead of reading an index in order.')
+
+    def handle(self, *args, **options):
+        vendor = connection.vendor
+        host = next((h.lstrip('.') for h in settings.ALLOWED_HOSTS if h != '*'), 'localhost')
+        self.factory = APIRequestFactory(HTTP_HOST=host)
+
+        with transaction.atomic():
+            if not options['no_seed']:
+                self.seed(options['doctors'], options['patients'], options['appointments'])
+            self.analyze()
+
+            problems = []
+            for name, viewset, user, params in self.scenarios():
+                plan = self.explain(viewset, user, params)
+                scans = self.full_scans(vendor, plan)
+                sorts = SORT_PATTERNS.get(vendor) and SORT_PATTERNS[vendor].search(plan)
+                if scans:
+                    problems.append(f"{name}: full scan of {', '.join(scans)}")
+                    label = self.style.ERROR('FULL SCAN')
+                elif sorts:
+                    if options['strict']:
+                        problems.append(f'{name}: sorts instead of reading an index in order')
+                    label = self.style.WARNING('SORT')
+                else:
+                    label = self.style.SUCCESS('OK')
+                self.stdout.write(f'[{label}] {name}')
+                if options['verbosity'] > 1:
+                    self.stdout.write(plan + '\n')
+
+            if not options['keep']:
+                transaction.set_rollback(True)
+
+        if problems:
+            raise CommandError('Query plan regressions:\n  ' + '\n  '.join(problems))
+
+    def seed(self, doctors, patients, appointments):
+        prefix = f'explain-{random.randrange(16 ** 6):06x}'
+        User.objects.bulk_create(
+            [User(username=f'{prefix}-doctor-{i}', email=f'{prefix}-doctor-{i}@example.com', password='!', is_doctor=True) for i in range(doctors)]
+            + [User(username=f'{prefix}-patient-{i}', email=f'{prefix}-patient-{i}@example.com', password='!', is_patient=True) for i in range(patients)],
+            batch_size=500,
+        )
+        doctor_ids = list(User.objects.filter(username__startswith=f'{prefix}-doctor-').values_list('id', flat=True))
+        patient_ids = list(User.objects.filter(username__startswith=f'{prefix}-patient-').values_list('id', flat=True))
+        self.sample_doctor = User.objects.get(pk=doctor_ids[0])
+        self.sample_patient = User.objects.get(pk=patient_ids[0])
+        self.sample_staff = User(username=f'{prefix}-staff', email=f'{prefix}-staff@example.com', password='!', is_staff=True)
+        self.sample_staff.save()
+
+        now = timezone.now()
+        statuses = [choice for choice, _ in Appointment.APPOINTMENT_STATUS]
+        rows = [
+            Appointment(
+                patient_id=random.choice(patient_ids),
+                doctor_id=random.choice(doctor_ids),
+                date_time=now + timedelta(minutes=30 * random.randrange(-20000, 20000)),
+                status=random.choice(statuses),
+            )
+            for _ in range(appointments)
+        ]
+        Appointment.objects.bulk_create(rows, batch_size=1000)
+        completed = Appointment.objects.filter(patient_id__in=patient_ids, status='COMPLETED').values_list('id', flat=True)
+        AppointmentFeedback.objects.bulk_create(
+            [AppointmentFeedback(appointment_id=pk, rating=random.randint(1, 5)) for pk in completed],
+            batch_size=1000,
+        )
+
+    def analyze(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def scenarios(self):
+        if not hasattr(self, 'sample_doctor'):
+            self.sample_doctor = User.objects.filter(is_doctor=True).first()
+            self.sample_patient = User.objects.filter(is_patient=True).first()
+            self.sample_staff = User.objects.filter(is_staff=True).first()
+        doctor, patient, staff = self.sample_doctor, self.sample_patient, self.sample_staff
+        if not (doctor and patient and staff):
+            raise CommandError('Need at least one doctor, patient and staff user; run without --no-seed.')
+
+        return [
+            ('appointment-list (patient history)', AppointmentViewSet, patient, {}),
+            ('appointment-list (patient history, deep page)', AppointmentViewSet, patient, {'_deep': True}),
+            ('appointment-list (doctor agenda)', AppointmentViewSet, doctor, {}),
+            ('appointment-list (doctor agenda, deep page)', AppointmentViewSet, doctor, {'_deep': True}),
+            ('appointment-list (doctor agenda, by status)', AppointmentViewSet, doctor, {'status': 'SCHEDULED'}),
+            ('appointment-list (staff)', AppointmentViewSet, staff, {}),
+            ('appointment-list (staff, deep page)', AppointmentViewSet, staff, {'_deep': True}),
+            ('appointment-list (staff, status sweep)', AppointmentViewSet, staff, {'status': 'SCHEDULED', 'ordering': 'date_time'}),
+            ('appointment-list (staff, search)', AppointmentViewSet, staff, {'search': 'scheduled'}),
+            ('appointment-list (patient, search)', AppointmentViewSet, patient, {'search': 'scheduled'}),
+            ('appointmentfeedback-list (patient)', AppointmentFeedbackViewSet, patient, {}),
+            ('appointmentfeedback-list (doctor)', AppointmentFeedbackViewSet, doctor, {}),
+            ('appointmentfeedback-list (staff)', AppointmentFeedbackViewSet, staff, {}),
+        ]
+
+    def build_page_queryset(self, viewset, user, params):
+        request = Request(self.factory.get('/', params))
+        request.user = user
+        view = viewset(request=request, format_kwarg=None, action='list', args=(), kwargs={})
+        queryset = view.filter_queryset(view.get_queryset())
+        return view, request, queryset, view.paginator.get_page_queryset(queryset, request, view)
+
+    def explain(self, viewset, user, params):
+        params = dict(params)
+        deep = params.pop('_deep', False)
+        view, request, queryset, page = self.build_page_queryset(viewset, user, params)
+        if deep:
+            # Seek from a row in the middle of the result set.
+            paginator = view.paginator
+            middle = queryset.order_by(*paginator.sort_key)[queryset.count() // 2:][:1]
+            paginator.page = list(middle) or list(page[:1])
+            paginator.has_more = True
+            if paginator.page:
+                cursor = parse_qs(urlparse(paginator.get_next_link()).query)['cursor'][0]
+                _, _, _, page = self.build_page_queryset(viewset, user, {**params, 'cursor': cursor})
+        return page.explain()
+
+    def full_scans(self, vendor, plan):
+        pattern = FULL_SCAN_PATTERNS.get(vendor)
+        if pattern is None:
+            return []
+        return sorted({match.group(1) for match in pattern.finditer(plan)})
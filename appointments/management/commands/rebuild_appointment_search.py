@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from appointments.models import Appointment
+from appointments.search import install_search_index, refresh_search_text
+
+
+class Command(BaseCommand):
+    help = "Recompute Appointment.search_text and (re)create the full-text search index."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = refresh_search_text(Appointment.objects.all())
+            install_search_index(connection)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt the search index over {count} appointment(s).'))
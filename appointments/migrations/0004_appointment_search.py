@@ -0,0 +1,43 @@
+from django.db import migrations, models
+
+from appointments.search import drop_search_index, install_search_index
+
+
+def backfill_search_text(apps, schema_editor):
+    Appointment = apps.get_model('appointments', 'Appointment')
+    queryset = Appointment.objects.using(schema_editor.connection.alias).select_related('doctor', 'patient').order_by('pk')
+    last_pk = 0
+    while True:
+        batch = list(queryset.filter(pk__gt=last_pk)[:1000])
+        if not batch:
+            break
+        for appointment in batch:
+            parts = [appointment.status, appointment.doctor.username, appointment.patient.username, appointment.notes]
+            appointment.search_text = ' '.join(filter(None, parts))
+        Appointment.objects.using(schema_editor.connection.alias).bulk_update(batch, ['search_text'])
+        last_pk = batch[-1].pk
+
+
+def create_index(apps, schema_editor):
+    install_search_index(schema_editor.connection)
+
+
+def remove_index(apps, schema_editor):
+    drop_search_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0003_doctor_rating_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='search_text',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(backfill_search_text, migrations.RunPython.noop),
+        migrations.RunPython(create_index, remove_index),
+    ]
@@ -1,6 +1,19 @@
 from django.db import models
 from django.conf import settings
 
+class AppointmentQuerySet(models.QuerySet):
+    def with_participants(self):
+        """
+        Join both participants and their role profiles so that serializing a
+        page of appointments costs a single query regardless of its size.
+        """
+        return self.select_related(
+            'patient__patient_profile',
+            'patient__doctor_profile',
+            'doctor__doctor_profile',
+            'doctor__patient_profile',
+        )
+
 class Appointment(models.Model):
     APPOINTMENT_STATUS = (
         ('SCHEDULED', 'Scheduled'),
@@ -8,13 +21,48 @@ class Appointment(models.Model):
         ('CANCELLED', 'Cancelled'),
     )
 
-    patient = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='patient_appointments')
-    doctor = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='doctor_appointments')
+    # The composite indexes in Meta lead with these columns, so the implicit
+    # single-column FK indexes would only add write cost.
+    patient = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='patient_appointments', db_index=False)
+    doctor = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='doctor_appointments', db_index=False)
     date_time = models.DateTimeField()
     status = models.CharField(max_length=20, choices=APPOINTMENT_STATUS, default='SCHEDULED')
     notes = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Status, participant usernames and notes in one column, indexed for
+    # full-text search (see appointments/search.py).
+    search_text = models.TextField(blank=True, default='', editable=False)
+
+    objects = AppointmentQuerySet.as_manager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remembered so signal handlers can tell when the doctor changes.
+        instance._loaded_doctor_id = instance.__dict__.get('doctor_id')
+        return instance
+
+    class Meta:
+        indexes = [
+            # Doctor agenda and patient history, in keyset pagination order.
+            models.Index(fields=['doctor', 'date_time', 'id'], name='appointment_doctor_agenda_idx'),
+            models.Index(fields=['patient', 'date_time', 'id'], name='appointment_patient_hist_idx'),
+            # Status sweeps (e.g. upcoming SCHEDULED appointments).
+            models.Index(fields=['status', 'date_time'], name='appointment_status_date_idx'),
+            # Staff listing across all appointments.
+            models.Index(fields=['date_time', 'id'], name='appointment_date_time_idx'),
+        ]
+
+    def build_search_text(self):
+        return ' '.join(filter(None, [self.status, self.doctor.username, self.patient.username, self.notes]))
+
+    def save(self, *args, **kwargs):
+        self.search_text = self.build_search_text()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'search_text' not in update_fields:
+            kwargs['update_fields'] = [*update_fields, 'search_text']
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"Appointment with Dr. {self.doctor.username} for {self.patient.username} on {self.date_time}"
@@ -25,6 +73,47 @@ class AppointmentFeedback(models.Model):
     comment = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='feedback_created_at_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remembered so signal handlers can move the rating when it changes.
+        instance._loaded_rating = instance.__dict__.get('rating')
+        instance._loaded_appointment_id = instance.__dict__.get('appointment_id')
+        return instance
+
     def __str__(self):
         return f"Feedback for appointment {self.appointment.id}"
 
+class DoctorRatingStats(models.Model):
+    """
+    Running rating totals per doctor, maintained from AppointmentFeedback
+    signals so that averages never need an aggregate over the feedback table.
+    """
+    doctor = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='rating_stats')
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def average_rating(self):
+        if not self.rating_count:
+            return None
+        return self.rating_sum / self.rating_count
+
+    @property
+    def histogram(self):
+        return {rating: getattr(self, f'rating_{rating}') for rating in range(1, 6)}
+
+    def __str__(self):
+        return f"Rating stats for Dr. {self.doctor_id}"
+
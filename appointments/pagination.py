@@ -0,0 +1,214 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+from datetime import date, datetime
+from operator import attrgetter
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination that seeks on a unique, composite sort key.
+
+    The cursor carries the sort-key values of the row at the page boundary,
+    so every page is a range scan on an index instead of an OFFSET scan, and
+    no COUNT(*) is ever issued. The primary key is always appended to the
+    ordering as a tie-breaker, which keeps pages stable under OrderingFilter.
+    Ordering fields must be non-nullable.
+    """
+    cursor_query_param = 'cursor'
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ordering = ('date_time', 'id')
+    # Annotation added by a ranking search filter; results are ordered by it
+    # when the client did not ask for an explicit ordering.
+    rank_field = 'search_rank'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.set_page(list(self.get_page_queryset(queryset, request, view)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        return self.set_page([obj async for obj in self.get_page_queryset(queryset, request, view)])
+
+    def set_page(self, results):
+        self.has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if self.reverse:
+            results.reverse()
+        self.page = results
+        return results
+
+    def get_page_queryset(self, queryset, request, view=None):
+        """
+        Return the unevaluated, sliced queryset for the requested page.
+        Fetches one extra row so the presence of a next page is known
+        without counting.
+        """
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        self.sort_key = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+
+        self.reverse = False
+        if self.cursor is not None:
+            self.reverse = self.cursor['reverse']
+            values = self.clean_cursor_values(queryset, self.cursor['values'])
+            queryset = queryset.filter(self.seek_filter(values, self.reverse))
+
+        order_by = self.sort_key
+        if self.reverse:
+            order_by = [self.invert(field) for field in order_by]
+        return queryset.order_by(*order_by)[:self.page_size + 1]
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                size = int(request.query_params[self.page_size_query_param])
+                if size > 0:
+                    return min(size, self.max_page_size)
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    def get_ordering(self, request, queryset, view):
+        ordering = None
+        ordering_filters = [
+            backend for backend in getattr(view, 'filter_backends', [])
+            if hasattr(backend, 'get_ordering')
+        ]
+        if ordering_filters:
+            ordering = ordering_filters[0]().get_ordering(request, queryset, view)
+        if not ordering and self.rank_field in queryset.query.annotations:
+            ordering = [f'-{self.rank_field}']
+
+        sort_key = []
+        for field in ordering or self.ordering:
+            sort_key.append(field)
+            if field.lstrip('-') in ('id', 'pk'):
+                return sort_key
+        sort_key.append('-id' if sort_key[-1].startswith('-') else 'id')
+        return sort_key
+
+    @staticmethod
+    def invert(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    def seek_filter(self, values, reverse):
+        """
+        Build `(a, b, id) > (x, y, z)` as an OR of prefix equalities, honoring
+        the direction of each ordering field. The redundant inclusive bound on
+        the leading field gives the planner an index range to seek on.
+        """
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.sort_key, values):
+            name = field.lstrip('-')
+            descending = field.startswith('-') != reverse
+            lookup = f'{name}__lt' if descending else f'{name}__gt'
+            condition |= Q(**equal, **{lookup: value})
+            equal[name] = value
+        leading = self.sort_key[0]
+        descending = leading.startswith('-') != reverse
+        bound = f"{leading.lstrip('-')}__{'lte' if descending else 'gte'}"
+        return Q(**{bound: values[0]}) & condition
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            padded = encoded + '=' * (-len(encoded) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+            cursor = {'reverse': bool(payload['r']), 'values': list(payload['v'])}
+            ordering = list(payload['o'])
+        except (TypeError, ValueError, KeyError, UnicodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if ordering != self.sort_key or len(cursor['values']) != len(self.sort_key):
+            raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    @staticmethod
+    def sort_field(queryset, name):
+        """The model field or annotation output field that `name` sorts on."""
+        if name in queryset.query.annotations:
+            return queryset.query.annotations[name].output_field
+        model, field = queryset.model, None
+        for part in name.split('__'):
+            field = model._meta.get_field('id' if part == 'pk' else part)
+            model = field.related_model or model
+        return field
+
+    def clean_cursor_values(self, queryset, values):
+        """Convert cursor values to their fields' types; a tampered cursor is a 404."""
+        cleaned = []
+        for field, value in zip(self.sort_key, values):
+            try:
+                value = self.sort_field(queryset, field.lstrip('-')).to_python(value)
+            except (ValidationError, TypeError, ValueError, FieldDoesNotExist):
+                raise NotFound(self.invalid_cursor_message)
+            if value is None:
+                raise NotFound(self.invalid_cursor_message)
+            cleaned.append(value)
+        return cleaned
+
+    def encode_cursor(self, obj, reverse):
+        values = []
+        for field in self.sort_key:
+            value = attrgetter(field.lstrip('-').replace('__', '.'))(obj)
+            if isinstance(value, (datetime, date)):
+                value = value.isoformat()
+            values.append(value)
+        payload = json.dumps({'o': self.sort_key, 'v': values, 'r': int(reverse)}, separators=(',', ':'))
+        encoded = base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        has_next = self.has_more if not self.reverse else True
+        if not has_next:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        has_previous = self.has_more if self.reverse else self.cursor is not None
+        if not has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class AppointmentPagination(KeysetPagination):
+    ordering = ('date_time', 'id')
+
+
+class AppointmentFeedbackPagination(KeysetPagination):
+    ordering = ('created_at', 'id')
@@ -0,0 +1,76 @@
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+
+from users.directory import invalidate_directory
+from .models import AppointmentFeedback, DoctorRatingStats
+
+
+def adjust_rating(doctor_id, rating, delta):
+    """
+    Add (delta=1) or remove (delta=-1) one rating from a doctor's running
+    totals. Uses F() expressions so concurrent writers never lose updates.
+    """
+    changes = {
+        'rating_count': F('rating_count') + delta,
+        'rating_sum': F('rating_sum') + delta * rating,
+        f'rating_{rating}': F(f'rating_{rating}') + delta,
+    }
+    with transaction.atomic(savepoint=False):
+        # Removals never create a row: the stats may already be gone because
+        # the doctor is being deleted.
+        if not DoctorRatingStats.objects.filter(doctor_id=doctor_id).update(**changes) and delta > 0:
+            DoctorRatingStats.objects.get_or_create(doctor_id=doctor_id)
+            DoctorRatingStats.objects.filter(doctor_id=doctor_id).update(**changes)
+
+
+def move_rating(old_doctor_id, old_rating, new_doctor_id, new_rating):
+    if (old_doctor_id, old_rating) == (new_doctor_id, new_rating):
+        return
+    if old_doctor_id == new_doctor_id:
+        DoctorRatingStats.objects.filter(doctor_id=new_doctor_id).update(**{
+            'rating_sum': F('rating_sum') + new_rating - old_rating,
+            f'rating_{old_rating}': F(f'rating_{old_rating}') - 1,
+            f'rating_{new_rating}': F(f'rating_{new_rating}') + 1,
+        })
+        return
+    with transaction.atomic(savepoint=False):
+        adjust_rating(old_doctor_id, old_rating, -1)
+        adjust_rating(new_doctor_id, new_rating, 1)
+
+
+def get_rating_stats(doctor_ids):
+    """Stats for each requested doctor id, with empty totals for unrated doctors."""
+    found = DoctorRatingStats.objects.in_bulk(doctor_ids)
+    return [found.get(doctor_id) or DoctorRatingStats(doctor_id=doctor_id) for doctor_id in doctor_ids]
+
+
+async def aget_rating_stats(doctor_ids):
+    found = await DoctorRatingStats.objects.ain_bulk(doctor_ids)
+    return [found.get(doctor_id) or DoctorRatingStats(doctor_id=doctor_id) for doctor_id in doctor_ids]
+
+
+def rebuild_rating_stats(doctor_ids=None):
+    """
+    Recompute the running totals from AppointmentFeedback. Returns the
+    number of doctors with at least one rating.
+    """
+    feedback = AppointmentFeedback.objects.all()
+    if doctor_ids is not None:
+        feedback = feedback.filter(appointment__doctor_id__in=doctor_ids)
+    totals = feedback.values('appointment__doctor_id').annotate(
+        rating_count=Count('id'),
+        rating_sum=Sum('rating'),
+        **{f'rating_{rating}': Count('id', filter=Q(rating=rating)) for rating in range(1, 6)},
+    )
+    rows = [
+        DoctorRatingStats(doctor_id=row.pop('appointment__doctor_id'), **row)
+        for row in totals
+    ]
+    with transaction.atomic():
+        stale = DoctorRatingStats.objects.all()
+        if doctor_ids is not None:
+            stale = stale.filter(doctor_id__in=doctor_ids)
+        stale.delete()
+        DoctorRatingStats.objects.bulk_create(rows, batch_size=1000)
+        invalidate_directory()
+    return len(rows)
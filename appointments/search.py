@@ -0,0 +1,139 @@
+"""
+Full-text search over Appointment.search_text.
+
+On SQLite the column is mirrored into an external-content FTS5 table kept in
+sync by triggers. On PostgreSQL it carries a GIN index on its tsvector for
+word matches and a trigram index for substring matches. Other backends fall
+back to a case-insensitive substring scan.
+
+The index is created by migration 0004. SQLite drops triggers when Django
+rebuilds a table, so after a migration that alters the appointments table
+there, run `manage.py rebuild_appointment_search`.
+"""
+import re
+
+from django.db import connections
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast
+from rest_framework import filters
+
+FTS_TABLE = 'appointments_appointment_fts'
+RANK_FIELD = 'search_rank'
+BATCH_SIZE = 1000
+
+SQLITE_INDEX = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    f"search_text, content='appointments_appointment', content_rowid='id')",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON appointments_appointment BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, search_text) VALUES (new.id, new.search_text); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON appointments_appointment BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_text) VALUES ('delete', old.id, old.search_text); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF search_text ON appointments_appointment BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_text) VALUES ('delete', old.id, old.search_text); "
+    f"INSERT INTO {FTS_TABLE}(rowid, search_text) VALUES (new.id, new.search_text); END",
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+SQLITE_DROP = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ai",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+# The index expressions must match what the queries below compile to:
+# SearchVector(..., config='simple') and the UPPER() that icontains uses.
+POSTGRESQL_INDEX = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS appointment_search_fts_idx ON appointments_appointment "
+    "USING gin (to_tsvector('simple'::regconfig, COALESCE(search_text, '')))",
+    "CREATE INDEX IF NOT EXISTS appointment_search_trgm_idx ON appointments_appointment "
+    "USING gin (UPPER(search_text) gin_trgm_ops)",
+]
+POSTGRESQL_DROP = [
+    "DROP INDEX IF EXISTS appointment_search_fts_idx",
+    "DROP INDEX IF EXISTS appointment_search_trgm_idx",
+]
+
+
+def install_search_index(connection):
+    statements = {'sqlite': SQLITE_INDEX, 'postgresql': POSTGRESQL_INDEX}.get(connection.vendor, [])
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def drop_search_index(connection):
+    statements = {'sqlite': SQLITE_DROP, 'postgresql': POSTGRESQL_DROP}.get(connection.vendor, [])
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def refresh_search_text(queryset):
+    """Recompute search_text for the given appointments in batches."""
+    from .models import Appointment
+
+    updated = 0
+    queryset = queryset.select_related('doctor', 'patient').order_by('pk')
+    last_pk = 0
+    while True:
+        batch = list(queryset.filter(pk__gt=last_pk)[:BATCH_SIZE])
+        if not batch:
+            return updated
+        for appointment in batch:
+            appointment.search_text = appointment.build_search_text()
+        Appointment.objects.bulk_update(batch, ['search_text'])
+        updated += len(batch)
+        last_pk = batch[-1].pk
+
+
+def search_terms(text):
+    return re.findall(r'\w+', text.lower())
+
+
+def search_appointments(queryset, text, rank=True):
+    """
+    Filter queryset to appointments matching every word of text as a prefix.
+    With rank=True the rows are annotated with search_rank (higher is better).
+    """
+    terms = search_terms(text)
+    if not terms:
+        return queryset
+
+    vendor = connections[queryset.db].vendor
+    table = queryset.model._meta.db_table
+    if vendor == 'sqlite':
+        match = ' '.join(f'"{term}"*' for term in terms)
+        queryset = queryset.filter(pk__in=RawSQL(f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s', [match]))
+        if rank:
+            queryset = queryset.annotate(**{RANK_FIELD: RawSQL(
+                f'SELECT -bm25({FTS_TABLE}) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s AND rowid = "{table}"."id"',
+                [match], output_field=FloatField(),
+            )})
+        return queryset
+
+    if vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+
+        vector = SearchVector('search_text', config='simple')
+        query = SearchQuery(' & '.join(f'{term}:*' for term in terms), config='simple', search_type='raw')
+        queryset = queryset.alias(search_vector=vector).filter(
+            Q(search_vector=query) | Q(search_text__icontains=' '.join(terms))
+        )
+        if rank:
+            # float8 so that cursor values round-trip exactly through JSON.
+            queryset = queryset.annotate(**{RANK_FIELD: Cast(SearchRank(vector, query), FloatField())})
+        return queryset
+
+    for term in terms:
+        queryset = queryset.filter(search_text__icontains=term)
+    if rank:
+        queryset = queryset.annotate(**{RANK_FIELD: Value(0.0, output_field=FloatField())})
+    return queryset
+
+
+class AppointmentSearchFilter(filters.SearchFilter):
+    """SearchFilter backed by the search index instead of icontains joins."""
+    def filter_queryset(self, request, queryset, view):
+        return search_appointments(queryset, request.query_params.get(self.search_param, ''))
@@ -1,14 +1,17 @@
+from django.db import transaction
 from rest_framework import serializers
 from .models import Appointment, AppointmentFeedback
+from .availability import SlotConflict, ensure_slot_available
 from users.serializers import UserSerializer
+from config.timing import TimedSerializerMixin
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
 
-class AppointmentSerializer(serializers.ModelSerializer):
+class AppointmentSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     patient = UserSerializer(read_only=True)
     doctor = UserSerializer(read_only=True)
-    doctor_id = serializers.PrimaryKeyRelatedField(source='doctor', queryset=User.objects.filter(is_doctor=True), write_only=True)
+    doctor_id = serializers.PrimaryKeyRelatedField(source='doctor', queryset=User.objects.filter(is_doctor=True).select_related('doctor_profile', 'patient_profile'), write_only=True)
 
     class Meta:
         model = Appointment
@@ -18,9 +21,42 @@ class AppointmentSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         doctor = validated_data.pop('doctor')
         patient = self.context['request'].user
-        return Appointment.objects.create(doctor=doctor, patient=patient, **validated_data)
+        with transaction.atomic():
+            # A cancelled appointment does not hold its slot.
+            if validated_data.get('status') != 'CANCELLED':
+                self.check_availability(doctor.pk, validated_data['date_time'])
+            return Appointment.objects.create(doctor=doctor, patient=patient, **validated_data)
 
-class AppointmentFeedbackSerializer(serializers.ModelSerializer):
+    def update(self, instance, validated_data):
+        doctor_id = validated_data['doctor'].pk if 'doctor' in validated_data else instance.doctor_id
+        date_time = validated_data.get('date_time', instance.date_time)
+        status = validated_data.get('status', instance.status)
+        # Only a move or a reactivation claims a slot the appointment did not hold.
+        claims_slot = status != 'CANCELLED' and (
+            instance.status == 'CANCELLED' or doctor_id != instance.doctor_id or date_time != instance.date_time
+        )
+        # Atomic as well so that the notification commits with the change.
+        with transaction.atomic():
+            if claims_slot:
+                self.check_availability(doctor_id, date_time, exclude=[instance.pk])
+            return super().update(instance, validated_data)
+
+    def check_availability(self, doctor_id, date_time, exclude=None):
+        try:
+            ensure_slot_available(doctor_id, date_time, exclude=exclude)
+        except SlotConflict as e:
+            raise serializers.ValidationError({'date_time': str(e)})
+
+class BulkAppointmentCreateSerializer(serializers.Serializer):
+    doctor_id = serializers.IntegerField()
+    date_time = serializers.DateTimeField()
+    notes = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+
+class BulkAppointmentRescheduleSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    new_date_time = serializers.DateTimeField()
+
+class AppointmentFeedbackSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = AppointmentFeedback
         fields = ['id', 'appointment', 'rating', 'comment', 'created_at']
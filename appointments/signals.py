@@ -1,28 +1,127 @@
 
+import functools
+import logging
+
 from django.db.models.signals import post_save, post_delete
+from django.db.models import Q
 from django.dispatch import receiver
-from django.core.mail import send_mail
-from django.conf import settings
-from .models import Appointment
+from notifications.outbox import enqueue_emails
+from .models import Appointment, AppointmentFeedback
+from .ratings import adjust_rating, move_rating
+from . import cache as response_cache
+from .search import refresh_search_text
+from users.models import PatientProfile, DoctorProfile
+from users.directory import invalidate_directory
+from django.contrib.auth import get_user_model
 from django.utils import timezone
+from config.metrics import SIGNAL_FAILURES
+
+User = get_user_model()
+
+logger = logging.getLogger(__name__)
+
 
+def counted_failures(handler):
+    """Count the exceptions a receiver raises in the signal failure metric."""
+    @functools.wraps(handler)
+    def wrapper(*args, **kwargs):
+        try:
+            return handler(*args, **kwargs)
+        except Exception:
+            SIGNAL_FAILURES.labels(handler.__name__).inc()
+            raise
+    return wrapper
+
+
+def appointment_notification(instance, created):
+    """Email to the patient about a new or changed appointment."""
+    subject = 'New Appointment Scheduled' if created else 'Appointment Updated'
+    date_time_str = instance.date_time.strftime('%Y-%m-%d at %H:%M') if isinstance(instance.date_time, timezone.datetime) else str(instance.date_time)
+    message = (
+        f"{'An appointment has been scheduled' if created else 'Your appointment has been updated'} "
+        f"with Dr. {instance.doctor.username} on {date_time_str}."
+    )
+    return {'subject': subject, 'message': message, 'recipient_list': [instance.patient.email]}
+
+# Registered before appointment_doctor_changed, which resets _loaded_doctor_id.
 @receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+@counted_failures
+def appointment_invalidate_cache(sender, instance, **kwargs):
+    doctor_ids = {instance.doctor_id, getattr(instance, '_loaded_doctor_id', None)}
+    response_cache.bump_on_commit(response_cache.appointment_scopes([instance.patient_id], doctor_ids))
+
+@receiver(post_save, sender=Appointment)
+@counted_failures
 def appointment_created_or_updated(sender, instance, created, **kwargs):
     if instance.patient and instance.patient.email:
-        subject = 'New Appointment Scheduled' if created else 'Appointment Updated'
-        date_time_str = instance.date_time.strftime('%Y-%m-%d at %H:%M') if isinstance(instance.date_time, timezone.datetime) else str(instance.date_time)
-        message = (
-            f"{'An appointment has been scheduled' if created else 'Your appointment has been updated'} "
-            f"with Dr. {instance.doctor.username} on {date_time_str}."
-        )
-        send_mail(
-            subject=subject,
-            message=message,
-            from_email=settings.DEFAULT_FROM_EMAIL,
-            recipient_list=[instance.patient.email],
-            fail_silently=False,
-        )
-        print(f"Appointment {'created' if created else 'updated'}: {instance}")
+        enqueue_emails([appointment_notification(instance, created)])
+        logger.info(f"Appointment {'created' if created else 'updated'}: {instance}")
     else:
-        print(f"Appointment notification failed due to missing user or email: {instance}")
+        logger.warning(f"Appointment notification skipped, the patient has no email: {instance}")
+
+@receiver(post_save, sender=Appointment)
+@counted_failures
+def appointment_doctor_changed(sender, instance, created, **kwargs):
+    previous_doctor_id = getattr(instance, '_loaded_doctor_id', None)
+    if created or previous_doctor_id in (None, instance.doctor_id):
+        return
+    rating = AppointmentFeedback.objects.filter(appointment=instance).values_list('rating', flat=True).first()
+    if rating is not None:
+        move_rating(previous_doctor_id, rating, instance.doctor_id, rating)
+    instance._loaded_doctor_id = instance.doctor_id
+
+@receiver(post_save, sender=AppointmentFeedback)
+@counted_failures
+def feedback_saved(sender, instance, created, **kwargs):
+    doctor_id = instance.appointment.doctor_id
+    previous_rating = getattr(instance, '_loaded_rating', None)
+    if created:
+        adjust_rating(doctor_id, instance.rating, 1)
+    elif previous_rating is not None:
+        previous_doctor_id = doctor_id
+        if instance._loaded_appointment_id != instance.appointment_id:
+            previous_doctor_id = Appointment.objects.values_list('doctor_id', flat=True).get(pk=instance._loaded_appointment_id)
+        move_rating(previous_doctor_id, previous_rating, doctor_id, instance.rating)
+    instance._loaded_rating = instance.rating
+    instance._loaded_appointment_id = instance.appointment_id
+
+@receiver(post_delete, sender=AppointmentFeedback)
+@counted_failures
+def feedback_deleted(sender, instance, **kwargs):
+    rating = getattr(instance, '_loaded_rating', None) or instance.rating
+    adjust_rating(instance.appointment.doctor_id, rating, -1)
+
+@receiver(post_save, sender=AppointmentFeedback)
+@receiver(post_delete, sender=AppointmentFeedback)
+@counted_failures
+def feedback_invalidate_cache(sender, instance, **kwargs):
+    appointment = instance.appointment
+    response_cache.bump_on_commit(response_cache.appointment_scopes([appointment.patient_id], [appointment.doctor_id]))
+    # The directory shows rating totals.
+    invalidate_directory()
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=PatientProfile)
+@receiver(post_save, sender=DoctorProfile)
+@receiver(post_delete, sender=PatientProfile)
+@receiver(post_delete, sender=DoctorProfile)
+@counted_failures
+def participant_invalidate_cache(sender, instance, created=False, update_fields=None, **kwargs):
+    """
+    Appointment payloads embed both participants, so a change to an existing
+    user or profile invalidates the cached responses of the appointments they
+    take part in. New users cannot appear in cached payloads yet, and
+    last_login is not serialized.
+    """
+    if created or (update_fields and set(update_fields) <= {'last_login'}):
+        return
+    response_cache.invalidate_participant(instance.pk if sender is User else instance.user_id)
 
+@receiver(post_save, sender=User)
+@counted_failures
+def user_renamed(sender, instance, created, **kwargs):
+    previous_username = getattr(instance, '_loaded_username', None)
+    if not created and previous_username not in (None, instance.username):
+        refresh_search_text(Appointment.objects.filter(Q(patient=instance) | Q(doctor=instance)))
+    instance._loaded_username = instance.username
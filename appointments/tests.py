@@ -1,12 +1,22 @@
-from django.test import TestCase
+import base64
+import io
+import json
+from django.core.management import call_command
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from rest_framework.test import APITestCase
 from rest_framework import status
-from .models import Appointment, AppointmentFeedback
+from .models import Appointment, AppointmentFeedback, DoctorRatingStats
+from notifications.models import OutboundEmail
+from . import cache as response_cache
 from .serializers import AppointmentSerializer, AppointmentFeedbackSerializer
 from datetime import datetime, timedelta
+from urllib.parse import parse_qs, urlparse
 from django.utils import timezone
+from unittest.mock import patch
+from prometheus_client import REGISTRY
 
 User = get_user_model()
 
@@ -31,6 +41,22 @@ class AppointmentModelTests(TestCase):
         self.appointment.save()
         self.assertEqual(self.appointment.status, 'COMPLETED')
 
+    def test_signal_failures_are_counted(self):
+        def failures(receiver):
+            return REGISTRY.get_sample_value('appointment_signal_failures_total', {'receiver': receiver}) or 0
+
+        notified, rated = failures('appointment_created_or_updated'), failures('feedback_saved')
+        User.objects.filter(pk=self.patient.pk).update(email='')
+        self.appointment.refresh_from_db()
+        # A patient without an email is skipped, which is not a failure.
+        with self.assertLogs('appointments.signals', 'WARNING'):
+            self.appointment.save()
+        with patch('appointments.signals.adjust_rating', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                AppointmentFeedback.objects.create(appointment=self.appointment, rating=5)
+        self.assertEqual(failures('appointment_created_or_updated') - notified, 0)
+        self.assertEqual(failures('feedback_saved') - rated, 1)
+
 class AppointmentFeedbackModelTests(TestCase):
     def setUp(self):
         self.patient = User.objects.create_user(username='patient', email='patient@example.com', password='testpass123', is_patient=True)
@@ -116,7 +142,7 @@ class AppointmentViewSetTests(APITestCase):
         url = reverse('appointment-list')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
 
     def test_create_appointment(self):
         url = reverse('appointment-list')
@@ -193,7 +219,7 @@ class AppointmentFeedbackViewSetTests(APITestCase):
         url = reverse('appointmentfeedback-list')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
 
     def test_doctor_average_rating(self):
         AppointmentFeedback.objects.create(
@@ -206,3 +232,830 @@ class AppointmentFeedbackViewSetTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['average_rating'], 5.0)
 
+
+class AppointmentQueryCountTests(APITestCase):
+    """
+    Query budgets for every appointment and feedback action. List and
+    retrieve must not grow with the number of rows on the page.
+    """
+    def setUp(self):
+        self.patient = User.objects.create_user(username='patient', email='patient@example.com', password='testpass123', is_patient=True)
+        self.doctor = User.objects.create_user(username='doctor', email='doctor@example.com', password='testpass123', is_doctor=True)
+        self.staff = User.objects.create_user(username='staff', email='staff@example.com', password='testpass123', is_staff=True)
+        self.appointment = self.create_appointment(days=1)
+        self.patient = User.objects.get(pk=self.patient.pk)
+        self.client.force_authenticate(user=self.patient)
+
+    def create_appointment(self, days, patient=None):
+        return Appointment.objects.create(
+            patient=patient or self.patient,
+            doctor=self.doctor,
+            date_time=timezone.now() + timedelta(days=days),
+            status='SCHEDULED'
+        )
+
+    def create_feedback(self, appointment=None, rating=5):
+        return AppointmentFeedback.objects.create(appointment=appointment or self.appointment, rating=rating)
+
+    def test_list_query_count_is_constant(self):
+        url = reverse('appointment-list')
+        with self.assertNumQueries(1):
+            self.client.get(url)
+        for days in range(2, 12):
+            self.create_appointment(days=days)
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_staff_list_query_count_is_constant(self):
+        other = User.objects.create_user(username='other', email='other@example.com', password='testpass123', is_patient=True)
+        for days in range(2, 12):
+            self.create_appointment(days=days, patient=other)
+        self.client.force_authenticate(user=self.staff)
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('appointment-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_retrieve_query_count(self):
+        url = reverse('appointment-detail', kwargs={'pk': self.appointment.pk})
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_create_query_count(self):
+        data = {
+            'doctor_id': self.doctor.id,
+            'date_time': (timezone.now() + timedelta(days=2)).isoformat(),
+        }
+        with self.assertNumQueries(7):
+            response = self.client.post(reverse('appointment-list'), data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_update_query_count(self):
+        self.client.force_authenticate(user=self.doctor)
+        url = reverse('appointment-detail', kwargs={'pk': self.appointment.pk})
+        data = {
+            'doctor_id': self.doctor.id,
+            'date_time': (timezone.now() + timedelta(days=2)).isoformat(),
+            'status': 'SCHEDULED',
+            'notes': 'Bring previous results',
+        }
+        with self.assertNumQueries(7):
+            response = self.client.put(url, data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_partial_update_query_count(self):
+        self.client.force_authenticate(user=self.doctor)
+        url = reverse('appointment-detail', kwargs={'pk': self.appointment.pk})
+        with self.assertNumQueries(5):
+            response = self.client.patch(url, {'notes': 'Fasting required'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_destroy_query_count(self):
+        self.client.force_authenticate(user=self.doctor)
+        url = reverse('appointment-detail', kwargs={'pk': self.appointment.pk})
+        with self.assertNumQueries(3):
+            response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_cancel_query_count(self):
+        url = reverse('appointment-cancel', kwargs={'pk': self.appointment.pk})
+        with self.assertNumQueries(5):
+            response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_reschedule_query_count(self):
+        url = reverse('appointment-reschedule', kwargs={'pk': self.appointment.pk})
+        data = {'new_date_time': (timezone.now() + timedelta(days=3)).isoformat()}
+        with self.assertNumQueries(6):
+            response = self.client.post(url, data)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_feedback_list_query_count_is_constant(self):
+        self.create_feedback()
+        url = reverse('appointmentfeedback-list')
+        with self.assertNumQueries(1):
+            self.client.get(url)
+        for days in range(2, 12):
+            self.create_feedback(appointment=self.create_appointment(days=days))
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_feedback_retrieve_query_count(self):
+        feedback = self.create_feedback()
+        url = reverse('appointmentfeedback-detail', kwargs={'pk': feedback.pk})
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_feedback_create_query_count(self):
+        # The doctor already has ratings, so their stats row exists.
+        self.create_feedback(appointment=self.create_appointment(days=5))
+        data = {'appointment': self.appointment.id, 'rating': 4}
+        with self.assertNumQueries(6):
+            response = self.client.post(reverse('appointmentfeedback-list'), data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_feedback_update_query_count(self):
+        feedback = self.create_feedback()
+        url = reverse('appointmentfeedback-detail', kwargs={'pk': feedback.pk})
+        with self.assertNumQueries(7):
+            response = self.client.put(url, {'appointment': self.appointment.id, 'rating': 3})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_feedback_partial_update_query_count(self):
+        feedback = self.create_feedback()
+        url = reverse('appointmentfeedback-detail', kwargs={'pk': feedback.pk})
+        with self.assertNumQueries(6):
+            response = self.client.patch(url, {'rating': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_feedback_destroy_query_count(self):
+        feedback = self.create_feedback()
+        url = reverse('appointmentfeedback-detail', kwargs={'pk': feedback.pk})
+        with self.assertNumQueries(6):
+            response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_doctor_average_rating_query_count(self):
+        self.create_feedback()
+        url = reverse('appointmentfeedback-doctor-average-rating')
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'doctor_id': self.doctor.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+class AppointmentPaginationTests(APITestCase):
+    def setUp(self):
+        self.patient = User.objects.create_user(username='patient', email='patient@example.com', password='testpass123', is_patient=True)
+        self.doctor = User.objects.create_user(username='doctor', email='doctor@example.com', password='testpass123', is_doctor=True)
+        self.start = timezone.now() + timedelta(days=1)
+        self.appointments = [
+            Appointment.objects.create(
+                patient=self.patient,
+                doctor=self.doctor,
+                # Pairs of identical date_times exercise the id tie-breaker.
+                date_time=self.start + timedelta(hours=i // 2),
+                status='CANCELLED' if i % 3 == 0 else 'SCHEDULED'
+            )
+            for i in range(7)
+        ]
+        self.client.force_authenticate(user=self.patient)
+
+    def collect(self, params, link='next'):
+        ids, url, pages = [], reverse('appointment-list'), 0
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids.extend(item['id'] for item in response.data['results'])
+            pages += 1
+            if not response.data[link]:
+                return ids, pages, response
+            response = self.client.get(response.data[link])
+
+    def test_pages_cover_every_row_once_in_order(self):
+        ids, pages, _ = self.collect({'page_size': 2})
+        expected = [a.id for a in sorted(self.appointments, key=lambda a: (a.date_time, a.id))]
+        self.assertEqual(ids, expected)
+        self.assertEqual(pages, 4)
+
+    def test_pages_are_stable_with_ordering_filter(self):
+        ids, _, _ = self.collect({'page_size': 3, 'ordering': '-status'})
+        expected = [a.id for a in sorted(self.appointments, key=lambda a: (a.status, a.id), reverse=True)]
+        self.assertEqual(ids, expected)
+
+    def test_pages_are_stable_with_filterset(self):
+        ids, _, _ = self.collect({'page_size': 2, 'status': 'SCHEDULED'})
+        expected = [a.id for a in self.appointments if a.status == 'SCHEDULED']
+        self.assertEqual(sorted(ids), sorted(expected))
+        self.assertEqual(len(ids), len(set(ids)))
+
+    def test_previous_link_walks_back(self):
+        _, _, last_page = self.collect({'page_size': 2})
+        self.assertIsNotNone(last_page.data['previous'])
+        response = self.client.get(last_page.data['previous'])
+        expected = [a.id for a in sorted(self.appointments, key=lambda a: (a.date_time, a.id))][4:6]
+        self.assertEqual([item['id'] for item in response.data['results']], expected)
+
+    def test_deep_page_costs_one_query(self):
+        response = self.client.get(reverse('appointment-list'), {'page_size': 2})
+        for _ in range(2):
+            response = self.client.get(response.data['next'])
+        with self.assertNumQueries(1):
+            self.client.get(response.data['next'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('appointment-list'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_cursor_with_malformed_values(self):
+        def cursor(values):
+            payload = json.dumps({'o': ['date_time', 'id'], 'v': values, 'r': 0})
+            return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+        for values in (['garbage', 1], [self.start.isoformat(), 'x'], ['2024-01-01T00:00:00', [1]], [None, 1]):
+            with self.subTest(values=values):
+                response = self.client.get(reverse('appointment-list'), {'cursor': cursor(values)})
+                self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        response = self.client.get(reverse('appointment-list'), {'cursor': cursor([self.start.isoformat(), '0'])})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_cursor_rejected_when_ordering_changes(self):
+        response = self.client.get(reverse('appointment-list'), {'page_size': 2})
+        cursor = parse_qs(urlparse(response.data['next']).query)['cursor'][0]
+        response = self.client.get(reverse('appointment-list'), {'page_size': 2, 'ordering': 'status', 'cursor': cursor})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_feedback_pages_follow_created_at(self):
+        for appointment, rating in zip(self.appointments, [5, 4, 3, 2, 1]):
+            AppointmentFeedback.objects.create(appointment=appointment, rating=rating)
+        response = self.client.get(reverse('appointmentfeedback-list'), {'page_size': 3})
+        ids = [item['id'] for item in response.data['results']]
+        response = self.client.get(response.data['next'])
+        ids += [item['id'] for item in response.data['results']]
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(ids, list(AppointmentFeedback.objects.order_by('created_at', 'id').values_list('id', flat=True)))
+
+class ExplainAppointmentQueriesCommandTests(TestCase):
+    def test_viewset_querysets_use_indexes(self):
+        out = io.StringIO()
+        call_command('explain_appointment_queries', doctors=5, patients=50, appointments=2000, verbosity=2, stdout=out)
+        self.assertNotIn('FULL SCAN', out.getvalue())
+        self.assertEqual(Appointment.objects.count(), 0)
+
+class AppointmentAvailabilityTests(APITestCase):
+    def setUp(self):
+        self.patient = User.objects.create_user(username='patient', email='patient@example.com', password='testpass123', is_patient=True)
+        self.doctor = User.objects.create_user(username='doctor', email='doctor@example.com', password='testpass123', is_doctor=True)
+        self.day = (timezone.now() + timedelta(days=2)).date()
+        self.ten_am = timezone.make_aware(datetime.combine(self.day, datetime.min.time())) + timedelta(hours=10)
+        self.appointment = Appointment.objects.create(patient=self.patient, doctor=self.doctor, date_time=self.ten_am)
+        self.client.force_authenticate(user=self.patient)
+
+    def book(self, date_time):
+        data = {'doctor_id': self.doctor.id, 'date_time': date_time.isoformat()}
+        return self.client.post(reverse('appointment-list'), data)
+
+    def test_create_rejects_overlapping_slot(self):
+        response = self.book(self.ten_am + timedelta(minutes=15))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('date_time', response.data)
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    def test_create_accepts_adjacent_slot(self):
+        response = self.book(self.ten_am + timedelta(minutes=30))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_cancelled_appointment_frees_its_slot(self):
+        self.appointment.status = 'CANCELLED'
+        self.appointment.save()
+        response = self.book(self.ten_am)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_reactivating_cancelled_appointment_rejects_rebooked_slot(self):
+        self.appointment.status = 'CANCELLED'
+        self.appointment.save()
+        other = User.objects.create_user(username='other', email='other@example.com', password='testpass123', is_patient=True)
+        self.client.force_authenticate(user=other)
+        self.assertEqual(self.book(self.ten_am).status_code, status.HTTP_201_CREATED)
+
+        self.client.force_authenticate(user=self.doctor)
+        url = reverse('appointment-detail', kwargs={'pk': self.appointment.pk})
+        response = self.client.patch(url, {'status': 'SCHEDULED'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('date_time', response.data)
+        self.appointment.refresh_from_db()
+        self.assertEqual(self.appointment.status, 'CANCELLED')
+
+    def test_booking_cancelled_skips_slot_check(self):
+        data = {'doctor_id': self.doctor.id, 'date_time': self.ten_am.isoformat(), 'status': 'CANCELLED'}
+        response = self.client.post(reverse('appointment-list'), data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_reschedule_rejects_conflict(self):
+        other = Appointment.objects.create(patient=self.patient, doctor=self.doctor, date_time=self.ten_am + timedelta(hours=2))
+        url = reverse('appointment-reschedule', kwargs={'pk': other.pk})
+        response = self.client.post(url, {'new_date_time': (self.ten_am + timedelta(minutes=10)).isoformat()})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        other.refresh_from_db()
+        self.assertEqual(other.date_time, self.ten_am + timedelta(hours=2))
+
+    def test_reschedule_within_own_slot(self):
+        url = reverse('appointment-reschedule', kwargs={'pk': self.appointment.pk})
+        response = self.client.post(url, {'new_date_time': (self.ten_am + timedelta(minutes=10)).isoformat()})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_free_slots_skip_booked_slot(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('appointment-free-slots'), {'doctor_id': self.doctor.id, 'start': self.day.isoformat()})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        slots = response.data['free_slots']
+        self.assertEqual(len(slots), 15)
+        self.assertNotIn(self.ten_am.isoformat(), slots)
+        self.assertIn((self.ten_am + timedelta(minutes=30)).isoformat(), slots)
+
+    def test_free_slots_requires_doctor(self):
+        response = self.client.get(reverse('appointment-free-slots'), {'doctor_id': self.patient.id, 'start': self.day.isoformat()})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_free_slots_range_is_bounded(self):
+        end = self.day + timedelta(days=60)
+        response = self.client.get(reverse('appointment-free-slots'), {'doctor_id': self.doctor.id, 'start': self.day.isoformat(), 'end': end.isoformat()})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class DoctorRatingStatsTests(APITestCase):
+    def setUp(self):
+        self.patient = User.objects.create_user(username='patient', email='patient@example.com', password='testpass123', is_patient=True)
+        self.doctor = User.objects.create_user(username='doctor', email='doctor@example.com', password='testpass123', is_doctor=True)
+        self.other_doctor = User.objects.create_user(username='other', email='other@example.com', password='testpass123', is_doctor=True)
+        self.appointments = [
+            Appointment.objects.create(patient=self.patient, doctor=self.doctor, date_time=timezone.now() + timedelta(days=i + 1))
+            for i in range(3)
+        ]
+        self.client.force_authenticate(user=self.patient)
+
+    def stats(self, doctor=None):
+        return DoctorRatingStats.objects.get(doctor=doctor or self.doctor)
+
+    def test_stats_follow_create_update_and_delete(self):
+        first = AppointmentFeedback.objects.create(appointment=self.appointments[0], rating=5)
+        AppointmentFeedback.objects.create(appointment=self.appointments[1], rating=3)
+        stats = self.stats()
+        self.assertEqual((stats.rating_count, stats.rating_sum), (2, 8))
+        self.assertEqual(stats.histogram, {1: 0, 2: 0, 3: 1, 4: 0, 5: 1})
+
+        first = AppointmentFeedback.objects.get(pk=first.pk)
+        first.rating = 1
+        first.save()
+        stats = self.stats()
+        self.assertEqual((stats.rating_count, stats.rating_sum), (2, 4))
+        self.assertEqual(stats.histogram, {1: 1, 2: 0, 3: 1, 4: 0, 5: 0})
+
+        first.delete()
+        stats = self.stats()
+        self.assertEqual((stats.rating_count, stats.rating_sum), (1, 3))
+        self.assertEqual(stats.average_rating, 3.0)
+
+    def test_stats_move_with_appointment_doctor(self):
+        AppointmentFeedback.objects.create(appointment=self.appointments[0], rating=4)
+        appointment = Appointment.objects.get(pk=self.appointments[0].pk)
+        appointment.doctor = self.other_doctor
+        appointment.save()
+        self.assertEqual(self.stats().rating_count, 0)
+        self.assertEqual(self.stats(self.other_doctor).rating_sum, 4)
+
+    def test_deleting_doctor_removes_stats(self):
+        AppointmentFeedback.objects.create(appointment=self.appointments[0], rating=4)
+        self.doctor.delete()
+        self.assertFalse(DoctorRatingStats.objects.exists())
+
+    def test_api_writes_update_stats(self):
+        response = self.client.post(reverse('appointmentfeedback-list'), {'appointment': self.appointments[0].id, 'rating': 2})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        url = reverse('appointmentfeedback-detail', kwargs={'pk': response.data['id']})
+        self.client.patch(url, {'rating': 4})
+        self.assertEqual(self.stats().rating_sum, 4)
+        self.client.delete(url)
+        self.assertEqual(self.stats().rating_count, 0)
+
+    def test_batch_lookup(self):
+        AppointmentFeedback.objects.create(appointment=self.appointments[0], rating=5)
+        AppointmentFeedback.objects.create(appointment=self.appointments[1], rating=4)
+        url = reverse('appointmentfeedback-doctor-average-rating')
+        with self.assertNumQueries(1):
+            response = self.client.get(url, {'doctor_ids': f'{self.doctor.id},{self.other_doctor.id}'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['average_rating'], 4.5)
+        self.assertEqual(response.data['results'][0]['rating_count'], 2)
+        self.assertIsNone(response.data['results'][1]['average_rating'])
+        self.assertEqual(response.data['results'][1]['rating_count'], 0)
+
+    def test_batch_lookup_rejects_bad_ids(self):
+        url = reverse('appointmentfeedback-doctor-average-rating')
+        response = self.client.get(url, {'doctor_ids': '1,x'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        for params in ({'doctor_id': ','}, {'doctor_ids': ',,'}, {'doctor_ids': ' '}):
+            with self.subTest(params=params):
+                response = self.client.get(url, params)
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_backfill_command(self):
+        AppointmentFeedback.objects.create(appointment=self.appointments[0], rating=5)
+        AppointmentFeedback.objects.create(appointment=self.appointments[1], rating=2)
+        DoctorRatingStats.objects.all().delete()
+        call_command('backfill_doctor_ratings', stdout=io.StringIO())
+        stats = self.stats()
+        self.assertEqual((stats.rating_count, stats.rating_sum, stats.rating_2, stats.rating_5), (2, 7, 1, 1))
+
+class BulkAppointmentTests(APITestCase):
+    def setUp(self):
+        self.patient = User.objects.create_user(username='patient', email='patient@example.com', password='testpass123', is_patient=True)
+        self.other_patient = User.objects.create_user(username='other', email='other@example.com', password='testpass123', is_patient=True)
+        self.doctor = User.objects.create_user(username='doctor', email='doctor@example.com', password='testpass123', is_doctor=True)
+        self.day = (timezone.now() + timedelta(days=2)).date()
+        self.ten_am = timezone.make_aware(datetime.combine(self.day, datetime.min.time())) + timedelta(hours=10)
+        self.appointment = Appointment.objects.create(patient=self.patient, doctor=self.doctor, date_time=self.ten_am)
+        self.client.force_authenticate(user=self.patient)
+
+    def at(self, minutes):
+        return (self.ten_am + timedelta(minutes=minutes)).isoformat()
+
+    def test_bulk_create_reports_each_item(self):
+        items = [
+            {'doctor_id': self.doctor.id, 'date_time': self.at(60)},
+            {'doctor_id': self.doctor.id, 'date_time': self.at(15)},
+            {'doctor_id': self.doctor.id, 'date_time': self.at(75)},
+            {'doctor_id': self.patient.id, 'date_time': self.at(120)},
+            {'doctor_id': self.doctor.id, 'date_time': 'tomorrow'},
+            {'doctor_id': self.doctor.id, 'date_time': self.at(90), 'notes': 'Follow-up'},
+        ]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('appointment-bulk-create'), {'appointments': items}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual([r['status'] for r in results], ['created', 'error', 'error', 'error', 'error', 'created'])
+        self.assertIn('date_time', results[1]['errors'])
+        self.assertIn('date_time', results[2]['errors'])
+        self.assertIn('doctor_id', results[3]['errors'])
+        self.assertEqual(Appointment.objects.count(), 3)
+        self.assertEqual(Appointment.objects.get(pk=results[5]['id']).notes, 'Follow-up')
+        # And one for the appointment made in setUp.
+        self.assertEqual(OutboundEmail.objects.filter(subject='New Appointment Scheduled').count(), 3)
+
+    def test_bulk_create_query_count_is_constant(self):
+        items = [{'doctor_id': self.doctor.id, 'date_time': self.at(30 * (i + 1))} for i in range(10)]
+        with self.assertNumQueries(6):
+            response = self.client.post(reverse('appointment-bulk-create'), {'appointments': items}, format='json')
+        self.assertEqual([r['status'] for r in response.data['results']], ['created'] * 10)
+
+    def test_doctor_cannot_bulk_create(self):
+        self.client.force_authenticate(user=self.doctor)
+        items = [{'doctor_id': self.doctor.id, 'date_time': self.at(60)}]
+        response = self.client.post(reverse('appointment-bulk-create'), {'appointments': items}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_request_size_is_bounded(self):
+        response = self.client.post(reverse('appointment-bulk-cancel'), {'ids': list(range(1, 102))}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(reverse('appointment-bulk-cancel'), {'ids': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_cancel_checks_ownership(self):
+        second = Appointment.objects.create(patient=self.patient, doctor=self.doctor, date_time=self.ten_am + timedelta(hours=1))
+        foreign = Appointment.objects.create(patient=self.other_patient, doctor=self.doctor, date_time=self.ten_am + timedelta(hours=2))
+        ids = [self.appointment.pk, foreign.pk, second.pk, second.pk, 'x']
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertNumQueries(5):
+                response = self.client.post(reverse('appointment-bulk-cancel'), {'ids': ids}, format='json')
+        self.assertEqual([r['status'] for r in response.data['results']], ['cancelled', 'error', 'cancelled', 'error', 'error'])
+        self.assertEqual(OutboundEmail.objects.filter(subject='Appointment Updated').count(), 2)
+        self.assertEqual(Appointment.objects.filter(status='CANCELLED').count(), 2)
+        foreign.refresh_from_db()
+        self.assertEqual(foreign.status, 'SCHEDULED')
+
+        response = self.client.post(reverse('appointment-bulk-cancel'), {'ids': [second.pk]}, format='json')
+        self.assertIn('status', response.data['results'][0]['errors'])
+
+    def test_bulk_reschedule_applies_items_in_order(self):
+        second = Appointment.objects.create(patient=self.patient, doctor=self.doctor, date_time=self.ten_am + timedelta(hours=1))
+        third = Appointment.objects.create(patient=self.patient, doctor=self.doctor, date_time=self.ten_am + timedelta(hours=2))
+        changes = [
+            {'id': self.appointment.pk, 'new_date_time': self.at(300)},
+            {'id': second.pk, 'new_date_time': self.at(10)},
+            {'id': third.pk, 'new_date_time': self.at(300)},
+        ]
+        response = self.client.post(reverse('appointment-bulk-reschedule'), {'changes': changes}, format='json')
+        self.assertEqual([r['status'] for r in response.data['results']], ['rescheduled', 'rescheduled', 'error'])
+        self.assertIn('new_date_time', response.data['results'][2]['errors'])
+        self.appointment.refresh_from_db()
+        second.refresh_from_db()
+        third.refresh_from_db()
+        self.assertEqual(self.appointment.date_time, self.ten_am + timedelta(minutes=300))
+        self.assertEqual(second.date_time, self.ten_am + timedelta(minutes=10))
+        self.assertEqual(third.date_time, self.ten_am + timedelta(hours=2))
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        self.patient = User.objects.create_user(username='patient', email='patient@example.com', password='testpass123', is_patient=True)
+        self.doctor = User.objects.create_user(username='doctor', email='doctor@example.com', password='testpass123', is_doctor=True)
+        self.appointments = [
+            Appointment.objects.create(patient=self.patient, doctor=self.doctor, date_time=timezone.now() + timedelta(days=i + 1))
+            for i in range(3)
+        ]
+        self.client.force_authenticate(user=self.patient)
+        self.url = reverse('appointment-list')
+
+    def revalidate(self, url, etag):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_unchanged_list_is_not_modified(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        self.assertIn('private', response['Cache-Control'])
+        with self.assertNumQueries(1):
+            response = self.revalidate(self.url, etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertFalse(response.content)
+
+    def test_list_validator_tracks_changes(self):
+        etag = self.client.get(self.url)['ETag']
+        self.appointments[0].notes = 'Bring test results'
+        self.appointments[0].save()
+        response = self.revalidate(self.url, etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+        etag = response['ETag']
+        self.appointments[1].delete()
+        response = self.revalidate(self.url, etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 2)
+
+        etag = response['ETag']
+        self.doctor.username = 'dr-renamed'
+        self.doctor.save()
+        response = self.revalidate(self.url, etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_validator_depends_on_query(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.revalidate(self.url + '?status=SCHEDULED', etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_retrieve_is_not_modified(self):
+        url = reverse('appointment-detail', kwargs={'pk': self.appointments[0].pk})
+        response = self.client.get(url)
+        self.assertIn('Last-Modified', response)
+        with self.assertNumQueries(1):
+            response = self.revalidate(url, response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_retrieve_of_foreign_appointment_is_not_revalidated(self):
+        other = User.objects.create_user(username='other', email='other@example.com', password='testpass123', is_patient=True)
+        url = reverse('appointment-detail', kwargs={'pk': self.appointments[0].pk})
+        etag = self.client.get(url)['ETag']
+        self.client.force_authenticate(user=other)
+        response = self.revalidate(url, etag)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'appointment-cache-tests'}},
+    APPOINTMENT_CACHE_TIMEOUT=300,
+)
+class AppointmentResponseCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.patient = User.objects.create_user(username='patient', email='patient@example.com', password='testpass123', is_patient=True)
+        self.other_patient = User.objects.create_user(username='other', email='other@example.com', password='testpass123', is_patient=True)
+        self.doctor = User.objects.create_user(username='doctor', email='doctor@example.com', password='testpass123', is_doctor=True)
+        self.appointment = Appointment.objects.create(patient=self.patient, doctor=self.doctor, date_time=timezone.now() + timedelta(days=1))
+        self.client.force_authenticate(user=self.patient)
+        self.url = reverse('appointment-list')
+
+    def test_list_is_served_from_cache(self):
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response_cache.get_stats(), {'hit': 1, 'miss': 1})
+
+    def test_cached_entry_answers_conditional_requests(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_write_bumps_only_affected_scopes(self):
+        Appointment.objects.create(patient=self.other_patient, doctor=self.doctor, date_time=timezone.now() + timedelta(days=2))
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Appointment.objects.create(patient=self.other_patient, doctor=self.doctor, date_time=timezone.now() + timedelta(days=3))
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+
+        self.client.force_authenticate(user=self.doctor)
+        self.assertEqual(len(self.client.get(self.url).data['results']), 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.appointment.status = 'COMPLETED'
+            self.appointment.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['results'][0]['status'], 'COMPLETED')
+
+    def test_retrieve_and_feedback_list_are_invalidated(self):
+        detail = reverse('appointment-detail', kwargs={'pk': self.appointment.pk})
+        feedback = reverse('appointmentfeedback-list')
+        self.client.get(detail)
+        self.assertEqual(len(self.client.get(feedback).data['results']), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            AppointmentFeedback.objects.create(appointment=self.appointment, rating=4)
+        self.assertEqual(len(self.client.get(feedback).data['results']), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.doctor.username = 'dr-renamed'
+            self.doctor.save()
+        self.assertEqual(self.client.get(detail).data['doctor']['username'], 'dr-renamed')
+
+    def test_participant_change_bumps_only_shared_appointments(self):
+        other_doctor = User.objects.create_user(username='other-doctor', email='od@example.com', password='testpass123', is_doctor=True)
+        Appointment.objects.create(patient=self.other_patient, doctor=other_doctor, date_time=timezone.now() + timedelta(days=2))
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            other_doctor.username = 'other-renamed'
+            other_doctor.save()
+            User.objects.create_user(username='bystander', email='b@example.com', password='testpass123')
+            bystander = User.objects.get(username='bystander')
+            bystander.first_name = 'Bea'
+            bystander.save()
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.patient.patient_profile.save()
+        self.assertEqual(response_cache.get_stats(), {'hit': 1, 'miss': 1})
+        self.client.get(self.url)
+        self.assertEqual(response_cache.get_stats(), {'hit': 1, 'miss': 2})
+
+    def test_bulk_writes_invalidate(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('appointment-bulk-cancel'), {'ids': [self.appointment.pk]}, format='json')
+        self.assertEqual(self.client.get(self.url).data['results'][0]['status'], 'CANCELLED')
+
+    def test_responses_are_per_user(self):
+        self.client.get(self.url)
+        self.client.force_authenticate(user=self.other_patient)
+        self.assertEqual(len(self.client.get(self.url).data['results']), 0)
+
+    def test_stats_command(self):
+        self.client.get(self.url)
+        self.client.get(self.url)
+        out = io.StringIO()
+        call_command('appointment_cache_stats', '--reset', stdout=out)
+        self.assertIn('hits: 1  misses: 1  hit ratio: 50.0%', out.getvalue())
+        self.assertEqual(response_cache.get_stats(), {'hit': 0, 'miss': 0})
+
+class AppointmentSearchTests(APITestCase):
+    def setUp(self):
+        self.patient = User.objects.create_user(username='alice', email='alice@example.com', password='testpass123', is_patient=True)
+        self.smith = User.objects.create_user(username='drsmith', email='smith@example.com', password='testpass123', is_doctor=True)
+        self.jones = User.objects.create_user(username='drjones', email='jones@example.com', password='testpass123', is_doctor=True)
+        self.staff = User.objects.create_user(username='staff', email='staff@example.com', password='testpass123', is_staff=True)
+        start = timezone.now() + timedelta(days=1)
+        self.knee = Appointment.objects.create(patient=self.patient, doctor=self.smith, date_time=start, notes='Knee pain after running')
+        self.rash = Appointment.objects.create(patient=self.patient, doctor=self.jones, date_time=start + timedelta(hours=1), notes='Skin rash')
+        self.checkup = Appointment.objects.create(patient=self.patient, doctor=self.smith, date_time=start + timedelta(hours=2), notes='Yearly checkup, knee and knee brace')
+        self.client.force_authenticate(user=self.staff)
+        self.url = reverse('appointment-list')
+
+    def search(self, text, **params):
+        response = self.client.get(self.url, {'search': text, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [row['id'] for row in response.data['results']]
+
+    def test_matches_notes_and_participants(self):
+        self.assertEqual(set(self.search('rash')), {self.rash.pk})
+        self.assertEqual(set(self.search('drsm')), {self.knee.pk, self.checkup.pk})
+        self.assertEqual(set(self.search('alice SKIN')), {self.rash.pk})
+        self.assertEqual(set(self.search('scheduled')), {self.knee.pk, self.rash.pk, self.checkup.pk})
+        self.assertEqual(self.search('nothing'), [])
+
+    def test_results_are_ranked(self):
+        self.assertEqual(self.search('knee'), [self.checkup.pk, self.knee.pk])
+        self.assertEqual(self.search('knee', ordering='date_time'), [self.knee.pk, self.checkup.pk])
+
+    def test_ranked_results_paginate(self):
+        seen = []
+        response = self.client.get(self.url, {'search': 'scheduled', 'page_size': 1})
+        while True:
+            seen += [row['id'] for row in response.data['results']]
+            if not response.data['next']:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(sorted(seen), sorted([self.knee.pk, self.rash.pk, self.checkup.pk]))
+
+    def test_search_is_scoped_and_costs_one_query(self):
+        self.client.force_authenticate(user=self.jones)
+        with self.assertNumQueries(1):
+            ids = self.search('scheduled')
+        self.assertEqual(ids, [self.rash.pk])
+
+    def test_index_follows_writes(self):
+        self.rash.notes = 'Eczema flare'
+        self.rash.save()
+        self.assertEqual(self.search('rash'), [])
+        self.assertEqual(self.search('eczema'), [self.rash.pk])
+
+        self.smith.username = 'drbrown'
+        self.smith.save()
+        self.assertEqual(set(self.search('drbrown')), {self.knee.pk, self.checkup.pk})
+        self.assertEqual(self.search('drsmith'), [])
+
+        self.client.post(reverse('appointment-bulk-cancel'), {'ids': [self.knee.pk]}, format='json')
+        self.assertEqual(self.search('cancelled'), [self.knee.pk])
+
+        self.knee.delete()
+        self.assertEqual(self.search('running'), [])
+
+    def test_admin_search_uses_index(self):
+        self.staff.is_superuser = True
+        self.staff.save()
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('admin:appointments_appointment_changelist'), {'q': 'eczema rash'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(reverse('admin:appointments_appointment_changelist'), {'q': 'rash'})
+        self.assertContains(response, f'/admin/appointments/appointment/{self.rash.pk}/change/')
+        self.assertNotContains(response, f'/admin/appointments/appointment/{self.knee.pk}/change/')
+
+    def test_rebuild_command(self):
+        Appointment.objects.filter(pk=self.rash.pk).update(search_text='')
+        self.assertEqual(self.search('rash'), [])
+        call_command('rebuild_appointment_search', stdout=io.StringIO())
+        self.assertEqual(self.search('rash'), [self.rash.pk])
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'async-appointment-tests'}},
+    APPOINTMENT_CACHE_TIMEOUT=300,
+)
+class AsyncAppointmentReadTests(APITestCase):
+    def setUp(self):
+        from users.tokens import RefreshToken
+
+        cache.clear()
+        self.patient = User.objects.create_user(username='patient', email='patient@example.com', password='testpass123', is_patient=True)
+        self.other_patient = User.objects.create_user(username='other', email='other@example.com', password='testpass123', is_patient=True)
+        self.doctor = User.objects.create_user(username='doctor', email='doctor@example.com', password='testpass123', is_doctor=True)
+        self.appointment = Appointment.objects.create(patient=self.patient, doctor=self.doctor, date_time=timezone.now() + timedelta(days=1))
+        self.other_appointment = Appointment.objects.create(patient=self.other_patient, doctor=self.doctor, date_time=timezone.now() + timedelta(days=2))
+        self.headers = {'Authorization': f'Bearer {RefreshToken.for_user(self.patient).access_token}'}
+
+    async def sync_get(self, url):
+        """The same request through the synchronous endpoint."""
+        from asgiref.sync import sync_to_async
+
+        def get():
+            self.client.force_authenticate(user=self.patient)
+            return self.client.get(url).json()
+        return await sync_to_async(get)()
+
+    async def test_list_matches_sync_endpoint(self):
+        response = await self.async_client.get(reverse('async-appointment-list'), headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        expected = await self.sync_get(reverse('appointment-list'))
+        self.assertEqual(response.json()['results'], expected['results'])
+        self.assertEqual([row['id'] for row in response.json()['results']], [self.appointment.pk])
+
+    async def test_retrieve_and_revalidate(self):
+        url = reverse('async-appointment-detail', kwargs={'pk': self.appointment.pk})
+        response = await self.async_client.get(url, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), await self.sync_get(reverse('appointment-detail', kwargs={'pk': self.appointment.pk})))
+
+        await cache.aclear()
+        response = await self.async_client.get(url, headers={**self.headers, 'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    async def test_other_patients_appointment_is_not_found(self):
+        url = reverse('async-appointment-detail', kwargs={'pk': self.other_appointment.pk})
+        response = await self.async_client.get(url, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = await self.async_client.get(reverse('async-appointment-detail', kwargs={'pk': 'nope'}), headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    async def test_authentication_is_required(self):
+        response = await self.async_client.get(reverse('async-appointment-list'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response['WWW-Authenticate'], 'Bearer realm="api"')
+        response = await self.async_client.get(reverse('async-appointment-list'), headers={'Authorization': 'Bearer invalid'})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = await self.async_client.post(reverse('async-appointment-list'), headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    async def test_session_users_are_accepted(self):
+        await self.async_client.aforce_login(self.patient)
+        response = await self.async_client.get(reverse('async-appointment-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    async def test_list_shares_the_response_cache(self):
+        url = reverse('async-appointment-list')
+        await self.async_client.get(url, headers=self.headers)
+        response = await self.async_client.get(url, headers=self.headers)
+        self.assertEqual(len(response.json()['results']), 1)
+        self.assertEqual(await cache.aget(response_cache.STATS_KEYS['hit']), 1)
+        self.assertEqual(await cache.aget(response_cache.STATS_KEYS['miss']), 1)
+
+    async def test_doctor_average_rating(self):
+        url = reverse('async-appointmentfeedback-doctor-average-rating')
+        response = await self.async_client.get(url, {'doctor_id': self.doctor.pk}, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json(), await self.sync_get(f"{reverse('appointmentfeedback-doctor-average-rating')}?doctor_id={self.doctor.pk}"))
+        response = await self.async_client.get(url, {'doctor_ids': 'x'}, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = await self.async_client.get(url, {'doctor_id': ','}, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -1,5 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from config.asyncapi import async_action
 from .views import AppointmentViewSet, AppointmentFeedbackViewSet
 
 router = DefaultRouter()
@@ -8,5 +9,13 @@ router.register(r'feedback', AppointmentFeedbackViewSet, basename='appointmentfe
 
 urlpatterns = [
     path('', include(router.urls)),
+    # Async versions of the read endpoints, for ASGI deployments.
+    path('async/appointments/', async_action(AppointmentViewSet, 'list', 'appointment'), name='async-appointment-list'),
+    path('async/appointments/<pk>/', async_action(AppointmentViewSet, 'retrieve', 'appointment'), name='async-appointment-detail'),
+    path(
+        'async/feedback/doctor_average_rating/',
+        async_action(AppointmentFeedbackViewSet, 'doctor_average_rating', 'appointmentfeedback'),
+        name='async-appointmentfeedback-doctor-average-rating',
+    ),
 ]
 
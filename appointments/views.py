@@ -2,29 +2,48 @@ from rest_framework import viewsets, permissions, status, filters, serializers
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import Avg
+from django.db import transaction
+from django.contrib.auth import get_user_model
+from django.conf import settings
 from .models import Appointment, AppointmentFeedback
 from .serializers import AppointmentSerializer, AppointmentFeedbackSerializer
+from .pagination import AppointmentPagination, AppointmentFeedbackPagination
 from .permissions import IsPatientOrDoctorOrAdmin, CanViewAppointment, CanEditAppointment
+from .availability import DoctorSchedule, SlotConflict, ensure_slot_available
+from .ratings import aget_rating_stats, get_rating_stats
+from . import bulk, conditional
+from .cache import acached_response, cached_response
+from .search import AppointmentSearchFilter
+from users.throttling import BookingThrottle, RateLimitHeadersMixin
+from config.asyncapi import AsyncReadMixin
 
-class AppointmentViewSet(viewsets.ModelViewSet):
+User = get_user_model()
+
+class AppointmentViewSet(AsyncReadMixin, RateLimitHeadersMixin, viewsets.ModelViewSet):
     queryset = Appointment.objects.all()
     serializer_class = AppointmentSerializer
     permission_classes = [IsPatientOrDoctorOrAdmin]
-    filter_backends = [filters.SearchFilter, DjangoFilterBackend, filters.OrderingFilter]
+    pagination_class = AppointmentPagination
+    filter_backends = [AppointmentSearchFilter, DjangoFilterBackend, filters.OrderingFilter]
+    # Covered by Appointment.search_text, together with notes.
     search_fields = ['status', 'doctor__username', 'patient__username']
     ordering_fields = ['status', 'date_time']
     filterset_fields = ['status', 'date_time']
+    max_bulk_items = 100
+    # Columns an appointment's representation depends on; see validator_row.
+    validator_fields = ('id', 'updated_at', 'patient__updated_at', 'doctor__updated_at')
 
     def get_queryset(self):
         user = self.request.user
         if user.is_staff:
-            return Appointment.objects.all()
+            queryset = Appointment.objects.all()
         elif user.is_patient:
-            return Appointment.objects.filter(patient=user)
+            queryset = Appointment.objects.filter(patient=user)
         elif user.is_doctor:
-            return Appointment.objects.filter(doctor=user)
-        return Appointment.objects.none()
+            queryset = Appointment.objects.filter(doctor=user)
+        else:
+            return Appointment.objects.none()
+        return queryset.with_participants()
 
     def get_permissions(self):
         if self.action in ['retrieve', 'list']:
@@ -35,6 +54,96 @@ class AppointmentViewSet(viewsets.ModelViewSet):
             permission_classes = [IsPatientOrDoctorOrAdmin]
         return [permission() for permission in permission_classes]
 
+    def get_throttles(self):
+        # A bulk request books up to max_bulk_items at once but spends one token.
+        if self.action in ['create', 'bulk_create']:
+            return [BookingThrottle()]
+        return []
+
+    @staticmethod
+    def validator_row(appointment):
+        return (appointment.id, appointment.updated_at, appointment.patient.updated_at, appointment.doctor.updated_at)
+
+    # Conditional requests are revalidated against the ids and timestamps of
+    # the rows only; rows are loaded and serialized just when something
+    # changed. The a* methods are the async versions (config/asyncapi.py).
+
+    def validator_rows(self, queryset):
+        return self.paginator.get_page_queryset(queryset, self.request, self).values_list(*self.validator_fields)
+
+    def page_not_modified(self, request, rows):
+        page_size = self.paginator.page_size
+        etag = conditional.make_etag(request, rows[:page_size], len(rows) > page_size)
+        response = conditional.not_modified(request, etag)
+        if response is not None:
+            return conditional.set_validators(response, etag)
+        return None
+
+    def page_response(self, request, page):
+        serializer = self.get_serializer(page, many=True)
+        etag = conditional.make_etag(request, [self.validator_row(appointment) for appointment in page], self.paginator.has_more)
+        return conditional.set_validators(self.get_paginated_response(serializer.data), etag)
+
+    @cached_response
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        if conditional.is_conditional(request):
+            response = self.page_not_modified(request, list(self.validator_rows(queryset)))
+            if response is not None:
+                return response
+        return self.page_response(request, self.paginate_queryset(queryset))
+
+    @acached_response
+    async def alist(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        if conditional.is_conditional(request):
+            response = self.page_not_modified(request, [row async for row in self.validator_rows(queryset)])
+            if response is not None:
+                return response
+        return self.page_response(request, await self.paginator.apaginate_queryset(queryset, request, self))
+
+    def validator_row_queryset(self):
+        lookup = {self.lookup_field: self.kwargs[self.lookup_url_kwarg or self.lookup_field]}
+        return self.filter_queryset(self.get_queryset()).filter(**lookup).values_list(*self.validator_fields)
+
+    def row_not_modified(self, request, row):
+        if row is None:
+            return None
+        etag = conditional.make_etag(request, [row])
+        response = conditional.not_modified(request, etag, max(row[1:]))
+        if response is not None:
+            return conditional.set_validators(response, etag, max(row[1:]))
+        return None
+
+    def instance_response(self, request, instance):
+        row = self.validator_row(instance)
+        response = Response(self.get_serializer(instance).data)
+        return conditional.set_validators(response, conditional.make_etag(request, [row]), max(row[1:]))
+
+    @cached_response
+    def retrieve(self, request, *args, **kwargs):
+        if conditional.is_conditional(request):
+            try:
+                row = self.validator_row_queryset().first()
+            except (TypeError, ValueError):
+                row = None
+            response = self.row_not_modified(request, row)
+            if response is not None:
+                return response
+        return self.instance_response(request, self.get_object())
+
+    @acached_response
+    async def aretrieve(self, request, *args, **kwargs):
+        if conditional.is_conditional(request):
+            try:
+                row = await self.validator_row_queryset().afirst()
+            except (TypeError, ValueError):
+                row = None
+            response = self.row_not_modified(request, row)
+            if response is not None:
+                return response
+        return self.instance_response(request, await self.aget_object())
+
     def perform_create(self, serializer):
         user = self.request.user
         if not user.is_patient:
@@ -48,7 +157,8 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         if request.user.is_doctor and appointment.doctor != request.user:
             return Response({'error': 'You can only cancel your own appointments.'}, status=status.HTTP_403_FORBIDDEN)
         appointment.status = 'CANCELLED'
-        appointment.save()
+        with transaction.atomic():
+            appointment.save()
         return Response({'status': 'appointment cancelled'})
 
     @action(detail=True, methods=['post'])
@@ -59,14 +169,75 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         new_date_time = request.data.get('new_date_time')
         if not new_date_time:
             return Response({'error': 'New date and time are required.'}, status=status.HTTP_400_BAD_REQUEST)
-        appointment.date_time = new_date_time
-        appointment.save()
+        new_date_time = serializers.DateTimeField().to_internal_value(new_date_time)
+        with transaction.atomic():
+            try:
+                ensure_slot_available(appointment.doctor_id, new_date_time, exclude=[appointment.pk])
+            except SlotConflict as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            appointment.date_time = new_date_time
+            appointment.save()
         return Response({'status': 'appointment rescheduled'})
 
-class AppointmentFeedbackViewSet(viewsets.ModelViewSet):
+    def get_bulk_items(self, request, key):
+        items = request.data.get(key) if hasattr(request.data, 'get') else None
+        if not isinstance(items, list) or not items:
+            return None, Response({'error': f'{key} must be a non-empty list.'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > self.max_bulk_items:
+            return None, Response({'error': f'At most {self.max_bulk_items} items per request.'}, status=status.HTTP_400_BAD_REQUEST)
+        return items, None
+
+    @action(detail=False, methods=['post'])
+    def bulk_create(self, request):
+        if not request.user.is_patient:
+            raise serializers.ValidationError("Only patients can book appointments.")
+        items, error = self.get_bulk_items(request, 'appointments')
+        if error:
+            return error
+        return Response({'results': bulk.create_appointments(request.user, items)})
+
+    @action(detail=False, methods=['post'])
+    def bulk_cancel(self, request):
+        ids, error = self.get_bulk_items(request, 'ids')
+        if error:
+            return error
+        return Response({'results': bulk.cancel_appointments(self.get_queryset(), ids)})
+
+    @action(detail=False, methods=['post'])
+    def bulk_reschedule(self, request):
+        changes, error = self.get_bulk_items(request, 'changes')
+        if error:
+            return error
+        return Response({'results': bulk.reschedule_appointments(self.get_queryset(), changes)})
+
+    @action(detail=False, methods=['get'])
+    def free_slots(self, request):
+        doctor_id = request.query_params.get('doctor_id')
+        start = request.query_params.get('start')
+        if not doctor_id or not doctor_id.isdigit() or not start:
+            return Response({'error': 'doctor_id and start are required.'}, status=status.HTTP_400_BAD_REQUEST)
+        start = serializers.DateField().to_internal_value(start)
+        end = serializers.DateField().to_internal_value(request.query_params.get('end', start.isoformat()))
+        if end < start:
+            return Response({'error': 'end must not be before start.'}, status=status.HTTP_400_BAD_REQUEST)
+        if (end - start).days >= settings.APPOINTMENT_FREE_SLOTS_MAX_DAYS:
+            return Response({'error': f'The range may span at most {settings.APPOINTMENT_FREE_SLOTS_MAX_DAYS} days.'}, status=status.HTTP_400_BAD_REQUEST)
+        if not User.objects.filter(pk=doctor_id, is_doctor=True).exists():
+            return Response({'error': 'Doctor not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+        schedule = DoctorSchedule.for_dates(int(doctor_id), start, end)
+        return Response({
+            'doctor_id': int(doctor_id),
+            'slot_minutes': settings.APPOINTMENT_SLOT_MINUTES,
+            'free_slots': [slot.isoformat() for slot in schedule.free_slots(start, end)],
+        })
+
+class AppointmentFeedbackViewSet(AsyncReadMixin, viewsets.ModelViewSet):
     queryset = AppointmentFeedback.objects.all()
     serializer_class = AppointmentFeedbackSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = AppointmentFeedbackPagination
+    max_rating_batch = 100
 
     def get_queryset(self):
         user = self.request.user
@@ -78,18 +249,66 @@ class AppointmentFeedbackViewSet(viewsets.ModelViewSet):
             return AppointmentFeedback.objects.filter(appointment__doctor=user)
         return AppointmentFeedback.objects.none()
 
+    @cached_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
     def perform_create(self, serializer):
         appointment = serializer.validated_data['appointment']
-        if self.request.user != appointment.patient:
+        if appointment.patient_id != self.request.user.id:
             raise serializers.ValidationError("You can only provide feedback for your own appointments.")
-        serializer.save()
+        # The doctor's rating totals are updated by signals in the same transaction.
+        with transaction.atomic():
+            serializer.save()
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            serializer.save()
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+
+    def rating_doctor_ids(self, request):
+        """Return (ids, None) for a rating lookup, or (None, error response)."""
+        doctor_id = request.query_params.get('doctor_id')
+        doctor_ids = request.query_params.get('doctor_ids')
+        if not doctor_id and not doctor_ids:
+            return None, Response({'error': 'doctor_id or doctor_ids is required'}, status=400)
+
+        try:
+            ids = [int(value) for value in (doctor_ids or doctor_id).split(',') if value.strip()]
+        except ValueError:
+            return None, Response({'error': 'Doctor ids must be integers'}, status=400)
+        if not ids:
+            return None, Response({'error': 'doctor_id or doctor_ids is required'}, status=400)
+        if len(ids) > self.max_rating_batch:
+            return None, Response({'error': f'At most {self.max_rating_batch} doctor ids per request'}, status=400)
+        return ids, None
 
     @action(detail=False, methods=['get'])
     def doctor_average_rating(self, request):
-        doctor_id = request.query_params.get('doctor_id')
-        if not doctor_id:
-            return Response({'error': 'doctor_id is required'}, status=400)
-        
-        average_rating = self.get_queryset().filter(appointment__doctor_id=doctor_id).aggregate(Avg('rating'))
-        return Response({'average_rating': average_rating['rating__avg']})
+        ids, error = self.rating_doctor_ids(request)
+        if error is not None:
+            return error
+        return self.rating_response(request, get_rating_stats(ids))
+
+    async def adoctor_average_rating(self, request):
+        ids, error = self.rating_doctor_ids(request)
+        if error is not None:
+            return error
+        return self.rating_response(request, await aget_rating_stats(ids))
 
+    def rating_response(self, request, rows):
+        results = [
+            {
+                'doctor_id': stats.doctor_id,
+                'average_rating': stats.average_rating,
+                'rating_count': stats.rating_count,
+                'histogram': stats.histogram,
+            }
+            for stats in rows
+        ]
+        if request.query_params.get('doctor_ids'):
+            return Response({'results': results})
+        return Response(results[0])
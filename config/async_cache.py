@@ -0,0 +1,110 @@
+"""
+Async access to the shared cache.
+
+django-redis is synchronous, and Django's async cache methods only run it in
+a thread. With the Redis cache, these helpers talk to the same server through
+redis.asyncio instead. Keys and values are encoded by django-redis' own
+client, so entries are shared with synchronous code in both directions.
+Other cache backends (the local-memory cache in tests) go through Django's
+async cache API.
+
+As with DJANGO_REDIS_IGNORE_EXCEPTIONS for the synchronous cache, an
+unreachable Redis reads as a miss and writes are dropped.
+"""
+import asyncio
+import logging
+import weakref
+
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django_redis.cache import RedisCache
+from redis import asyncio as redis_asyncio
+from redis.exceptions import ConnectionError, TimeoutError
+
+logger = logging.getLogger(__name__)
+
+# One client per event loop: redis.asyncio connections belong to the loop
+# that opened them.
+_clients = weakref.WeakKeyDictionary()
+
+
+def get_backend():
+    backend = caches[DEFAULT_CACHE_ALIAS]
+    return backend if isinstance(backend, RedisCache) else None
+
+
+def get_client(backend):
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = _clients[loop] = redis_asyncio.Redis.from_url(backend.client._server[0])
+    return client
+
+
+def expiry(backend, timeout):
+    """Milliseconds to keep a value for, None for ever."""
+    if timeout is DEFAULT_TIMEOUT:
+        timeout = backend.default_timeout
+    return None if timeout is None else int(timeout * 1000)
+
+
+async def aget(key, default=None):
+    return (await aget_many([key])).get(key, default)
+
+
+async def aget_many(keys):
+    backend = get_backend()
+    if backend is None:
+        return await caches[DEFAULT_CACHE_ALIAS].aget_many(keys)
+    keys = list(keys)
+    try:
+        values = await get_client(backend).mget([backend.client.make_key(key) for key in keys])
+    except (ConnectionError, TimeoutError) as e:
+        logger.warning(f"Cache read skipped, cache unavailable: {e}")
+        return {}
+    return {key: backend.client.decode(value) for key, value in zip(keys, values) if value is not None}
+
+
+async def aset(key, value, timeout=DEFAULT_TIMEOUT, nx=False):
+    """Store value; with nx=True only if key is absent. Returns whether it was stored."""
+    backend = get_backend()
+    if backend is None:
+        cache = caches[DEFAULT_CACHE_ALIAS]
+        if nx:
+            return await cache.aadd(key, value, timeout)
+        await cache.aset(key, value, timeout)
+        return True
+
+    key = backend.client.make_key(key)
+    milliseconds = expiry(backend, timeout)
+    try:
+        client = get_client(backend)
+        if milliseconds is not None and milliseconds <= 0:
+            if not nx:
+                await client.delete(key)
+            return False
+        return bool(await client.set(key, backend.client.encode(value), px=milliseconds, nx=nx))
+    except (ConnectionError, TimeoutError) as e:
+        logger.warning(f"Cache write skipped, cache unavailable: {e}")
+        return False
+
+
+async def aadd(key, value, timeout=DEFAULT_TIMEOUT):
+    return await aset(key, value, timeout, nx=True)
+
+
+async def aincr_or_create(key, delta=1):
+    """Add delta to an integer counter, creating it when missing."""
+    backend = get_backend()
+    if backend is None:
+        cache = caches[DEFAULT_CACHE_ALIAS]
+        try:
+            await cache.aincr(key, delta)
+        except ValueError:
+            if not await cache.aadd(key, delta, None):
+                await cache.aincr(key, delta)
+        return
+    try:
+        await get_client(backend).incrby(backend.client.make_key(key), delta)
+    except (ConnectionError, TimeoutError) as e:
+        logger.warning(f"Cache write skipped, cache unavailable: {e}")
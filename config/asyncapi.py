@@ -0,0 +1,81 @@
+"""
+Async read endpoints on top of DRF viewsets.
+
+DRF views are synchronous, so under a sync worker one slow query or cache
+call holds the whole worker. async_action() turns an async `a<action>`
+method of a viewset into a plain Django async view instead. It reuses the
+parts of DRF that do no I/O: the Request wrapper, the viewset's queryset,
+filter, pagination, permission and serializer code, its exception handling,
+and the JSON renderer. The methods themselves do their I/O through the async
+ORM and config.async_cache, so a waiting request only suspends a coroutine.
+
+Requests are authenticated like CachedJWTAuthentication, falling back to the
+session user, and answered in JSON only.
+"""
+from django.core.exceptions import ValidationError
+from django.http import Http404, HttpResponse
+from rest_framework.exceptions import MethodNotAllowed, NotAuthenticated
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+from users.authentication import CachedJWTAuthentication
+
+from .replicas import aresolve_pin
+
+
+class AsyncReadMixin:
+    """Async counterparts of GenericAPIView helpers."""
+    async def aget_object(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            obj = await queryset.aget(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except (queryset.model.DoesNotExist, TypeError, ValueError, ValidationError):
+            raise Http404
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+
+async def authenticate(request):
+    authenticated = await CachedJWTAuthentication().aauthenticate(request)
+    if authenticated is not None:
+        return authenticated
+    return await request.auser(), None
+
+
+def render(viewset, request, response):
+    if not isinstance(response, Response):
+        return response
+    viewset.finalize_response(request, response)
+    rendered = HttpResponse(response.rendered_content, status=response.status_code, content_type=response.content_type)
+    for header, value in response.items():
+        rendered[header] = value
+    return rendered
+
+
+def async_action(viewset_class, action, basename):
+    """A Django async view answering GET requests with viewset_class.a<action>()."""
+    async def view(request, *args, **kwargs):
+        drf_request = Request(request)
+        drf_request.accepted_renderer = JSONRenderer()
+        drf_request.accepted_media_type = JSONRenderer.media_type
+        viewset = viewset_class(
+            request=drf_request, args=args, kwargs=kwargs, format_kwarg=None,
+            action=action, basename=basename, headers={},
+        )
+        try:
+            if request.method not in ('GET', 'HEAD'):
+                raise MethodNotAllowed(request.method)
+            drf_request.user, drf_request.auth = await authenticate(request)
+            if not drf_request.user.is_authenticated:
+                raise NotAuthenticated()
+            await aresolve_pin(drf_request.user)
+            viewset.check_permissions(drf_request)
+            response = await getattr(viewset, f'a{action}')(drf_request, *args, **kwargs)
+        except Exception as exc:
+            response = viewset.handle_exception(exc)
+        return render(viewset, drf_request, response)
+
+    view.__name__ = f'{viewset_class.__name__}.a{action}'
+    return view
@@ -0,0 +1,71 @@
+"""
+Database settings from DATABASE_URL.
+
+Without pooling, connections persist for DATABASE_CONN_MAX_AGE seconds and
+are health-checked before a request reuses them, so a connection the server
+dropped costs a reconnect instead of a failed request.
+
+Under ASGI (config/asgi.py) DATABASE_CONN_MAX_AGE defaults to 0: the sync
+ORM calls of each request run in a fresh thread-sensitive context, so a
+persistent connection is left behind by its request instead of being reused,
+and they pile up. Connections are reused there through DATABASE_POOL.
+
+With DATABASE_POOL on PostgreSQL, every worker process keeps a psycopg pool
+instead: requests take a connection, which is checked on the way out of the
+pool, and hand it back when they finish. Pool sizes are per process. By
+default the connections the app may hold on one host, DATABASE_MAX_CONNECTIONS,
+are split evenly between the WEB_CONCURRENCY worker processes, and each pool
+must be able to serve all WEB_THREADS threads of its worker at once.
+
+Inconsistent pool settings raise ImproperlyConfigured when the settings load.
+"""
+import dj_database_url
+from django.core.exceptions import ImproperlyConfigured
+
+POSTGRESQL_ENGINE = 'django.db.backends.postgresql'
+
+
+def database_config(url, conn_max_age=60, pool=False, pool_min_size=None, pool_max_size=None, pool_timeout=10,
+                    max_connections=20, workers=1, threads=1):
+    config = dj_database_url.parse(url, conn_max_age=conn_max_age, conn_health_checks=conn_max_age != 0)
+    if not pool:
+        return config
+
+    if config['ENGINE'] != POSTGRESQL_ENGINE:
+        raise ImproperlyConfigured(f"DATABASE_POOL needs a PostgreSQL DATABASE_URL, not {config['ENGINE']}.")
+    if pool_max_size is None:
+        pool_max_size = max_connections // workers
+        if pool_max_size < 1:
+            raise ImproperlyConfigured(
+                f"DATABASE_MAX_CONNECTIONS={max_connections} leaves no connection for each of "
+                f"WEB_CONCURRENCY={workers} workers."
+            )
+    if pool_max_size < threads:
+        raise ImproperlyConfigured(
+            f"A pool of {pool_max_size} connection(s) per worker cannot serve WEB_THREADS={threads} threads; "
+            f"raise DATABASE_MAX_CONNECTIONS or DATABASE_POOL_MAX_SIZE."
+        )
+    if pool_min_size is None:
+        pool_min_size = min(threads, pool_max_size)
+    if not 0 <= pool_min_size <= pool_max_size:
+        raise ImproperlyConfigured(
+            f"DATABASE_POOL_MIN_SIZE={pool_min_size} must be between 0 and the pool size {pool_max_size}."
+        )
+
+    try:
+        import psycopg  # noqa: F401 -- Django only pools with psycopg 3.
+        from psycopg_pool import ConnectionPool
+    except ImportError:
+        raise ImproperlyConfigured("DATABASE_POOL needs psycopg 3 and psycopg_pool: pip install 'psycopg[binary,pool]'.")
+
+    # Pooled connections go back to the pool after every request; Django
+    # refuses CONN_MAX_AGE together with a pool.
+    config['CONN_MAX_AGE'] = 0
+    config['CONN_HEALTH_CHECKS'] = False
+    config.setdefault('OPTIONS', {})['pool'] = {
+        'min_size': pool_min_size,
+        'max_size': pool_max_size,
+        'timeout': pool_timeout,
+        'check': ConnectionPool.check_connection,
+    }
+    return config
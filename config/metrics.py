@@ -0,0 +1,127 @@
+"""
+Aggregate metrics in the Prometheus text format, served at /metrics.
+
+Request rate and latency by route, cache hit ratios, database pool usage,
+email send latency, the email outbox and password hashing queues, and
+failures in appointments.signals.
+
+Each process only updates its own values. With PROMETHEUS_MULTIPROC_DIR set
+(before the process starts), prometheus_client keeps them in memory-mapped
+files in that directory, and a scrape of any gunicorn worker sums the files
+of all of them, and of the email outbox worker if it shares the directory.
+gunicorn.conf.py empties the directory on start and retires the gauges of
+exited workers. Without it, a scrape shows the serving process only.
+
+Scraping is opt-in: the endpoint answers requests bearing METRICS_TOKEN, or
+coming from METRICS_ALLOWED_IPS, and refuses everything else. Behind a
+reverse proxy every request comes from the proxy's address, so there use the
+token, or block /metrics at the proxy.
+"""
+import hmac
+import os
+import time
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Count
+from django.http import HttpResponse, HttpResponseForbidden
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Seconds between refreshes of a process's pool gauges.
+POOL_REFRESH_SECONDS = 1.0
+
+REQUESTS = Counter('http_requests', 'Requests by route, method and status.', ['route', 'method', 'status'])
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Request latency by route.', ['route', 'method'], buckets=LATENCY_BUCKETS,
+)
+CACHE_LOOKUPS = Counter('cache_lookups', 'Cache lookups by cache and result.', ['cache', 'result'])
+DB_POOL_CONNECTIONS = Gauge(
+    'db_pool_connections', 'Pooled database connections by state.', ['alias', 'state'], multiprocess_mode='livesum',
+)
+DB_POOL_MAX = Gauge('db_pool_max_connections', 'Pool size limits.', ['alias'], multiprocess_mode='livesum')
+DB_POOL_WAITING = Gauge(
+    'db_pool_requests_waiting', 'Requests waiting for a pooled connection.', ['alias'], multiprocess_mode='livesum',
+)
+EMAIL_SEND_LATENCY = Histogram(
+    'email_send_duration_seconds', 'SMTP send time per email by outcome.', ['outcome'], buckets=LATENCY_BUCKETS,
+)
+PASSWORD_HASH_SLOTS = Gauge(
+    'password_hash_slots_in_use', 'Password hashes running or queued.', multiprocess_mode='livesum',
+)
+SIGNAL_FAILURES = Counter('appointment_signal_failures', 'Failures in appointments.signals by receiver.', ['receiver'])
+
+_pools_refreshed = 0.0
+
+
+def observe_request(route, method, status, seconds):
+    REQUESTS.labels(route, method, status).inc()
+    REQUEST_LATENCY.labels(route, method).observe(seconds)
+    refresh_pool_gauges()
+
+
+def count_cache_lookup(cache, hit):
+    CACHE_LOOKUPS.labels(cache, 'hit' if hit else 'miss').inc()
+
+
+def refresh_pool_gauges():
+    global _pools_refreshed
+    now = time.monotonic()
+    if now - _pools_refreshed < POOL_REFRESH_SECONDS:
+        return
+    _pools_refreshed = now
+    for connection in connections.all(initialized_only=True):
+        if connection.vendor != 'postgresql' or not connection.settings_dict['OPTIONS'].get('pool'):
+            continue
+        stats = connection.pool.get_stats()
+        available = stats.get('pool_available', 0)
+        DB_POOL_CONNECTIONS.labels(connection.alias, 'idle').set(available)
+        DB_POOL_CONNECTIONS.labels(connection.alias, 'in_use').set(stats.get('pool_size', 0) - available)
+        DB_POOL_MAX.labels(connection.alias).set(stats.get('pool_max', 0))
+        DB_POOL_WAITING.labels(connection.alias).set(stats.get('requests_waiting', 0))
+
+
+class OutboxCollector:
+    """Emails waiting in the outbox, counted at scrape time."""
+    def collect(self):
+        from notifications.models import OutboundEmail
+
+        family = GaugeMetricFamily('email_outbox_messages', 'Outbox emails not sent yet, by status.', labels=['status'])
+        counts = dict.fromkeys(['PENDING', 'FAILED'], 0)
+        rows = OutboundEmail.objects.filter(status__in=counts).order_by().values_list('status').annotate(n=Count('id'))
+        counts.update(rows)
+        for status, count in counts.items():
+            family.add_metric([status.lower()], count)
+        yield family
+
+
+def registry():
+    """The registry a scrape reads: every process's files, or this process."""
+    if not os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        return REGISTRY
+    aggregated = CollectorRegistry()
+    multiprocess.MultiProcessCollector(aggregated)
+    return aggregated
+
+
+def may_scrape(request):
+    token = settings.METRICS_TOKEN
+    if token:
+        scheme, _, given = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+        if scheme == 'Bearer' and hmac.compare_digest(given.encode(), token.encode()):
+            return True
+    return request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
+
+
+def metrics_view(request):
+    if not may_scrape(request):
+        return HttpResponseForbidden()
+    scraped = registry()
+    # Collected per scrape, so that it is counted once rather than per process.
+    outbox = CollectorRegistry()
+    outbox.register(OutboxCollector())
+    return HttpResponse(generate_latest(scraped) + generate_latest(outbox), content_type=CONTENT_TYPE_LATEST)
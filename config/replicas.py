@@ -0,0 +1,176 @@
+"""
+Read replicas with read-your-writes stickiness.
+
+ReplicaRoutingMiddleware opens a routing scope for each request. Inside it,
+ReplicaRouter sends the reads of GET, HEAD and OPTIONS requests to one
+replica, picked per request from DATABASE_REPLICAS. Everything else goes to
+the primary: writes, reads of other methods, reads inside a transaction on
+the primary, and all queries outside a request (management commands,
+workers).
+
+A request that writes pins its client to the primary for
+DATABASE_REPLICA_PIN_SECONDS, so that the next reads see the write despite
+replication lag. The pin is kept in two places: a cookie for browsers, and a
+cache marker for the authenticated user, for API clients that do not keep
+cookies. The marker is checked once the request's user is known, which for
+token authentication is only inside the view. Async views resolve it with
+aresolve_pin() right after authenticating, through config.async_cache, so
+the router never makes a blocking cache call for them.
+
+Data read from a replica may predate a write whose cache invalidation has
+already run, so caches filled from it use cache_timeout(), which keeps such
+entries no longer than the pin window.
+"""
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.functional import SimpleLazyObject, empty
+
+from . import async_cache
+
+PIN_COOKIE = 'db_primary_pin'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+current_request = ContextVar('replica_routing_request', default=None)
+
+
+def pin_key(user_pk):
+    return f'db:replica:pinned:{user_pk}'
+
+
+def known_user(request):
+    """The request's authenticated user, without loading a lazy session user."""
+    user = getattr(request, 'user', None)
+    if isinstance(user, SimpleLazyObject):
+        # Loading it here would query, and so route, recursively.
+        if user._wrapped is empty:
+            return None
+        user = user._wrapped
+    if user is None or not user.is_authenticated:
+        return None
+    return user
+
+
+class RoutingState:
+    def __init__(self, request):
+        self.request = request
+        self.replica = random.choice(settings.DATABASE_REPLICAS)
+        self.pinned = request.method not in SAFE_METHODS or PIN_COOKIE in request.COOKIES
+        self.checked_user = None
+        self.wrote = False
+        self.read_replica = False
+
+    def use_replica(self):
+        if self.pinned or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return False
+        user = known_user(self.request)
+        if user is not None and user.pk != self.checked_user:
+            self.checked_user = user.pk
+            self.pinned = bool(cache.get(pin_key(user.pk)))
+        return not self.pinned
+
+    async def acheck_user(self, user):
+        if self.pinned or user is None or not user.is_authenticated or user.pk == self.checked_user:
+            return
+        self.checked_user = user.pk
+        self.pinned = bool(await async_cache.aget(pin_key(user.pk)))
+
+    def pin(self, response):
+        seconds = settings.DATABASE_REPLICA_PIN_SECONDS
+        response.set_cookie(PIN_COOKIE, '1', max_age=seconds, httponly=True, samesite='Lax')
+        user = known_user(self.request)
+        if user is not None:
+            cache.set(pin_key(user.pk), True, seconds)
+
+    async def apin(self, response):
+        seconds = settings.DATABASE_REPLICA_PIN_SECONDS
+        response.set_cookie(PIN_COOKIE, '1', max_age=seconds, httponly=True, samesite='Lax')
+        user = known_user(self.request)
+        if user is not None:
+            await async_cache.aset(pin_key(user.pk), True, seconds)
+
+
+async def aresolve_pin(user):
+    """Look up the pin marker of the current request's user ahead of its reads."""
+    state = current_request.get()
+    if state is not None:
+        await state.acheck_user(user)
+
+
+def cache_timeout(timeout):
+    """Cache timeout for data read so far in the current request."""
+    state = current_request.get()
+    if state is None or not state.read_replica:
+        return timeout
+    seconds = settings.DATABASE_REPLICA_PIN_SECONDS
+    return seconds if timeout is None else min(timeout, seconds)
+
+
+class ReplicaRoutingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+        state = RoutingState(request)
+        token = current_request.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_request.reset(token)
+        if state.wrote:
+            state.pin(response)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return await self.get_response(request)
+        state = RoutingState(request)
+        token = current_request.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_request.reset(token)
+        if state.wrote:
+            await state.apin(response)
+        return response
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = current_request.get()
+        if state is None:
+            return None
+        # Explicitly the primary otherwise: left to Django, reads through
+        # an instance loaded from a replica would stay on that replica.
+        if not state.use_replica():
+            return DEFAULT_DB_ALIAS
+        state.read_replica = True
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = current_request.get()
+        if state is not None:
+            state.wrote = True
+            state.pinned = True
+        # Never the instance's own database, which may be a replica.
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
@@ -0,0 +1,175 @@
+"""
+Where a request's time goes.
+
+ServerTimingMiddleware times every request and counts it in the request
+metrics (see config/metrics.py) for its route, the URL name such as
+`appointment-list` or `appointment-reschedule` (for the DRF routers, the
+viewset's basename and action).
+
+A sample of requests, SERVER_TIMING_SAMPLE_RATE, is also broken down: SQL
+query count and time, cache hits and misses, and the time serializers spend
+building representations. The breakdown is sent in a Server-Timing header,
+which browser developer tools show next to the request, and logged as one
+JSON line on the `config.timing` logger. Outside sampled requests the hooks
+only look up a context variable, so the middleware can stay on in production.
+"""
+import json
+import logging
+import random
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+current_timing = ContextVar('request_timing', default=None)
+
+
+class RequestTiming:
+    """Breakdown of one sampled request."""
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.serialize = 0.0
+        self.serializing = False
+
+    def header(self, total):
+        return ', '.join([
+            f'db;dur={self.db * 1000:.1f};desc="{self.queries} queries"',
+            f'cache;desc="{self.cache_hits} hits {self.cache_misses} misses"',
+            f'serialize;dur={self.serialize * 1000:.1f}',
+            f'total;dur={total * 1000:.1f}',
+        ])
+
+    def log(self, request, response, route, total):
+        logger.info(json.dumps({
+            'method': request.method,
+            'route': route,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 1),
+            'db_queries': self.queries,
+            'db_ms': round(self.db * 1000, 1),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+            'serialize_ms': round(self.serialize * 1000, 1),
+        }))
+
+
+def route_of(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        # One bucket for every unmatched path, whatever was requested.
+        return 'unmatched'
+    return match.url_name or match.view_name or match._func_path
+
+
+def record_query(execute, sql, params, many, context):
+    timing = current_timing.get()
+    if timing is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timing.db += time.perf_counter() - start
+        timing.queries += 1
+
+
+def instrument(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def instrument_connection(sender, connection, **kwargs):
+    instrument(connection)
+
+
+# Every connection a worker opens later, in whatever thread.
+connection_created.connect(instrument_connection)
+
+
+def count_cache(cache, hit):
+    """Count a lookup in the named cache, and towards the current request's breakdown."""
+    metrics.count_cache_lookup(cache, hit)
+    timing = current_timing.get()
+    if timing is None:
+        return
+    if hit:
+        timing.cache_hits += 1
+    else:
+        timing.cache_misses += 1
+
+
+class TimedSerializerMixin:
+    """Counts time spent in to_representation() towards the request's breakdown.
+
+    Nested serializers run inside their parent's time and are not counted again.
+    """
+    def to_representation(self, instance):
+        timing = current_timing.get()
+        if timing is None or timing.serializing:
+            return super().to_representation(instance)
+        timing.serializing = True
+        start = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            timing.serialize += time.perf_counter() - start
+            timing.serializing = False
+
+
+class ServerTimingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        # Connections opened before the middleware was loaded.
+        for connection in connections.all(initialized_only=True):
+            instrument(connection)
+
+    def start(self):
+        if random.random() >= settings.SERVER_TIMING_SAMPLE_RATE:
+            return None, None
+        timing = RequestTiming()
+        return timing, current_timing.set(timing)
+
+    def finish(self, request, response, timing, total):
+        route = route_of(request)
+        metrics.observe_request(route, request.method, response.status_code, total)
+        if timing is not None:
+            response['Server-Timing'] = timing.header(total)
+            timing.log(request, response, route, total)
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timing, token = self.start()
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            if token is not None:
+                current_timing.reset(token)
+        return self.finish(request, response, timing, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        timing, token = self.start()
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            if token is not None:
+                current_timing.reset(token)
+        return self.finish(request, response, timing, time.perf_counter() - start)
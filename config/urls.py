@@ -2,11 +2,13 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
-from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
-from users.views import UserRegistrationView, LogoutView, GoogleSignInView, google_auth_callback, SetUserRoleView
+from rest_framework_simplejwt.views import TokenRefreshView
+from config.metrics import metrics_view
+from users.views import TokenObtainPairView, UserRegistrationView, LogoutView, GoogleSignInView, google_auth_callback, SetUserRoleView
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
     path('api/users/', include('users.urls')),
     path('api/appointments/', include('appointments.urls')),
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
@@ -0,0 +1,33 @@
+"""
+gunicorn settings.
+
+WEB_CONCURRENCY worker processes (read by gunicorn itself) with WEB_THREADS
+threads each; settings size the database pool from the same variables. With
+more than one thread, workers serve requests concurrently, which is what
+lets the password hashing queue (users/hashing.py) fill up and shed load.
+
+Workers only write metrics to PROMETHEUS_MULTIPROC_DIR when it is set in
+their environment, e.g. PROMETHEUS_MULTIPROC_DIR=/run/healthcare-metrics;
+see config/metrics.py.
+"""
+import os
+import shutil
+
+threads = int(os.environ.get('WEB_THREADS', 1))
+worker_class = 'gthread' if threads > 1 else 'sync'
+
+
+def on_starting(server):
+    # Files left by a previous run would be added to this one's counters.
+    path = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+    if path:
+        shutil.rmtree(path, ignore_errors=True)
+        os.makedirs(path)
+
+
+def child_exit(server, worker):
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+
+        # Drops the exited worker's gauges; its counts stay in the totals.
+        multiprocess.mark_process_dead(worker.pid)
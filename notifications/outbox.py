@@ -0,0 +1,126 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from config.metrics import EMAIL_SEND_LATENCY
+
+from .models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_email(subject, message, recipient_list, from_email=None):
+    """
+    Queue an email for the outbox worker. The row is written in the caller's
+    transaction: it commits with the work that caused it, so neither a
+    rollback nor a crash after commit can leave the two disagreeing, and the
+    worker only sees it once committed.
+    """
+    enqueue_emails([
+        {'subject': subject, 'message': message, 'recipient_list': recipient_list, 'from_email': from_email},
+    ])
+
+
+def enqueue_emails(messages):
+    """Queue several emails with a single INSERT."""
+    rows = [
+        OutboundEmail(
+            subject=message['subject'],
+            body=message['message'],
+            from_email=message.get('from_email') or settings.DEFAULT_FROM_EMAIL,
+            recipients=list(message['recipient_list']),
+        )
+        for message in messages
+        if message['recipient_list']
+    ]
+    if rows:
+        OutboundEmail.objects.bulk_create(rows)
+
+
+def retry_delay(attempts):
+    base = settings.EMAIL_OUTBOX_RETRY_BASE_SECONDS
+    return timedelta(seconds=min(base * 2 ** (attempts - 1), settings.EMAIL_OUTBOX_RETRY_MAX_SECONDS))
+
+
+def claim_batch(batch_size):
+    """
+    Lease up to batch_size due emails to this worker by moving their
+    next_attempt_at EMAIL_OUTBOX_LEASE_SECONDS ahead, in a short transaction.
+
+    Rows are locked with SKIP LOCKED where supported, so several workers can
+    drain the outbox concurrently. An email whose worker dies mid-send becomes
+    due again when its lease runs out.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        batch = list(
+            OutboundEmail.objects.select_for_update(skip_locked=True)
+            .filter(status='PENDING', next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'id')[:batch_size]
+        )
+        if batch:
+            lease = now + timedelta(seconds=settings.EMAIL_OUTBOX_LEASE_SECONDS)
+            OutboundEmail.objects.filter(pk__in=[email.pk for email in batch]).update(next_attempt_at=lease)
+    return batch
+
+
+def send_pending(batch_size=None):
+    """
+    Send one batch of due emails over a single SMTP connection.
+
+    The batch is claimed first (see claim_batch) and sent outside any
+    transaction, each result being saved as soon as it is known. Failed sends
+    are retried with exponential backoff until EMAIL_OUTBOX_MAX_ATTEMPTS is
+    reached. Returns a (sent, failed) tuple for the batch.
+    """
+    batch = claim_batch(batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE)
+    sent = failed = 0
+    if not batch:
+        return sent, failed
+
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:
+        logger.error(f"Could not open email connection: {e}")
+        for email in batch:
+            _record_failure(email, e)
+        return sent, len(batch)
+
+    try:
+        for email in batch:
+            message = EmailMessage(email.subject, email.body, email.from_email, email.recipients, connection=connection)
+            start = time.perf_counter()
+            try:
+                connection.send_messages([message])
+            except Exception as e:
+                EMAIL_SEND_LATENCY.labels('failed').observe(time.perf_counter() - start)
+                logger.warning(f"Sending email {email.pk} failed (attempt {email.attempts + 1}): {e}")
+                _record_failure(email, e)
+                failed += 1
+            else:
+                EMAIL_SEND_LATENCY.labels('sent').observe(time.perf_counter() - start)
+                email.status = 'SENT'
+                email.attempts += 1
+                email.sent_at = timezone.now()
+                email.last_error = ''
+                email.save(update_fields=['status', 'attempts', 'sent_at', 'last_error'])
+                sent += 1
+    finally:
+        connection.close()
+    return sent, failed
+
+
+def _record_failure(email, error):
+    email.attempts += 1
+    email.last_error = str(error)
+    if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+        email.status = 'FAILED'
+    else:
+        email.next_attempt_at = timezone.now() + retry_delay(email.attempts)
+    email.save(update_fields=['status', 'attempts', 'next_attempt_at', 'last_error'])
@@ -0,0 +1,127 @@
+import io
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.core import mail
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from prometheus_client import REGISTRY
+from rest_framework.test import APITestCase
+
+from .models import OutboundEmail
+from .outbox import enqueue_email, enqueue_emails, send_pending
+
+
+class OutboxTests(TestCase):
+    def test_enqueue_writes_in_callers_transaction(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            enqueue_email('Hello', 'Body', ['patient@example.com'])
+        self.assertEqual(callbacks, [])
+        email = OutboundEmail.objects.get()
+        self.assertEqual(email.recipients, ['patient@example.com'])
+        self.assertEqual(email.status, 'PENDING')
+
+    def test_rolled_back_transaction_enqueues_nothing(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    enqueue_email('Hello', 'Body', ['patient@example.com'])
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertFalse(OutboundEmail.objects.exists())
+
+    def test_batch_is_sent_over_one_connection(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            enqueue_emails([
+                {'subject': f'Message {i}', 'message': 'Body', 'recipient_list': [f'user{i}@example.com']}
+                for i in range(3)
+            ])
+        with patch('notifications.outbox.get_connection', wraps=mail.get_connection) as get_connection:
+            self.assertEqual(send_pending(), (3, 0))
+        self.assertEqual(get_connection.call_count, 1)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(OutboundEmail.objects.filter(status='SENT').count(), 3)
+        self.assertEqual(send_pending(), (0, 0))
+
+    @override_settings(EMAIL_OUTBOX_MAX_ATTEMPTS=2, EMAIL_OUTBOX_RETRY_BASE_SECONDS=60)
+    def test_failures_back_off_then_give_up(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            enqueue_email('Hello', 'Body', ['patient@example.com'])
+        with patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError('SMTP down')):
+            self.assertEqual(send_pending(), (0, 1))
+            email = OutboundEmail.objects.get()
+            self.assertEqual((email.status, email.attempts, email.last_error), ('PENDING', 1, 'SMTP down'))
+            self.assertGreater(email.next_attempt_at, timezone.now() + timedelta(seconds=50))
+
+            # Not due yet.
+            self.assertEqual(send_pending(), (0, 0))
+            OutboundEmail.objects.update(next_attempt_at=timezone.now())
+            self.assertEqual(send_pending(), (0, 1))
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('FAILED', 2))
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_sends_are_saved_one_by_one_outside_the_claim(self):
+        enqueue_emails([
+            {'subject': f'Message {i}', 'message': 'Body', 'recipient_list': ['user@example.com']}
+            for i in range(2)
+        ])
+
+        def send_messages(messages):
+            # Claimed rows are leased away from other workers while sending.
+            self.assertFalse(OutboundEmail.objects.filter(next_attempt_at__lte=timezone.now()).exists())
+            if messages[0].subject == 'Message 1':
+                raise KeyboardInterrupt
+            return 1
+
+        with patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=send_messages):
+            with self.assertRaises(KeyboardInterrupt):
+                send_pending()
+        self.assertEqual(
+            dict(OutboundEmail.objects.values_list('subject', 'status')),
+            {'Message 0': 'SENT', 'Message 1': 'PENDING'},
+        )
+        self.assertEqual(send_pending(), (0, 0))
+        with override_settings(EMAIL_OUTBOX_LEASE_SECONDS=0):
+            OutboundEmail.objects.filter(status='PENDING').update(next_attempt_at=timezone.now())
+            self.assertEqual(send_pending(), (1, 0))
+
+    def test_send_latency_is_recorded(self):
+        def sends(outcome):
+            return REGISTRY.get_sample_value('email_send_duration_seconds_count', {'outcome': outcome}) or 0
+
+        sent, failed = sends('sent'), sends('failed')
+        with self.captureOnCommitCallbacks(execute=True):
+            enqueue_emails([
+                {'subject': f'Message {i}', 'message': 'Body', 'recipient_list': ['user@example.com']}
+                for i in range(2)
+            ])
+        with patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=[1, OSError('SMTP down')]):
+            self.assertEqual(send_pending(), (1, 1))
+        self.assertEqual((sends('sent') - sent, sends('failed') - failed), (1, 1))
+
+    def test_worker_command_drains_outbox(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            enqueue_emails([
+                {'subject': f'Message {i}', 'message': 'Body', 'recipient_list': ['user@example.com']}
+                for i in range(5)
+            ])
+        call_command('process_email_outbox', once=True, batch_size=2, stdout=io.StringIO())
+        self.assertEqual(len(mail.outbox), 5)
+
+
+class OutboxIntegrationTests(APITestCase):
+    def test_registration_queues_verification_email(self):
+        data = {'username': 'newuser', 'email': 'new@example.com', 'password': 'testpass123', 'password_confirm': 'testpass123'}
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('user-register'), data)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(mail.outbox), 0)
+        email = OutboundEmail.objects.get()
+        self.assertEqual(email.subject, 'Email Verification')
+        send_pending()
+        self.assertEqual(mail.outbox[0].to, ['new@example.com'])
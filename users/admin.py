@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from .models import User, DoctorProfile, PatientProfile
+from .services import ensure_profile
 
 
 class DoctorProfileInline(admin.StackedInline):
@@ -25,6 +26,11 @@ class CustomUserAdmin(BaseUserAdmin):
         }),
     )
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # After the inlines, so a profile entered there is not created twice.
+        ensure_profile(form.instance)
+
 
 admin.site.register(User, CustomUserAdmin)
 admin.site.register(DoctorProfile)
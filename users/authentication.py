@@ -0,0 +1,113 @@
+"""
+JWT authentication with a cached user lookup.
+
+simplejwt's JWTAuthentication loads the user row on every request. Here the
+user is kept in the cache next to a per-user version counter, and both are
+read with a single round trip. Any save or delete of the user, and any
+change to their profile, bumps the version after commit, so a stale copy
+(old roles, deactivated account, changed password) is never served once the
+change is visible in the database.
+
+Role claims are deliberately not embedded in the token: they would stay
+valid until the token expires, however the account changes.
+
+aauthenticate() does the same for plain async views, with the async cache
+client and the async ORM.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from config import async_cache
+from config.replicas import cache_timeout
+from config.timing import count_cache
+
+
+def user_cache_keys(user_id):
+    return f'users:auth:version:{user_id}', f'users:auth:user:{user_id}'
+
+
+def bump_user_version(user_id):
+    version_key, _ = user_cache_keys(user_id)
+    try:
+        cache.incr(version_key)
+    except ValueError:
+        cache.set(version_key, time.time_ns(), None)
+
+
+def invalidate_cached_user(user_id):
+    transaction.on_commit(lambda: bump_user_version(user_id))
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    def get_user_id(self, validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+    def check_user(self, user):
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return user
+
+    def get_user(self, validated_token):
+        user_id = self.get_user_id(validated_token)
+        version_key, user_key = user_cache_keys(user_id)
+        values = cache.get_many([version_key, user_key])
+        version, entry = values.get(version_key), values.get(user_key)
+        hit = version is not None and entry is not None and entry[0] == version
+        count_cache('auth_user', hit)
+        if hit:
+            user = entry[1]
+        else:
+            if version is None:
+                # Seeded from the clock so an evicted counter never comes
+                # back at a value an old entry was stored under.
+                seed = time.time_ns()
+                version = seed if cache.add(version_key, seed, None) else cache.get(version_key)
+            try:
+                # The password hash is left out of the cached copy.
+                user = self.user_model.objects.defer('password').get(**{api_settings.USER_ID_FIELD: user_id})
+            except self.user_model.DoesNotExist:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            if version is not None:
+                cache.set(user_key, (version, user), cache_timeout(settings.AUTH_USER_CACHE_TIMEOUT))
+        return self.check_user(user)
+
+    async def aget_user(self, validated_token):
+        user_id = self.get_user_id(validated_token)
+        version_key, user_key = user_cache_keys(user_id)
+        values = await async_cache.aget_many([version_key, user_key])
+        version, entry = values.get(version_key), values.get(user_key)
+        hit = version is not None and entry is not None and entry[0] == version
+        count_cache('auth_user', hit)
+        if hit:
+            return self.check_user(entry[1])
+
+        if version is None:
+            seed = time.time_ns()
+            version = seed if await async_cache.aadd(version_key, seed, None) else await async_cache.aget(version_key)
+        try:
+            user = await self.user_model.objects.defer('password').aget(**{api_settings.USER_ID_FIELD: user_id})
+        except self.user_model.DoesNotExist:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if version is not None:
+            await async_cache.aset(user_key, (version, user), cache_timeout(settings.AUTH_USER_CACHE_TIMEOUT))
+        return self.check_user(user)
+
+    async def aauthenticate(self, request):
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
@@ -0,0 +1,82 @@
+"""
+Public doctor directory.
+
+The directory looks the same to every caller, so whole responses are cached
+in the shared cache under a single generation counter, keyed by URL (filters
+and cursor) and Accept header. Any change to a doctor, their profile or
+their rating totals bumps the counter after commit, which orphans every
+cached page at once. The ETag is derived from the cache key, so a client
+revalidating an unchanged page gets a 304 without a database query.
+
+When the counter cannot be read (the cache is down), the key would stay the
+same across changes, so pages are then served uncached and without an ETag.
+"""
+import functools
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import patch_cache_control
+from rest_framework.response import Response
+
+from appointments import conditional
+from config.replicas import cache_timeout
+from config.timing import count_cache
+from appointments.cache import bump_on_commit, get_generations
+from appointments.pagination import KeysetPagination
+
+GENERATION_KEY = 'users:directory:gen'
+
+
+def invalidate_directory():
+    bump_on_commit([GENERATION_KEY])
+
+
+def response_key(view, request):
+    """The cache key of a page, or None without a current generation."""
+    generation, = get_generations([GENERATION_KEY])
+    if generation is None:
+        return None
+    digest = hashlib.sha1()
+    digest.update(request.build_absolute_uri().encode())
+    digest.update(request.META.get('HTTP_ACCEPT', '').encode())
+    return f'users:directory:response:{view.action}:{generation}:{digest.hexdigest()}'
+
+
+def set_public_validators(response, etag):
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=settings.DOCTOR_DIRECTORY_MAX_AGE)
+    return response
+
+
+def cached_directory_response(view_method):
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        timeout = settings.DOCTOR_DIRECTORY_CACHE_TIMEOUT
+        if not timeout:
+            return view_method(self, request, *args, **kwargs)
+
+        key = response_key(self, request)
+        if key is None:
+            return view_method(self, request, *args, **kwargs)
+        etag = f'W/"{hashlib.sha1(key.encode()).hexdigest()}"'
+        if conditional.is_conditional(request):
+            response = conditional.not_modified(request, etag)
+            if response is not None:
+                return set_public_validators(response, etag)
+
+        data = cache.get(key)
+        count_cache('doctor_directory', data is not None)
+        if data is None:
+            response = view_method(self, request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            cache.set(key, response.data, cache_timeout(timeout))
+        else:
+            response = Response(data)
+        return set_public_validators(response, etag)
+    return wrapper
+
+
+class DoctorDirectoryPagination(KeysetPagination):
+    ordering = ('id',)
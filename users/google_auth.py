@@ -0,0 +1,154 @@
+"""
+Google ID token verification with cached signing keys.
+
+google.oauth2.id_token fetches Google's certificates on every call. Here the
+certificates are kept in process memory and in the shared Django cache for
+as long as the certificate response's Cache-Control max-age allows, and are
+refreshed in a background thread shortly before they expire. A token signed
+with a key id that is not in the cached set triggers an immediate refetch,
+rate limited so that tokens with made-up key ids cannot hammer Google.
+
+Verification itself still goes through id_token.verify_oauth2_token; the
+cache is plugged in as its HTTP transport.
+"""
+import json
+import logging
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from google.auth import exceptions, jwt, transport
+from google.auth.transport import requests as google_requests
+from google.oauth2 import id_token
+
+logger = logging.getLogger(__name__)
+
+# The URL id_token.verify_oauth2_token asks its transport for.
+GOOGLE_CERTS_URL = 'https://www.googleapis.com/oauth2/v1/certs'
+MAX_AGE_RE = re.compile(r'max-age=(\d+)')
+
+
+class CertsResponse(transport.Response):
+    def __init__(self, certs):
+        self._data = json.dumps(certs).encode('utf-8')
+
+    @property
+    def status(self):
+        return 200
+
+    @property
+    def headers(self):
+        return {'content-type': 'application/json'}
+
+    @property
+    def data(self):
+        return self._data
+
+
+class SigningKeyCache:
+    cache_key = 'google:oauth2:certs'
+    lock_key = 'google:oauth2:certs:refreshing'
+    # Used when the certificate response carries no max-age.
+    default_max_age = 300
+    # Refresh in the background once less than this many seconds are left.
+    refresh_margin = 300
+    # Minimum seconds between refetches caused by an unknown key id.
+    unknown_kid_interval = 30
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entry = None
+        self._refreshing = False
+        self._transport = None
+
+    def clear(self):
+        with self._lock:
+            self._entry = None
+        cache.delete(self.cache_key)
+
+    def get(self, kid=None):
+        """Return a {key id: certificate} mapping that is fresh and knows kid."""
+        entry = self._fresh(self._entry) or self._fresh(cache.get(self.cache_key))
+        if entry is None:
+            entry = self.fetch()
+        elif kid is not None and kid not in entry['certs'] and time.time() - entry['fetched_at'] > self.unknown_kid_interval:
+            logger.info(f"Unknown Google signing key id {kid}; refetching certificates")
+            entry = self.fetch()
+        elif entry['expires_at'] - time.time() < self.refresh_margin:
+            self.refresh_in_background()
+        self._entry = entry
+        return entry['certs']
+
+    def _fresh(self, entry):
+        if entry is not None and entry['expires_at'] > time.time():
+            return entry
+        return None
+
+    def fetch(self):
+        if self._transport is None:
+            self._transport = google_requests.Request()
+        response = self._transport(settings.GOOGLE_OAUTH2_CERTS_URL, method='GET')
+        if response.status != 200:
+            raise exceptions.TransportError(f'Could not fetch Google certificates: HTTP {response.status}')
+        certs = json.loads(response.data.decode('utf-8'))
+
+        match = MAX_AGE_RE.search(response.headers.get('cache-control', ''))
+        max_age = int(match.group(1)) if match else self.default_max_age
+        max_age -= int(response.headers.get('age', 0) or 0)
+        now = time.time()
+        entry = {'certs': certs, 'fetched_at': now, 'expires_at': now + max(max_age, 0)}
+        with self._lock:
+            self._entry = entry
+        if max_age > 0:
+            cache.set(self.cache_key, entry, max_age)
+        return entry
+
+    def refresh_in_background(self):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        # One worker refreshes for everybody; the others pick the new keys
+        # up from the shared cache.
+        if not cache.add(self.lock_key, 1, 60):
+            self._refreshing = False
+            return
+        threading.Thread(target=self._refresh, daemon=True).start()
+
+    def _refresh(self):
+        try:
+            self.fetch()
+        except Exception as e:
+            logger.warning(f"Background refresh of Google certificates failed: {e}")
+        finally:
+            cache.delete(self.lock_key)
+            self._refreshing = False
+
+
+signing_keys = SigningKeyCache()
+
+
+class CachedCertsRequest(transport.Request):
+    """Transport that answers certificate requests from signing_keys."""
+    def __init__(self, kid=None):
+        self.kid = kid
+
+    def __call__(self, url, method='GET', body=None, headers=None, timeout=None, **kwargs):
+        if method == 'GET' and url == GOOGLE_CERTS_URL:
+            return CertsResponse(signing_keys.get(self.kid))
+        return google_requests.Request()(url, method=method, body=body, headers=headers, timeout=timeout, **kwargs)
+
+
+def token_key_id(token):
+    try:
+        return jwt.decode_header(token).get('kid')
+    except (ValueError, TypeError):
+        return None
+
+
+def verify_google_id_token(token):
+    """Verify a Google ID token for this app and return its claims."""
+    request = CachedCertsRequest(kid=token_key_id(token))
+    return id_token.verify_oauth2_token(token, request, settings.GOOGLE_CLIENT_ID)
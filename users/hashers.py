@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.contrib.auth import hashers
+
+from .hashing import offload
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """
+    Django's PBKDF2 hasher with the iteration count taken from the
+    PASSWORD_HASH_ITERATIONS setting, running on the bounded hashing pool.
+    Hashes made with another count are upgraded on the next login.
+    """
+    @property
+    def iterations(self):
+        return settings.PASSWORD_HASH_ITERATIONS or hashers.PBKDF2PasswordHasher.iterations
+
+    def encode(self, password, salt, iterations=None):
+        return offload(super().encode, password, salt, iterations)
+
+    def verify(self, password, encoded):
+        return offload(super().verify, password, encoded)
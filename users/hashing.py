@@ -0,0 +1,144 @@
+"""
+Bounded offloading of password hashing.
+
+Hashing and verifying passwords is deliberately slow and CPU bound. Every
+hash and verify made by users.hashers runs on a small per-process thread
+pool (hashlib releases the GIL while it works), so at most
+PASSWORD_HASH_WORKERS of them use CPU at once and the other request threads
+stay free for the rest of the API. Up to PASSWORD_HASH_QUEUE_SIZE more calls
+wait for a slot; beyond that they fail fast with HashingSaturated, which DRF
+renders as a 503 with Retry-After.
+
+The limits are per process, so they matter when one process serves several
+requests at once: gunicorn with WEB_THREADS (see gunicorn.conf.py), or ASGI.
+Saturation needs more concurrent logins per process than
+PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE_SIZE.
+
+Outside DRF views, where nothing maps APIExceptions (the admin login),
+HashingSaturatedMiddleware answers the same 503.
+
+The pool only protects request handling. Batch jobs that are parallel
+already, such as the user import, hash on their own threads with inline().
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.deprecation import MiddlewareMixin
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from config.metrics import PASSWORD_HASH_SLOTS
+
+_local = threading.local()
+_lock = threading.Lock()
+_pool = None
+
+
+class HashingSaturated(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'The server is busy. Please try again shortly.'
+    default_code = 'hashing_saturated'
+
+    def __init__(self):
+        super().__init__()
+        # DRF's exception handler turns this into the Retry-After header.
+        self.wait = settings.PASSWORD_HASH_RETRY_AFTER
+
+
+class HashingSaturatedMiddleware(MiddlewareMixin):
+    def process_exception(self, request, exception):
+        if not isinstance(exception, HashingSaturated):
+            return None
+        response = HttpResponse(exception.detail, status=exception.status_code, content_type='text/plain')
+        response['Retry-After'] = str(exception.wait)
+        return response
+
+
+class HashingPool:
+    def __init__(self, workers, queue_size):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='password-hash')
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+
+    def run(self, fn, *args):
+        # Hashers call themselves (verify encodes); nested calls run inline
+        # instead of waiting for a slot they may be holding.
+        if getattr(_local, 'in_pool', False):
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            raise HashingSaturated()
+        PASSWORD_HASH_SLOTS.inc()
+        try:
+            future = self._executor.submit(self._call, fn, args)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: self._release())
+        return future.result()
+
+    def _release(self):
+        PASSWORD_HASH_SLOTS.dec()
+        self._slots.release()
+
+    def _call(self, fn, args):
+        _local.in_pool = True
+        try:
+            return fn(*args)
+        finally:
+            _local.in_pool = False
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _lock:
+            if _pool is None:
+                _pool = HashingPool(settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_QUEUE_SIZE)
+    return _pool
+
+
+def configure(workers=None, queue_size=None):
+    """Replace the pool, e.g. to benchmark other sizes. None means the setting."""
+    global _pool
+    with _lock:
+        old, _pool = _pool, HashingPool(
+            workers or settings.PASSWORD_HASH_WORKERS,
+            settings.PASSWORD_HASH_QUEUE_SIZE if queue_size is None else queue_size,
+        )
+    if old is not None:
+        old.shutdown()
+    return _pool
+
+
+def offload(fn, *args):
+    if getattr(_local, 'in_pool', False):
+        return fn(*args)
+    return get_pool().run(fn, *args)
+
+
+@contextmanager
+def inline():
+    """Hash on the calling thread, bypassing the pool and its limits."""
+    previous = getattr(_local, 'in_pool', False)
+    _local.in_pool = True
+    try:
+        yield
+    finally:
+        _local.in_pool = previous
+
+
+def _forget_pool():
+    # A forked child inherits the pool but not its threads.
+    global _pool, _lock
+    _pool, _lock = None, threading.Lock()
+
+
+os.register_at_fork(after_in_child=_forget_pool)
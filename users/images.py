@@ -0,0 +1,141 @@
+"""
+Profile image variants.
+
+Uploads are stored as they arrive and flagged image_pending. The
+process_profile_images worker renders each pending upload once into resized
+WebP and JPEG variants, named after a hash of their content, and records
+them on the profile. Because a variant's URL changes whenever its bytes do,
+the media server can send the files with a far-future, immutable
+Cache-Control. Until an upload is processed the original is served.
+
+Replacing or clearing the image deletes the previous original and its
+variants once the change commits, and a worker that loses the race with a
+newer upload deletes what it rendered.
+"""
+import hashlib
+import io
+import logging
+import posixpath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from PIL import Image, ImageOps
+from rest_framework import serializers
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+
+
+def variant_name(image_name, size, fmt, content):
+    digest = hashlib.sha256(content).hexdigest()[:16]
+    return posixpath.join(posixpath.dirname(image_name), f'profile_{size}.{digest}.{fmt}')
+
+
+def variant_names(variants):
+    return {name for by_size in variants.values() for name in by_size.values()}
+
+
+def delete_on_commit(storage, names):
+    """Delete the named files once the current transaction commits."""
+    def delete():
+        for name in names:
+            try:
+                storage.delete(name)
+            except Exception as e:
+                # An orphaned file costs space, not correctness.
+                logger.warning(f"Could not delete {name}: {e}")
+    if names:
+        transaction.on_commit(delete)
+
+
+def render_variants(image):
+    """Write every size/format variant of an ImageField file; return {fmt: {size: name}}."""
+    with image.open('rb') as f:
+        source = Image.open(f)
+        source = ImageOps.exif_transpose(source)
+        source.load()
+    if source.mode not in ('RGB', 'RGBA'):
+        source = source.convert('RGBA' if 'A' in source.getbands() else 'RGB')
+
+    variants = {fmt: {} for fmt in FORMATS}
+    for size in settings.PROFILE_IMAGE_SIZES:
+        resized = source.copy()
+        resized.thumbnail((size, size), Image.LANCZOS)
+        for fmt, pil_format in FORMATS.items():
+            frame = resized.convert('RGB') if fmt == 'jpeg' else resized
+            buffer = io.BytesIO()
+            frame.save(buffer, pil_format, quality=settings.PROFILE_IMAGE_QUALITY)
+            content = buffer.getvalue()
+            name = variant_name(image.name, size, fmt, content)
+            if not image.storage.exists(name):
+                name = image.storage.save(name, ContentFile(content))
+            variants[fmt][str(size)] = name
+    return variants
+
+
+def process_pending(models, batch_size=20):
+    """Render variants for up to batch_size pending uploads per model; returns the count."""
+    processed = 0
+    for model in models:
+        for profile in model.objects.filter(image_pending=True).order_by('pk')[:batch_size]:
+            try:
+                variants = render_variants(profile.image)
+            except Exception as e:
+                # Undecodable uploads keep being served as they are.
+                logger.warning(f"Could not process image for {model.__name__} {profile.pk}: {e}")
+                variants = {}
+            with transaction.atomic():
+                current = model.objects.select_for_update().filter(pk=profile.pk).first()
+                # Skip the row if a newer upload replaced the image meanwhile,
+                # deleting what was rendered unless the row uses it already.
+                if current is None or current.image.name != profile.image.name or not current.image_pending:
+                    in_use = variant_names(current.image_variants) if current else set()
+                    delete_on_commit(profile.image.storage, variant_names(variants) - in_use)
+                    continue
+                current.image_variants = variants
+                current.image_pending = False
+                current.save(update_fields=['image_variants', 'image_pending'])
+            processed += 1
+    return processed
+
+
+class ProfileImageField(serializers.ImageField):
+    """
+    Accepts an upload and represents the profile's image by the URL of its
+    best variant: WebP (or ?image_format=jpeg) at PROFILE_IMAGE_DEFAULT_SIZE
+    (or ?image_size=). The absolute URL prefix is built once per request and
+    shared by every profile in the response.
+    """
+    def get_attribute(self, instance):
+        return instance
+
+    def to_representation(self, profile):
+        if not profile.image:
+            return None
+        request = self.context.get('request')
+        if request is None:
+            return None
+        name = self.pick_variant(profile.image_variants, request)
+        url = profile.image.storage.url(name) if name else profile.image.url
+        if '://' in url:
+            return url
+        if '_media_origin' not in self.context:
+            self.context['_media_origin'] = request.build_absolute_uri('/').rstrip('/')
+        return self.context['_media_origin'] + url
+
+    def pick_variant(self, variants, request):
+        fmt = request.query_params.get('image_format', 'webp')
+        by_size = variants.get(fmt if fmt in FORMATS else 'webp') or {}
+        if not by_size:
+            return None
+        wanted = request.query_params.get('image_size', settings.PROFILE_IMAGE_DEFAULT_SIZE)
+        try:
+            wanted = int(wanted)
+        except (TypeError, ValueError):
+            wanted = settings.PROFILE_IMAGE_DEFAULT_SIZE
+        # Smallest variant at least as large as requested, else the largest.
+        sizes = sorted(int(size) for size in by_size)
+        size = next((size for size in sizes if size >= wanted), sizes[-1])
+        return by_size[str(size)]
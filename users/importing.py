@@ -0,0 +1,138 @@
+"""
+Bulk user import.
+
+Rows are read lazily from CSV or JSON Lines and handled in fixed-size chunks.
+Each chunk is validated with one uniqueness query per unique field, its
+passwords are hashed in a process pool (directly, not through the request
+path's users.hashing pool), and its users and profiles are
+written with one bulk_create each inside a single transaction. Memory use
+depends on the chunk size, not on the size of the input.
+
+bulk_create bypasses User.save and the model signals. Nothing per user is
+cached for users that did not exist yet, but the public doctor directory
+lists every doctor, so a chunk that adds doctors invalidates it itself.
+"""
+import csv
+import itertools
+import json
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+
+from . import hashing
+from .directory import invalidate_directory
+from .models import User, PatientProfile, DoctorProfile
+from .serializers import UserImportSerializer
+
+FORMATS = ('csv', 'jsonl')
+# Passwords handed to a pool worker at a time.
+HASH_BATCH_SIZE = 16
+
+
+def read_rows(stream, fmt):
+    """Yield (line number, row) pairs; row is None for an unparsable line."""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            # Empty cells mean "not given", not an empty value.
+            yield reader.line_num, {key: value for key, value in row.items() if key and value not in ('', None)}
+        return
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row if isinstance(row, dict) else None
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while chunk := list(itertools.islice(rows, size)):
+        yield chunk
+
+
+def init_hash_worker():
+    # Workers started with "spawn" import nothing from the parent.
+    django.setup()
+
+
+def hash_password(password):
+    with hashing.inline():
+        return make_password(password)
+
+
+def hash_passwords(passwords, executor=None):
+    if executor is None:
+        return [hash_password(password) for password in passwords]
+    return list(executor.map(hash_password, passwords, chunksize=HASH_BATCH_SIZE))
+
+
+def validate_chunk(rows):
+    """Split a chunk into ([(line, data)], [(line, errors)])."""
+    valid, errors = [], []
+    for line, row in rows:
+        if row is None:
+            errors.append((line, {'non_field_errors': ['Could not parse this line.']}))
+            continue
+        serializer = UserImportSerializer(data=row)
+        if serializer.is_valid():
+            data = serializer.validated_data
+            data['username'] = User.normalize_username(data['username'])
+            data['email'] = User.objects.normalize_email(data['email'])
+            valid.append((line, data))
+        else:
+            errors.append((line, serializer.errors))
+
+    existing = {
+        'username': set(User.objects.filter(username__in=[data['username'] for _, data in valid]).values_list('username', flat=True)),
+        'email': set(User.objects.filter(email__in=[data['email'] for _, data in valid]).values_list('email', flat=True)),
+    }
+    accepted = []
+    for line, data in valid:
+        clashes = {
+            field: ['A user with that value already exists.']
+            for field in ('username', 'email') if data[field] in existing[field]
+        }
+        if clashes:
+            errors.append((line, clashes))
+            continue
+        existing['username'].add(data['username'])
+        existing['email'].add(data['email'])
+        accepted.append((line, data))
+    errors.sort(key=lambda error: error[0])
+    return accepted, errors
+
+
+def import_chunk(rows, executor=None):
+    """Import one chunk of (line, row) pairs; returns (created, errors)."""
+    accepted, errors = validate_chunk(rows)
+    passwords = hash_passwords([data.get('password') or None for _, data in accepted], executor)
+
+    users, profiles = [], []
+    for (_, data), password in zip(accepted, passwords):
+        user = User(
+            username=data['username'],
+            email=data['email'],
+            password=password,
+            first_name=data.get('first_name', ''),
+            last_name=data.get('last_name', ''),
+            is_patient=data['role'] == 'patient',
+            is_doctor=data['role'] == 'doctor',
+        )
+        if user.is_patient:
+            profiles.append(PatientProfile(user=user, date_of_birth=data.get('date_of_birth')))
+        else:
+            profiles.append(DoctorProfile(user=user, specialization=data['specialization']))
+        users.append(user)
+
+    doctor_profiles = [profile for profile in profiles if isinstance(profile, DoctorProfile)]
+    with transaction.atomic():
+        User.objects.bulk_create(users)
+        PatientProfile.objects.bulk_create([profile for profile in profiles if isinstance(profile, PatientProfile)])
+        DoctorProfile.objects.bulk_create(doctor_profiles)
+        if doctor_profiles:
+            invalidate_directory()
+    return len(users), errors
@@ -0,0 +1,74 @@
+import statistics
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from users import hashing
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure login throughput and latency through the token endpoint with "
+        "concurrent clients, for each given password hashing pool size."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', default='1,2,4', help='Comma-separated hashing pool sizes to try.')
+        parser.add_argument('--queue-size', type=int, default=None)
+        parser.add_argument('--clients', type=int, default=8, help='Concurrent login clients.')
+        parser.add_argument('--requests', type=int, default=5, help='Logins per client.')
+
+    def handle(self, *args, **options):
+        username = f'bench-login-{uuid.uuid4().hex[:8]}'
+        password = 'bench-password'
+        user = User.objects.create_user(username=username, email=f'{username}@example.com', password=password, is_patient=True)
+        try:
+            for workers in [int(value) for value in options['workers'].split(',')]:
+                hashing.configure(workers, options['queue_size'])
+                self.report(workers, *self.run(username, password, options['clients'], options['requests']))
+        finally:
+            hashing.configure()
+            user.delete()
+
+    def run(self, username, password, clients, requests):
+        url = reverse('token_obtain_pair')
+        latencies, statuses = [], []
+        lock = threading.Lock()
+
+        def client():
+            http = Client(SERVER_NAME='localhost')
+            try:
+                for _ in range(requests):
+                    start = time.perf_counter()
+                    response = http.post(url, {'username': username, 'password': password})
+                    elapsed = time.perf_counter() - start
+                    with lock:
+                        latencies.append(elapsed)
+                        statuses.append(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - start, latencies, statuses
+
+    def report(self, workers, elapsed, latencies, statuses):
+        ok = statuses.count(200)
+        rejected = statuses.count(503)
+        ok_latencies = [latency for latency, code in zip(latencies, statuses) if code == 200] or [0]
+        p99 = statistics.quantiles(ok_latencies, n=100)[98] if len(ok_latencies) > 1 else ok_latencies[0]
+        self.stdout.write(
+            f'workers={workers}: {ok / elapsed:.1f} logins/s, '
+            f'p50 {statistics.median(ok_latencies) * 1000:.0f}ms, p99 {p99 * 1000:.0f}ms, '
+            f'{ok} ok, {rejected} rejected with 503, {len(statuses) - ok - rejected} other'
+        )
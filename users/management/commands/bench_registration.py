@@ -0,0 +1,51 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from users.serializers import UserSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure registration throughput: validate and save users through "
+        "UserSerializer, as the registration endpoint does, then roll back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=50)
+        parser.add_argument('--role', choices=['patient', 'doctor'], default='patient')
+        parser.add_argument('--keep', action='store_true', help='Commit the created users instead of rolling back.')
+
+    def payload(self, run, index, role):
+        data = {
+            'username': f'bench-{run}-{index}',
+            'email': f'bench-{run}-{index}@example.com',
+            'password': 'bench-password',
+            'password_confirm': 'bench-password',
+            f'is_{role}': True,
+        }
+        if role == 'doctor':
+            data['doctor_profile'] = {'specialization': 'GP'}
+        return data
+
+    def handle(self, *args, **options):
+        count, role = options['count'], options['role']
+        run = uuid.uuid4().hex[:8]
+
+        with CaptureQueriesContext(connection) as queries, transaction.atomic():
+            start = time.perf_counter()
+            for index in range(count):
+                serializer = UserSerializer(data=self.payload(run, index, role))
+                serializer.is_valid(raise_exception=True)
+                serializer.save()
+            elapsed = time.perf_counter() - start
+            if not options['keep']:
+                transaction.set_rollback(True)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Registered {count} {role}(s) in {elapsed:.2f}s: '
+            f'{count / elapsed:.1f} users/s, {len(queries) / count:.1f} queries per user.'
+        ))
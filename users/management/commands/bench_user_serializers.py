@@ -0,0 +1,62 @@
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework import serializers
+
+from users.models import User, PatientProfile, DoctorProfile
+from users.serializers import UserSerializer, PatientProfileSerializer, DoctorProfileSerializer
+
+
+class TwoPassUserSerializer(UserSerializer):
+    """The previous UserSerializer output path, kept here as the baseline."""
+    def to_representation(self, instance):
+        ret = serializers.ModelSerializer.to_representation(self, instance)
+        if instance.is_patient:
+            ret['patient_profile'] = PatientProfileSerializer(instance.patient_profile, context=self.context).data
+        elif instance.is_doctor:
+            ret['doctor_profile'] = DoctorProfileSerializer(instance.doctor_profile, context=self.context).data
+        else:
+            ret.pop('patient_profile', None)
+            ret.pop('doctor_profile', None)
+        return ret
+
+
+class Command(BaseCommand):
+    help = "Time serializing a list of users with and without the single-pass UserSerializer."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def build_users(self, count):
+        """Unsaved users with both profile relations cached, as select_related leaves them."""
+        users = []
+        for pk in range(1, count + 1):
+            user = User(pk=pk, username=f'user{pk}', email=f'user{pk}@example.com', is_patient=pk % 2 == 0, is_doctor=pk % 2 == 1)
+            if user.is_patient:
+                PatientProfile(pk=pk, user=user)
+                User.doctor_profile.related.set_cached_value(user, None)
+            else:
+                DoctorProfile(pk=pk, user=user, specialization='GP')
+                User.patient_profile.related.set_cached_value(user, None)
+            users.append(user)
+        return users
+
+    def best_of(self, serializer_class, users, repeat):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            serializer_class(users, many=True).data
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+
+    def handle(self, *args, **options):
+        users = self.build_users(options['users'])
+        if TwoPassUserSerializer(users, many=True).data != UserSerializer(users, many=True).data:
+            self.stderr.write('Warning: the two serializers disagree.')
+        before = self.best_of(TwoPassUserSerializer, users, options['repeat'])
+        after = self.best_of(UserSerializer, users, options['repeat'])
+        self.stdout.write(
+            f"{options['users']} users: two-pass {before * 1000:.1f}ms, "
+            f"single-pass {after * 1000:.1f}ms ({before / after:.2f}x faster)."
+        )
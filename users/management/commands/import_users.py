@@ -0,0 +1,68 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.importing import FORMATS, chunked, import_chunk, init_hash_worker, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream patients and doctors from a CSV or JSON Lines file into the database in chunks. "
+        "Columns: username, email, password, role (patient/doctor), first_name, last_name, "
+        "date_of_birth, specialization. Progress is checkpointed after every chunk, so an "
+        "interrupted import resumes where it stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=FORMATS, help='Defaults to the file extension.')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Password hashing processes; 0 hashes in this process.')
+        parser.add_argument('--checkpoint', help='Defaults to PATH.checkpoint.')
+        parser.add_argument('--restart', action='store_true', help='Ignore an existing checkpoint.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+        checkpoint_path = options['checkpoint'] or f'{path}.checkpoint'
+        progress = {'line': 0, 'created': 0, 'rejected': 0}
+        if not options['restart'] and os.path.exists(checkpoint_path):
+            with open(checkpoint_path) as f:
+                progress = json.load(f)
+            self.stdout.write(f"Resuming after line {progress['line']}.")
+
+        try:
+            stream = open(path, newline='', encoding='utf-8')
+        except OSError as e:
+            raise CommandError(f'Cannot open {path}: {e}')
+
+        workers = options['workers']
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=init_hash_worker) if workers else nullcontext()
+        with stream, pool as executor:
+            rows = ((line, row) for line, row in read_rows(stream, fmt) if line > progress['line'])
+            for chunk in chunked(rows, options['chunk_size']):
+                created, errors = import_chunk(chunk, executor)
+                for line, error in errors:
+                    self.stderr.write(f'Line {line}: {json.dumps(error)}')
+                progress = {
+                    'line': chunk[-1][0],
+                    'created': progress['created'] + created,
+                    'rejected': progress['rejected'] + len(errors),
+                }
+                self.save_checkpoint(checkpoint_path, progress)
+                self.stdout.write(f"Imported up to line {progress['line']}: {progress['created']} created, {progress['rejected']} rejected.")
+
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {progress['created']} user(s); {progress['rejected']} row(s) rejected."
+        ))
+
+    def save_checkpoint(self, path, progress):
+        # Written to a temporary file first so a crash never leaves a torn checkpoint.
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump(progress, f)
+        os.replace(f'{path}.tmp', path)
@@ -0,0 +1,33 @@
+import signal
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.images import process_pending
+from users.models import PatientProfile, DoctorProfile
+
+
+class Command(BaseCommand):
+    help = "Render resized, content-hashed variants of newly uploaded profile images."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Process the currently pending images and exit.')
+        parser.add_argument('--batch-size', type=int, default=20)
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds to sleep when nothing is pending.')
+
+    def handle(self, *args, **options):
+        self.running = True
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        while self.running:
+            processed = process_pending([PatientProfile, DoctorProfile], options['batch_size'])
+            if processed:
+                self.stdout.write(f'Processed {processed} profile image(s).')
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+
+    def stop(self, *args):
+        self.running = False
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete expired outstanding refresh tokens, and their blacklist entries, "
+        "in small batches so no transaction holds locks for long."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--pause', type=float, default=0.1, help='Seconds to sleep between batches.')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        expired = OutstandingToken.objects.filter(expires_at__lte=now).order_by('pk').values_list('pk', flat=True)
+        deleted = {}
+        while True:
+            # Tokens share one lifetime, so expired rows sit at the low end of
+            # the primary key and this walk stops early without an index on
+            # expires_at.
+            batch = list(expired[:options['batch_size']])
+            if not batch:
+                break
+            _, counts = OutstandingToken.objects.filter(pk__in=batch).only('pk').delete()
+            for label, count in counts.items():
+                deleted[label] = deleted.get(label, 0) + count
+            if len(batch) < options['batch_size']:
+                break
+            time.sleep(options['pause'])
+
+        outstanding = deleted.get(OutstandingToken._meta.label, 0)
+        blacklisted = deleted.get(BlacklistedToken._meta.label, 0)
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {outstanding} expired outstanding token(s) and {blacklisted} blacklisted token(s).'
+        ))
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.3 on 2026-10-18 05:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_user_manager'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='doctorprofile',
+            index=models.Index(fields=['specialization', 'availability', 'id'], name='doctor_directory_idx'),
+        ),
+    ]
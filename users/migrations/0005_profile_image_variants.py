@@ -0,0 +1,49 @@
+# Generated by Django 5.1.3 on 2026-10-18 05:03
+
+from django.db import migrations, models
+
+
+def queue_existing_images(apps, schema_editor):
+    # Images uploaded before variants existed get processed like new uploads.
+    for name in ('PatientProfile', 'DoctorProfile'):
+        model = apps.get_model('users', name)
+        model.objects.using(schema_editor.connection.alias).exclude(image='').exclude(image=None).update(image_pending=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_doctor_directory_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='doctorprofile',
+            name='image_pending',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='doctorprofile',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='patientprofile',
+            name='image_pending',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='patientprofile',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='doctorprofile',
+            index=models.Index(condition=models.Q(('image_pending', True)), fields=['id'], name='doctor_image_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patientprofile',
+            index=models.Index(condition=models.Q(('image_pending', True)), fields=['id'], name='patient_image_pending_idx'),
+        ),
+        migrations.RunPython(queue_existing_images, migrations.RunPython.noop),
+    ]
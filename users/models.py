@@ -1,5 +1,6 @@
-from django.contrib.auth.models import AbstractUser
-from django.db import models
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AbstractUser, UserManager as BaseUserManager
+from django.db import models, transaction
 from django.utils.deconstruct import deconstructible
 from django.core.exceptions import ValidationError
 import os
@@ -18,38 +19,125 @@ class GenerateProfileImagePath:
 
 user_profile_image_path = GenerateProfileImagePath()
 
+class ProfileImageModel(models.Model):
+    """
+    A profile picture plus the resized variants users.images renders from it.
+    Saving a new image clears the variants and queues it for processing.
+    """
+    image = models.ImageField(upload_to=user_profile_image_path, null=True, blank=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    image_pending = models.BooleanField(default=False, editable=False)
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_image = instance.__dict__.get('image')
+        return instance
+
+    def save(self, *args, **kwargs):
+        stale = set()
+        if (self.image.name or None) != (getattr(self, '_loaded_image', None) or None):
+            stale = self.stored_image_names() - {self.image.name}
+            self.image_pending = bool(self.image)
+            self.image_variants = {}
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'image_pending', 'image_variants'}
+        super().save(*args, **kwargs)
+        self._loaded_image = self.image.name
+        if stale:
+            from .images import delete_on_commit
+            delete_on_commit(self.image.storage, stale)
+
+    def stored_image_names(self):
+        """The original and variant files the saved row points at."""
+        from .images import variant_names
+
+        if self._state.adding:
+            return set()
+        row = type(self)._base_manager.filter(pk=self.pk).values('image', 'image_variants').first()
+        if row is None:
+            return set()
+        names = variant_names(row['image_variants'])
+        if row['image']:
+            names.add(row['image'])
+        return names
+
+class UserQuerySet(models.QuerySet):
+    def create(self, **kwargs):
+        # Also reached through acreate() and get_or_create().
+        from .services import create_profile
+
+        with transaction.atomic(using=self.db):
+            user = super().create(**kwargs)
+            create_profile(user, new_user=True)
+        return user
+
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
+    def _create_user(self, username, email, password, **extra_fields):
+        from .services import provision_user
+
+        if not username:
+            raise ValueError("The given username must be set")
+        return provision_user(
+            username=self.model.normalize_username(username),
+            email=self.normalize_email(email),
+            password=password,
+            **extra_fields,
+        )
+
+    async def acreate_user(self, username, email=None, password=None, **extra_fields):
+        return await sync_to_async(self.create_user)(username, email, password, **extra_fields)
+
+    async def acreate_superuser(self, username, email=None, password=None, **extra_fields):
+        return await sync_to_async(self.create_superuser)(username, email, password, **extra_fields)
+
 class User(AbstractUser):
     is_patient = models.BooleanField(default=False)
     is_doctor = models.BooleanField(default=False)
     email_verified = models.BooleanField(default=False)
     email = models.EmailField(unique=True)
+    # Also bumped when the user's profile changes, so it can serve as the
+    # validator for conditional requests on the profile endpoint.
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = UserManager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remembered so denormalized copies of the username can be refreshed.
+        instance._loaded_username = instance.__dict__.get('username')
+        return instance
 
     def clean(self):
         if self.is_patient and self.is_doctor:
             raise ValidationError("A user cannot be both a patient and a doctor.")
         
     def save(self, *args, **kwargs):
+        # Profiles are created by users.services, not here.
         self.clean()
-        is_new = self._state.adding
         super().save(*args, **kwargs)
-        if is_new:
-            if self.is_patient:
-                PatientProfile.objects.get_or_create(user=self)
-            elif self.is_doctor:
-                DoctorProfile.objects.get_or_create(user=self)
 
     def __str__(self):
         return self.username
 
-class PatientProfile(models.Model):
+class PatientProfile(ProfileImageModel):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='patient_profile')
-    image = models.ImageField(upload_to=user_profile_image_path, null=True, blank=True)
     date_of_birth = models.DateField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['id'], condition=models.Q(image_pending=True), name='patient_image_pending_idx'),
+        ]
+
     def __str__(self):
         return f"Patient Profile: {self.user.username}"
 
-class DoctorProfile(models.Model):
+class DoctorProfile(ProfileImageModel):
     SPECIALIZATION_CHOICES = [
         ('GP', 'General Practitioner'),
         ('CARD', 'Cardiologist'),
@@ -60,10 +148,16 @@ class DoctorProfile(models.Model):
     ]
 
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='doctor_profile')
-    image = models.ImageField(upload_to=user_profile_image_path, null=True, blank=True)
     specialization = models.CharField(max_length=5, choices=SPECIALIZATION_CHOICES)
     availability = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            # Directory filters, with id for its keyset pagination.
+            models.Index(fields=['specialization', 'availability', 'id'], name='doctor_directory_idx'),
+            models.Index(fields=['id'], condition=models.Q(image_pending=True), name='doctor_image_pending_idx'),
+        ]
+
     def __str__(self):
         return f"Doctor Profile: {self.user.username} - {self.get_specialization_display()}"
 
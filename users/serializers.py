@@ -1,27 +1,41 @@
 from rest_framework import serializers
+from rest_framework.fields import SkipField
+from rest_framework.relations import PKOnlyObject
 from django.contrib.auth import get_user_model
 from .models import PatientProfile, DoctorProfile
+from .services import ROLES, provision_user
+from .images import ProfileImageField
+from config.timing import TimedSerializerMixin
 
 User = get_user_model()
 
 class PasswordResetSerializer(serializers.Serializer):
     email = serializers.EmailField()
 
+class UserImportSerializer(serializers.Serializer):
+    """One row of a bulk import; uniqueness is checked per chunk by the importer."""
+    username = serializers.CharField(max_length=150, validators=[User.username_validator])
+    email = serializers.EmailField()
+    password = serializers.CharField(required=False, allow_blank=True, min_length=8)
+    role = serializers.ChoiceField(choices=ROLES)
+    first_name = serializers.CharField(required=False, allow_blank=True, max_length=150)
+    last_name = serializers.CharField(required=False, allow_blank=True, max_length=150)
+    date_of_birth = serializers.DateField(required=False)
+    specialization = serializers.ChoiceField(choices=DoctorProfile.SPECIALIZATION_CHOICES, required=False)
+
+    def validate(self, data):
+        if data['role'] == 'doctor' and not data.get('specialization'):
+            raise serializers.ValidationError({"specialization": "This field is required for doctors."})
+        return data
+
 class PatientProfileSerializer(serializers.ModelSerializer):
-    image = serializers.SerializerMethodField()
+    image = ProfileImageField(required=False, allow_null=True)
 
     class Meta:
         model = PatientProfile
         fields = ['id', 'user', 'image', 'date_of_birth']
         read_only_fields = ['user']
 
-    def get_image(self, obj):
-        if obj.image:
-            request = self.context.get('request')
-            if request is not None:
-                return request.build_absolute_uri(obj.image.url)
-        return None
-
     def create(self, validated_data):
         user = self.context['request'].user
         return PatientProfile.objects.create(user=user, **validated_data)
@@ -32,7 +46,67 @@ class DoctorProfileSerializer(serializers.ModelSerializer):
         fields = ['id', 'user', 'specialization', 'availability']
         read_only_fields = ['user']
 
-class UserProfileSerializer(serializers.ModelSerializer):
+class DoctorDirectorySerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    doctor_id = serializers.IntegerField(source='user_id', read_only=True)
+    username = serializers.CharField(source='user.username', read_only=True)
+    first_name = serializers.CharField(source='user.first_name', read_only=True)
+    last_name = serializers.CharField(source='user.last_name', read_only=True)
+    specialization_display = serializers.CharField(source='get_specialization_display', read_only=True)
+    image = ProfileImageField(read_only=True)
+    average_rating = serializers.SerializerMethodField()
+    rating_count = serializers.SerializerMethodField()
+
+    class Meta:
+        model = DoctorProfile
+        fields = [
+            'id', 'doctor_id', 'username', 'first_name', 'last_name', 'specialization',
+            'specialization_display', 'availability', 'image', 'average_rating', 'rating_count',
+        ]
+
+    def rating_stats(self, obj):
+        # Loaded with select_related; doctors without ratings have no row.
+        return getattr(obj.user, 'rating_stats', None)
+
+    def get_average_rating(self, obj):
+        stats = self.rating_stats(obj)
+        return stats.average_rating if stats else None
+
+    def get_rating_count(self, obj):
+        stats = self.rating_stats(obj)
+        return stats.rating_count if stats else 0
+
+class RoleProfileSerializerMixin:
+    """
+    Serializes a user in one pass, driven by role: only the profile matching
+    the role is serialized, the other profile key is null, and users without
+    a role get neither key.
+    """
+    profile_fields = {'patient_profile', 'doctor_profile'}
+
+    def to_representation(self, instance):
+        if instance.is_patient:
+            role_profile = 'patient_profile'
+        elif instance.is_doctor:
+            role_profile = 'doctor_profile'
+        else:
+            role_profile = None
+
+        # Serializer.to_representation, with the profile fields decided by role.
+        ret = {}
+        for field in self._readable_fields:
+            if field.field_name in self.profile_fields and field.field_name != role_profile:
+                if role_profile is not None:
+                    ret[field.field_name] = None
+                continue
+            try:
+                attribute = field.get_attribute(instance)
+            except SkipField:
+                continue
+            check_for_none = attribute.pk if isinstance(attribute, PKOnlyObject) else attribute
+            ret[field.field_name] = None if check_for_none is None else field.to_representation(attribute)
+        return ret
+
+class UserProfileSerializer(TimedSerializerMixin, RoleProfileSerializerMixin, serializers.ModelSerializer):
     patient_profile = PatientProfileSerializer(required=False)
     doctor_profile = DoctorProfileSerializer(required=False)
 
@@ -61,18 +135,7 @@ class UserProfileSerializer(serializers.ModelSerializer):
         instance.refresh_from_db()
         return instance
 
-    def to_representation(self, instance):
-        ret = super().to_representation(instance)
-        if instance.is_patient:
-            ret['patient_profile'] = PatientProfileSerializer(instance.patient_profile, context=self.context).data
-        elif instance.is_doctor:
-            ret['doctor_profile'] = DoctorProfileSerializer(instance.doctor_profile, context=self.context).data
-        else:
-            ret.pop('patient_profile', None)
-            ret.pop('doctor_profile', None)
-        return ret
-
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, RoleProfileSerializerMixin, serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, required=False)
     password_confirm = serializers.CharField(write_only=True, required=False)
     patient_profile = PatientProfileSerializer(required=False)
@@ -104,19 +167,14 @@ class UserSerializer(serializers.ModelSerializer):
         validated_data.pop('password_confirm', None)
         patient_profile_data = validated_data.pop('patient_profile', None)
         doctor_profile_data = validated_data.pop('doctor_profile', None)
-    
-        password = validated_data.pop('password', None)
-        user = User.objects.create_user(**validated_data, email_verified=False)
-        if password:
-            user.set_password(password)
-        user.save()
-
-        if user.is_patient and patient_profile_data:
-            PatientProfile.objects.create(user=user, **patient_profile_data)
-        elif user.is_doctor and doctor_profile_data:
-            DoctorProfile.objects.create(user=user, **doctor_profile_data)
+        profile = patient_profile_data if validated_data.get('is_patient') else doctor_profile_data
 
-        return user
+        return provision_user(
+            password=validated_data.pop('password', None),
+            profile=profile,
+            email_verified=False,
+            **validated_data,
+        )
 
     def update(self, instance, validated_data):
         validated_data.pop('password', None)
@@ -137,14 +195,3 @@ class UserSerializer(serializers.ModelSerializer):
         instance.refresh_from_db()
         return instance
 
-    def to_representation(self, instance):
-        ret = super().to_representation(instance)
-        if instance.is_patient:
-            ret['patient_profile'] = PatientProfileSerializer(instance.patient_profile, context=self.context).data
-        elif instance.is_doctor:
-            ret['doctor_profile'] = DoctorProfileSerializer(instance.doctor_profile, context=self.context).data
-        else:
-            ret.pop('patient_profile', None)
-            ret.pop('doctor_profile', None)
-        return ret
-
@@ -0,0 +1,89 @@
+"""
+User provisioning.
+
+Every path that creates a user or gives one a role goes through here, so the
+user row and the profile for their role are written together in one
+transaction, the password is hashed once, and nothing is read back.
+"""
+from django.db import IntegrityError, transaction
+
+from .models import User, PatientProfile, DoctorProfile
+
+ROLES = ('patient', 'doctor')
+
+
+def profile_model(user):
+    if user.is_patient:
+        return PatientProfile
+    if user.is_doctor:
+        return DoctorProfile
+    return None
+
+
+def create_profile(user, new_user=False, **fields):
+    """Insert the profile for the user's role; the user must have none yet."""
+    model = profile_model(user)
+    if model is None:
+        return None
+    # Assigning user also fills the reverse accessor, so user.patient_profile
+    # (or doctor_profile) is available without a query.
+    profile = model(user=user, **fields)
+    profile._with_new_user = new_user
+    profile.save(force_insert=True)
+    return profile
+
+
+async def aload_profile(user):
+    """Load the profile for the user's role into the user's relation cache."""
+    model = profile_model(user)
+    if model is None:
+        return None
+    profile = await model.objects.filter(user=user).afirst()
+    # A missing profile is cached as well, so reading it raises DoesNotExist
+    # instead of querying.
+    model.user.field.remote_field.set_cached_value(user, profile)
+    return profile
+
+
+def ensure_profile(user):
+    model = profile_model(user)
+    if model is None:
+        return None
+    profile, _ = model.objects.get_or_create(user=user)
+    return profile
+
+
+@transaction.atomic
+def provision_user(password=None, profile=None, **fields):
+    """
+    Create a user together with the profile for their role. A password of
+    None leaves the account without a usable password (social sign-in).
+    """
+    user = User(**fields)
+    user.set_password(password)
+    user.save(force_insert=True)
+    create_profile(user, new_user=True, **(profile or {}))
+    return user
+
+
+@transaction.atomic
+def assign_role(user, role):
+    user.is_patient = role == 'patient'
+    user.is_doctor = role == 'doctor'
+    user.save(update_fields=['is_patient', 'is_doctor', 'updated_at'])
+    ensure_profile(user)
+    return user
+
+
+def get_or_provision_google_user(email, first_name='', last_name=''):
+    """Return (user, created) for the verified email of a Google account."""
+    user = User.objects.filter(email=email).first()
+    if user is not None:
+        return user, False
+    try:
+        return provision_user(
+            username=email, email=email, first_name=first_name, last_name=last_name, email_verified=True,
+        ), True
+    except IntegrityError:
+        # Lost a race with a concurrent sign-in for the same account.
+        return User.objects.get(email=email), False
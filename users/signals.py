@@ -1,15 +1,58 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
+from django.utils import timezone
 from .models import User, PatientProfile, DoctorProfile
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from .authentication import invalidate_cached_user
+from .tokens import revoke_on_commit, forget_revocation_on_commit
+from .directory import invalidate_directory
 
-@receiver(post_save, sender=User)
-def create_or_update_user_profile(sender, instance, created, **kwargs):
+@receiver(post_save, sender=PatientProfile)
+@receiver(post_save, sender=DoctorProfile)
+@receiver(post_delete, sender=PatientProfile)
+@receiver(post_delete, sender=DoctorProfile)
+def touch_user_on_profile_change(sender, instance, **kwargs):
     """
-    Signal to create or update a user's profile when a User instance is saved.
+    Bump the owner's updated_at so that representations embedding the
+    profile stop matching their old validators, and drop the cached
+    authenticated user, which may carry the old profile. A profile written
+    together with its new user needs neither.
     """
+    if kwargs.get('created') and getattr(instance, '_with_new_user', False):
+        return
+    User.objects.filter(pk=instance.user_id).update(updated_at=timezone.now())
+    invalidate_cached_user(instance.user_id)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_authenticated_user(sender, instance, **kwargs):
+    invalidate_cached_user(instance.pk)
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def cache_token_revocation(sender, instance, created, **kwargs):
     if created:
-        if instance.is_patient and not hasattr(instance, 'patient_profile'):
-            PatientProfile.objects.get_or_create(user=instance)
-        elif instance.is_doctor and not hasattr(instance, 'doctor_profile'):
-            DoctorProfile.objects.get_or_create(user=instance)
+        revoke_on_commit(instance.token.jti, instance.token.expires_at.timestamp())
 
+
+@receiver(post_delete, sender=BlacklistedToken)
+def forget_token_revocation(sender, instance, origin=None, **kwargs):
+    # Rows removed along with their expired OutstandingToken by
+    # prune_tokens need no cache work; their entries expire on their own.
+    if getattr(origin, 'model', type(origin)) is BlacklistedToken:
+        forget_revocation_on_commit(instance.token.jti)
+
+
+@receiver(post_save, sender=DoctorProfile)
+@receiver(post_delete, sender=DoctorProfile)
+def doctor_profile_invalidate_directory(sender, instance, **kwargs):
+    invalidate_directory()
+
+
+@receiver(post_save, sender=User)
+def doctor_invalidate_directory(sender, instance, created, update_fields=None, **kwargs):
+    # A new doctor appears once their profile is saved.
+    if created or not instance.is_doctor or (update_fields and set(update_fields) <= {'last_login'}):
+        return
+    invalidate_directory()
@@ -1,14 +1,39 @@
 import io
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from PIL import Image
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from google.auth import crypt, jwt as google_jwt
+from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from rest_framework.test import APITestCase
 from rest_framework import status
 from unittest.mock import patch
+from asgiref.sync import sync_to_async
 from .serializers import UserSerializer, PatientProfileSerializer, DoctorProfileSerializer
 from .models import PatientProfile, DoctorProfile
+from .google_auth import signing_keys
+from .images import render_variants, variant_names
+from .importing import hash_passwords
+from .tokens import RefreshToken
+from .services import provision_user, get_or_provision_google_user
+from . import hashing
+from django.contrib.auth.hashers import check_password, make_password
+from django.core.cache import cache
+from django.core.management import call_command
+from django.utils import timezone as django_timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
 
 User = get_user_model()
 
@@ -189,6 +214,11 @@ class ViewSetTests(APITestCase):
             is_patient=True
         )
         self.client.force_authenticate(user=self.user)
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
 
     def create_test_image(self):
         file = io.BytesIO()
@@ -223,3 +253,728 @@ class ViewSetTests(APITestCase):
         self.assertEqual(PatientProfile.objects.count(), 1)  # Count should not increase
 
 
+
+    def test_profile_conditional_get(self):
+        url = reverse('user-profile')
+        response = self.client.get(url)
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        profile = self.user.patient_profile
+        profile.date_of_birth = '1990-01-01'
+        profile.save()
+        self.client.force_authenticate(user=User.objects.get(pk=self.user.pk))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['data']['patient_profile']['date_of_birth'], '1990-01-01')
+
+
+def make_signing_key(kid):
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, kid)])
+    now = datetime.now(timezone.utc)
+    cert = (
+        x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+        .serial_number(1).not_valid_before(now - timedelta(days=1)).not_valid_after(now + timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption())
+    return crypt.RSASigner.from_string(pem, key_id=kid), cert.public_bytes(serialization.Encoding.PEM).decode()
+
+
+class StubKeyServer(ThreadingHTTPServer):
+    """Serves Google-style {kid: certificate} JSON and counts the fetches."""
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubKeyHandler)
+        self.certs = {}
+        self.max_age = 3600
+        self.hits = 0
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}/oauth2/v1/certs'
+
+
+class StubKeyHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.server.hits += 1
+        body = json.dumps(self.server.certs).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Cache-Control', f'public, max-age={self.server.max_age}, must-revalidate')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'google-keys-tests'}})
+class GoogleSigningKeyCacheTests(APITestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = StubKeyServer()
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.keys = {kid: make_signing_key(kid) for kid in ('key-1', 'key-2')}
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.server.certs = {'key-1': self.keys['key-1'][1]}
+        self.server.max_age = 3600
+        self.server.hits = 0
+        self.settings_override = override_settings(GOOGLE_OAUTH2_CERTS_URL=self.server.url)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        signing_keys.clear()
+        self.addCleanup(signing_keys.clear)
+
+    def sign_in(self, kid='key-1'):
+        now = int(time.time())
+        claims = {
+            'iss': 'https://accounts.google.com', 'aud': settings.GOOGLE_CLIENT_ID, 'sub': '12345',
+            'email': 'googleuser@example.com', 'iat': now, 'exp': now + 600,
+        }
+        token = google_jwt.encode(self.keys[kid][0], claims).decode()
+        return self.client.post(reverse('google_signin'), {'token': token})
+
+    def test_certificates_are_fetched_once(self):
+        self.assertEqual(self.sign_in().status_code, status.HTTP_200_OK)
+        self.assertEqual(self.sign_in().status_code, status.HTTP_200_OK)
+        self.assertEqual(self.server.hits, 1)
+
+    def test_certificates_are_shared_through_the_cache(self):
+        self.sign_in()
+        signing_keys._entry = None  # as seen by another worker process
+        self.assertEqual(self.sign_in().status_code, status.HTTP_200_OK)
+        self.assertEqual(self.server.hits, 1)
+
+    def test_max_age_is_honored(self):
+        self.server.max_age = 0
+        self.sign_in()
+        self.sign_in()
+        self.assertEqual(self.server.hits, 2)
+
+    def test_unknown_key_id_triggers_refetch(self):
+        self.sign_in()
+        self.server.certs['key-2'] = self.keys['key-2'][1]
+        with patch.object(signing_keys, 'unknown_kid_interval', 0):
+            self.assertEqual(self.sign_in('key-2').status_code, status.HTTP_200_OK)
+        self.assertEqual(self.server.hits, 2)
+
+    def test_unknown_key_id_refetch_is_rate_limited(self):
+        self.sign_in()
+        response = self.sign_in('key-2')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.server.hits, 1)
+
+    def test_keys_are_refreshed_in_background(self):
+        self.server.max_age = 120
+        self.sign_in()
+        self.assertEqual(self.sign_in().status_code, status.HTTP_200_OK)
+        deadline = time.time() + 5
+        while self.server.hits < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.server.hits, 2)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'auth-user-tests'}})
+class CachedJWTAuthenticationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='patient', email='patient@example.com', password='testpass123', is_patient=True)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        self.url = reverse('user-profile')
+
+    def test_user_is_resolved_from_cache(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_deactivation_takes_effect(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_profile_change_invalidates_cached_user(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            profile = PatientProfile.objects.get(user=self.user)
+            profile.date_of_birth = '1990-01-01'
+            profile.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['data']['patient_profile']['date_of_birth'], '1990-01-01')
+
+    def test_role_change_through_api_is_visible(self):
+        other = User.objects.create_user(username='fresh', email='fresh@example.com', password='testpass123')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(other).access_token}')
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.put(reverse('user-set-role'), {'role': 'doctor'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.get(self.url)
+        self.assertTrue(response.data['data']['is_doctor'])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'token-revocation-tests'}})
+class TokenRevocationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='patient', email='patient@example.com', password='testpass123', is_patient=True)
+        self.refresh = RefreshToken.for_user(self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.refresh.access_token}')
+
+    def refresh_access(self):
+        return self.client.post(reverse('token_refresh'), {'refresh': str(self.refresh)}, format='json')
+
+    def test_refresh_checks_database_once(self):
+        self.assertEqual(self.refresh_access().status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(0):
+            response = self.refresh_access()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_logout_revokes_cached_token(self):
+        self.refresh_access()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('logout'), {'refresh': str(self.refresh)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_205_RESET_CONTENT)
+        with self.assertNumQueries(0):
+            response = self.refresh_access()
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_removing_blacklist_entry_restores_token(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.refresh.blacklist()
+        self.assertEqual(self.refresh_access().status_code, status.HTTP_401_UNAUTHORIZED)
+        with self.captureOnCommitCallbacks(execute=True):
+            BlacklistedToken.objects.get(token__jti=self.refresh['jti']).delete()
+        self.assertEqual(self.refresh_access().status_code, status.HTTP_200_OK)
+
+    def test_prune_tokens_deletes_expired_rows_in_batches(self):
+        expired = RefreshToken.for_user(self.user)
+        expired.blacklist()
+        RefreshToken.for_user(self.user)
+        past = django_timezone.now() - timedelta(days=1)
+        OutstandingToken.objects.exclude(jti=self.refresh['jti']).update(expires_at=past)
+
+        out = io.StringIO()
+        call_command('prune_tokens', batch_size=1, pause=0, stdout=out)
+
+        self.assertIn('Deleted 2 expired outstanding token(s) and 1 blacklisted token(s).', out.getvalue())
+        self.assertEqual(list(OutstandingToken.objects.values_list('jti', flat=True)), [self.refresh['jti']])
+        self.assertFalse(BlacklistedToken.objects.exists())
+
+
+class ProvisioningTests(APITestCase):
+    def test_registration_query_count(self):
+        data = {
+            'username': 'patient',
+            'email': 'patient@example.com',
+            'password': 'testpass123',
+            'password_confirm': 'testpass123',
+            'is_patient': True,
+            'patient_profile': {'date_of_birth': '1990-01-01'},
+        }
+        # Two uniqueness checks, then the user and profile inserts inside one
+        # savepoint, and the verification email queued alongside them.
+        with self.assertNumQueries(9):
+            response = self.client.post(reverse('user-register'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['data']['patient_profile']['date_of_birth'], '1990-01-01')
+        self.assertEqual(PatientProfile.objects.get().user.username, 'patient')
+
+    def test_create_user_provisions_role_profile(self):
+        with self.assertNumQueries(4):
+            user = User.objects.create_user(username='doctor', email='doctor@example.com', password='testpass123', is_doctor=True)
+        self.assertTrue(DoctorProfile.objects.filter(user=user).exists())
+        self.assertFalse(PatientProfile.objects.filter(user=user).exists())
+        self.assertTrue(user.check_password('testpass123'))
+
+    async def test_async_creation_provisions_role_profile(self):
+        user = await User.objects.acreate_user(username='patient', email='patient@example.com', password='testpass123', is_patient=True)
+        self.assertTrue(await PatientProfile.objects.filter(user=user).aexists())
+        self.assertTrue(await sync_to_async(user.check_password)('testpass123'))
+        user = await User.objects.acreate(username='doctor', email='doctor@example.com', is_doctor=True)
+        self.assertTrue(await DoctorProfile.objects.filter(user=user).aexists())
+
+    def test_failed_profile_insert_rolls_back_user(self):
+        with self.assertRaises(TypeError):
+            provision_user(username='patient', email='patient@example.com', is_patient=True, profile={'unknown': 1})
+        self.assertFalse(User.objects.exists())
+
+    def test_google_user_is_provisioned_once(self):
+        user, created = get_or_provision_google_user('g@example.com', 'Google', 'User')
+        self.assertTrue(created)
+        self.assertEqual(user.username, 'g@example.com')
+        self.assertTrue(user.email_verified)
+        self.assertFalse(user.has_usable_password())
+        again, created = get_or_provision_google_user('g@example.com')
+        self.assertFalse(created)
+        self.assertEqual(again.pk, user.pk)
+
+    def test_set_role_creates_profile(self):
+        user = User.objects.create_user(username='fresh', email='fresh@example.com', password='testpass123')
+        self.client.force_authenticate(user)
+        response = self.client.put(reverse('user-set-role'), {'role': 'patient'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(PatientProfile.objects.filter(user=user).exists())
+
+
+class ImportUsersTests(TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+    def write(self, name, content):
+        path = os.path.join(self.dir.name, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def run_import(self, path, **options):
+        out, err = io.StringIO(), io.StringIO()
+        call_command('import_users', path, workers=0, stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_csv_import_creates_users_and_profiles(self):
+        User.objects.create_user(username='taken', email='taken@example.com', password='testpass123')
+        path = self.write('users.csv', (
+            'username,email,password,role,date_of_birth,specialization\n'
+            'pat,pat@example.com,testpass123,patient,1990-01-01,\n'
+            'doc,doc@example.com,,doctor,,CARD\n'
+            'taken,new@example.com,testpass123,patient,,\n'
+            'dup,pat@example.com,testpass123,patient,,\n'
+            'nospec,nospec@example.com,testpass123,doctor,,\n'
+        ))
+        out, err = self.run_import(path, chunk_size=2)
+
+        self.assertIn('Imported 2 user(s); 3 row(s) rejected.', out)
+        self.assertIn('Line 4: {"username"', err)
+        self.assertIn('Line 5: {"email"', err)
+        self.assertIn('Line 6: {"specialization"', err)
+        patient = User.objects.get(username='pat')
+        self.assertTrue(patient.check_password('testpass123'))
+        self.assertEqual(str(patient.patient_profile.date_of_birth), '1990-01-01')
+        doctor = User.objects.get(username='doc')
+        self.assertFalse(doctor.has_usable_password())
+        self.assertEqual(doctor.doctor_profile.specialization, 'CARD')
+        self.assertFalse(os.path.exists(f'{path}.checkpoint'))
+
+    def test_jsonl_import_resumes_from_checkpoint(self):
+        rows = [{'username': f'user{i}', 'email': f'user{i}@example.com', 'role': 'patient'} for i in range(4)]
+        path = self.write('users.jsonl', '\n'.join(json.dumps(row) for row in rows) + '\nnot json\n')
+        self.write('users.jsonl.checkpoint', json.dumps({'line': 2, 'created': 2, 'rejected': 0}))
+
+        out, err = self.run_import(path, chunk_size=10)
+
+        self.assertIn('Resuming after line 2.', out)
+        self.assertIn('Imported 4 user(s); 1 row(s) rejected.', out)
+        self.assertIn('Line 5:', err)
+        self.assertEqual(sorted(User.objects.values_list('username', flat=True)), ['user2', 'user3'])
+
+    def test_passwords_are_hashed_in_worker_processes(self):
+        path = self.write('users.jsonl', json.dumps(
+            {'username': 'pooled', 'email': 'pooled@example.com', 'password': 'testpass123', 'role': 'patient'}
+        ))
+        out = io.StringIO()
+        call_command('import_users', path, workers=2, stdout=out, stderr=io.StringIO())
+        self.assertTrue(User.objects.get(username='pooled').check_password('testpass123'))
+
+
+class PasswordHashingPoolTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='patient', email='patient@example.com', password='testpass123', is_patient=True)
+        self.addCleanup(hashing.configure)
+
+    def occupy_pool(self):
+        started, release = threading.Event(), threading.Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+
+        thread = threading.Thread(target=hashing.offload, args=(block,))
+        thread.start()
+        started.wait(5)
+        self.addCleanup(thread.join)
+        self.addCleanup(release.set)
+
+    def test_import_hashes_outside_pool(self):
+        hashing.configure(workers=1, queue_size=0)
+        self.occupy_pool()
+        [encoded] = hash_passwords(['testpass123'])
+        with hashing.inline():
+            self.assertTrue(check_password('testpass123', encoded))
+        with self.assertRaises(hashing.HashingSaturated):
+            make_password('testpass123')
+
+    def test_login_succeeds_through_pool(self):
+        hashing.configure(workers=1, queue_size=0)
+        response = self.client.post(reverse('token_obtain_pair'), {'username': 'patient', 'password': 'testpass123'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(PASSWORD_HASH_RETRY_AFTER=7)
+    def test_saturated_pool_fails_fast_with_retry_after(self):
+        hashing.configure(workers=1, queue_size=0)
+        self.occupy_pool()
+        response = self.client.post(reverse('token_obtain_pair'), {'username': 'patient', 'password': 'testpass123'})
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '7')
+
+        response = self.client.post(reverse('user-register'), {
+            'username': 'new', 'email': 'new@example.com', 'password': 'testpass123', 'password_confirm': 'testpass123',
+        })
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertFalse(User.objects.filter(username='new').exists())
+
+    def test_saturated_pool_outside_drf(self):
+        admin = User.objects.create_superuser(username='admin', email='admin@example.com', password='testpass123')
+        hashing.configure(workers=1, queue_size=0)
+        self.occupy_pool()
+        response = self.client.post(reverse('admin:login'), {'username': admin.username, 'password': 'testpass123'})
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertIn('Retry-After', response)
+
+    def test_iterations_follow_setting(self):
+        with override_settings(PASSWORD_HASH_ITERATIONS=1000):
+            encoded = make_password('testpass123')
+            self.assertTrue(encoded.startswith('pbkdf2_sha256$1000$'))
+        # Logging in with the default cost upgrades the hash.
+        self.user.password = encoded
+        self.user.save()
+        self.assertTrue(self.user.check_password('testpass123'))
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.password.startswith('pbkdf2_sha256$1000$'))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'doctor-directory-tests'}})
+class DoctorDirectoryTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.cardiologist = User.objects.create_user(username='heart', email='heart@example.com', password='testpass123', is_doctor=True)
+        DoctorProfile.objects.filter(user=self.cardiologist).update(specialization='CARD')
+        self.gp = User.objects.create_user(username='gp', email='gp@example.com', password='testpass123', is_doctor=True)
+        DoctorProfile.objects.filter(user=self.gp).update(specialization='GP', availability=False)
+        self.url = reverse('doctor-directory-list')
+
+    def test_filters_and_rating_aggregates(self):
+        from appointments.models import Appointment, AppointmentFeedback
+        patient = User.objects.create_user(username='patient', email='patient@example.com', password='testpass123', is_patient=True)
+        appointment = Appointment.objects.create(patient=patient, doctor=self.cardiologist, date_time=django_timezone.now(), status='COMPLETED')
+        AppointmentFeedback.objects.create(appointment=appointment, rating=4)
+
+        response = self.client.get(self.url, {'specialization': 'CARD', 'availability': True})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['username'] for row in response.data['results']], ['heart'])
+        self.assertEqual(response.data['results'][0]['average_rating'], 4.0)
+        self.assertEqual(response.data['results'][0]['rating_count'], 1)
+
+        response = self.client.get(self.url, {'availability': False})
+        self.assertEqual([row['username'] for row in response.data['results']], ['gp'])
+        self.assertIsNone(response.data['results'][0]['average_rating'])
+
+    def test_keyset_pagination(self):
+        response = self.client.get(self.url, {'page_size': 1})
+        self.assertEqual([row['username'] for row in response.data['results']], ['heart'])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([row['username'] for row in response.data['results']], ['gp'])
+        self.assertIsNone(response.data['next'])
+
+    def test_cached_pages_skip_the_database(self):
+        response = self.client.get(self.url)
+        self.assertIn('public', response['Cache-Control'])
+        with self.assertNumQueries(0):
+            cached = self.client.get(self.url)
+        self.assertEqual(cached.data, response.data)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_profile_change_invalidates(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            profile = self.gp.doctor_profile
+            profile.availability = True
+            profile.save()
+        response = self.client.get(self.url, {'availability': True}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_imported_doctors_are_listed(self):
+        from users.importing import import_chunk
+        self.client.get(self.url)
+        row = {'username': 'imported', 'email': 'imported@example.com', 'role': 'doctor', 'specialization': 'CARD'}
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(import_chunk([(1, row)]), (1, []))
+        response = self.client.get(self.url)
+        self.assertIn('imported', [row['username'] for row in response.data['results']])
+
+    def test_unreadable_generation_is_not_cached(self):
+        etag = self.client.get(self.url)['ETag']
+        stored = set(cache._cache)
+        with patch('users.directory.get_generations', return_value=[None]):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('ETag', response)
+            self.client.get(self.url, {'page_size': 1})
+        self.assertEqual(set(cache._cache), stored)
+
+    def test_deactivated_doctor_is_hidden(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.gp.is_active = False
+            self.gp.save()
+        response = self.client.get(self.url)
+        self.assertEqual([row['username'] for row in response.data['results']], ['heart'])
+
+
+class ProfileImageTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='patient', email='patient@example.com', password='testpass123', is_patient=True)
+        self.client.force_authenticate(user=self.user)
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_settings = override_settings(MEDIA_ROOT=media.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def upload(self, color='red'):
+        file = io.BytesIO()
+        Image.new('RGB', (600, 400), color=color).save(file, 'png')
+        url = reverse('patientprofile-detail', kwargs={'pk': self.user.patient_profile.pk})
+        upload = SimpleUploadedFile('photo.png', file.getvalue(), content_type='image/png')
+        return self.client.patch(url, {'image': upload}, format='multipart')
+
+    def test_upload_is_served_as_is_until_processed(self):
+        response = self.upload()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['data']['image'].endswith('.png'))
+        self.assertTrue(PatientProfile.objects.get(user=self.user).image_pending)
+
+    def test_variants_have_content_hashed_names(self):
+        self.upload()
+        call_command('process_profile_images', once=True, stdout=io.StringIO())
+
+        profile = PatientProfile.objects.get(user=self.user)
+        self.assertFalse(profile.image_pending)
+        self.assertEqual(set(profile.image_variants), {'webp', 'jpeg'})
+        name = profile.image_variants['webp']['256']
+        self.assertRegex(name, rf'^accounts/{self.user.pk}/images/profile_256\.[0-9a-f]{{16}}\.webp$')
+        with profile.image.storage.open(name) as f:
+            self.assertEqual(Image.open(f).size, (256, 171))
+
+        url = reverse('patientprofile-detail', kwargs={'pk': profile.pk})
+        response = self.client.get(url)
+        self.assertEqual(response.data['image'], f'http://testserver/media/{name}')
+        response = self.client.get(url, {'image_format': 'jpeg', 'image_size': 50})
+        self.assertEqual(response.data['image'], f"http://testserver/media/{profile.image_variants['jpeg']['64']}")
+
+        # A new upload gets new variants under new names.
+        self.upload(color='blue')
+        self.assertEqual(PatientProfile.objects.get(user=self.user).image_variants, {})
+        call_command('process_profile_images', once=True, stdout=io.StringIO())
+        self.assertNotEqual(PatientProfile.objects.get(user=self.user).image_variants['webp']['256'], name)
+
+    def process(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('process_profile_images', once=True, stdout=io.StringIO())
+
+    def stored_names(self):
+        profile = PatientProfile.objects.get(user=self.user)
+        return {profile.image.name} | variant_names(profile.image_variants)
+
+    def test_replaced_image_files_are_deleted(self):
+        self.upload()
+        self.process()
+        old = self.stored_names()
+        self.assertEqual(len(old), 7)
+        storage = PatientProfile.objects.get(user=self.user).image.storage
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.upload(color='blue')
+        self.process()
+        new = self.stored_names()
+        self.assertFalse(old & new)
+        self.assertFalse([name for name in old if storage.exists(name)])
+        self.assertTrue(all(storage.exists(name) for name in new))
+
+        # Re-uploading the same picture re-renders the variants it deleted.
+        with self.captureOnCommitCallbacks(execute=True):
+            self.upload(color='blue')
+        self.process()
+        self.assertTrue(all(storage.exists(name) for name in self.stored_names()))
+
+    def test_variants_of_a_replaced_upload_are_deleted(self):
+        self.upload()
+        rendered = {}
+
+        def render_then_replace(image):
+            rendered.update(render_variants(image))
+            self.upload(color='blue')
+            return rendered
+
+        with patch('users.images.render_variants', side_effect=render_then_replace):
+            self.process()
+        storage = PatientProfile.objects.get(user=self.user).image.storage
+        self.assertEqual(len(variant_names(rendered)), 6)
+        self.assertFalse([name for name in variant_names(rendered) if storage.exists(name)])
+        self.assertTrue(PatientProfile.objects.get(user=self.user).image_pending)
+
+    def test_list_builds_absolute_uri_once(self):
+        from django.http import HttpRequest
+        self.upload()
+        for index in range(3):
+            other = User.objects.create_user(username=f'other{index}', email=f'other{index}@example.com', password='testpass123', is_patient=True)
+            PatientProfile.objects.filter(user=other).update(image=f'accounts/{other.pk}/images/profile_image.png')
+        self.user.is_staff = True
+        self.user.save()
+        with patch.object(HttpRequest, 'build_absolute_uri', autospec=True, side_effect=HttpRequest.build_absolute_uri) as build:
+            response = self.client.get(reverse('patientprofile-list'))
+        self.assertEqual(len([row for row in response.data if row['image']]), 4)
+        self.assertEqual(build.call_count, 1)
+
+
+class RoleProfileSerializationTests(TestCase):
+    def setUp(self):
+        self.patient = User.objects.create_user(username='patient', email='patient@example.com', password='testpass123', is_patient=True)
+        self.doctor = User.objects.create_user(username='doctor', email='doctor@example.com', password='testpass123', is_doctor=True)
+        self.nobody = User.objects.create_user(username='nobody', email='nobody@example.com', password='testpass123')
+
+    def test_only_the_role_profile_is_included(self):
+        users = User.objects.select_related('patient_profile', 'doctor_profile').order_by('pk')
+        patient, doctor, nobody = UserSerializer(users, many=True).data
+        self.assertEqual(patient['patient_profile']['id'], self.patient.patient_profile.pk)
+        self.assertIsNone(patient['doctor_profile'])
+        self.assertEqual(doctor['doctor_profile']['id'], self.doctor.doctor_profile.pk)
+        self.assertIsNone(doctor['patient_profile'])
+        self.assertNotIn('patient_profile', nobody)
+        self.assertNotIn('doctor_profile', nobody)
+        self.assertNotIn('password', patient)
+
+    def test_missing_profile_is_null(self):
+        PatientProfile.objects.filter(user=self.patient).delete()
+        user = User.objects.get(pk=self.patient.pk)
+        # Only the patient profile is looked up; the doctor one is not touched.
+        with self.assertNumQueries(1):
+            data = UserSerializer(user).data
+        self.assertIsNone(data['patient_profile'])
+        self.assertIsNone(data['doctor_profile'])
+
+    def test_profile_is_serialized_once(self):
+        with patch.object(PatientProfileSerializer, 'to_representation', autospec=True, side_effect=PatientProfileSerializer.to_representation) as nested:
+            UserSerializer(self.patient).data
+        self.assertEqual(nested.call_count, 1)
+
+
+THROTTLE_TEST_RATES = {'login': '2/min', 'register': '2/min', 'password_reset': '2/min', 'booking': '2/min'}
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'throttling-tests'}},
+    REST_FRAMEWORK={**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': THROTTLE_TEST_RATES},
+)
+class TokenBucketThrottleTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.url = reverse('password_reset')
+
+    def test_bucket_runs_dry_and_reports_state(self):
+        first = self.client.post(self.url, {'email': 'nobody@example.com'})
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(first['RateLimit-Limit'], '2')
+        self.assertEqual(first['RateLimit-Remaining'], '1')
+        self.assertEqual(self.client.post(self.url, {'email': 'nobody@example.com'})['RateLimit-Remaining'], '0')
+
+        refused = self.client.post(self.url, {'email': 'nobody@example.com'})
+        self.assertEqual(refused.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(refused['RateLimit-Remaining'], '0')
+        self.assertEqual(refused['Retry-After'], '30')
+        self.assertEqual(refused['RateLimit-Reset'], '60')
+
+    def test_bucket_refills_over_the_period(self):
+        now = time.time()
+        with patch('users.throttling.time.time', return_value=now):
+            self.client.post(self.url, {'email': 'nobody@example.com'})
+            self.client.post(self.url, {'email': 'nobody@example.com'})
+        with patch('users.throttling.time.time', return_value=now + 30):
+            response = self.client.post(self.url, {'email': 'nobody@example.com'})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response['RateLimit-Remaining'], '0')
+            response = self.client.post(self.url, {'email': 'nobody@example.com'})
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_buckets_are_per_client_and_scope(self):
+        for _ in range(2):
+            self.client.post(self.url, {'email': 'nobody@example.com'}, REMOTE_ADDR='10.0.0.1')
+        response = self.client.post(self.url, {'email': 'nobody@example.com'}, REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.client.post(reverse('token_obtain_pair'), {'username': 'nobody', 'password': 'wrong'}, REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response['RateLimit-Remaining'], '1')
+
+    def test_booking_is_throttled_per_user(self):
+        patient = User.objects.create_user(username='patient', email='patient@example.com', password='testpass123', is_patient=True)
+        doctor = User.objects.create_user(username='doctor', email='doctor@example.com', password='testpass123', is_doctor=True)
+        self.client.force_authenticate(user=patient)
+        url = reverse('appointment-list')
+        for days in (1, 2):
+            data = {'doctor_id': doctor.pk, 'date_time': (django_timezone.now() + timedelta(days=days)).isoformat()}
+            self.assertEqual(self.client.post(url, data).status_code, status.HTTP_201_CREATED)
+        data = {'doctor_id': doctor.pk, 'date_time': (django_timezone.now() + timedelta(days=3)).isoformat()}
+        self.assertEqual(self.client.post(url, data).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('RateLimit-Limit', response)
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:1/0',
+        'OPTIONS': {'CLIENT_CLASS': 'django_redis.client.DefaultClient'},
+    }})
+    def test_unreachable_redis_lets_requests_through(self):
+        for _ in range(3):
+            response = self.client.post(self.url, {'email': 'nobody@example.com'})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('RateLimit-Limit', response)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'async-profile-tests'}})
+class AsyncProfileTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='doctor', email='doctor@example.com', password='testpass123', is_doctor=True)
+        DoctorProfile.objects.filter(user=self.user).update(specialization='CARD')
+        self.url = reverse('async-user-profile')
+        self.headers = {'Authorization': f'Bearer {RefreshToken.for_user(self.user).access_token}'}
+
+    async def test_profile_matches_sync_endpoint(self):
+        response = await self.async_client.get(self.url, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        user = await User.objects.aget(pk=self.user.pk)
+        self.client.force_authenticate(user=user)
+        expected = await sync_to_async(lambda: self.client.get(reverse('user-profile')).json())()
+        self.assertEqual(response.json(), expected)
+        self.assertEqual(response.json()['data']['doctor_profile']['specialization'], 'CARD')
+
+        response = await self.async_client.get(self.url, headers={**self.headers, 'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    async def test_missing_profile_is_null(self):
+        await DoctorProfile.objects.filter(user=self.user).adelete()
+        response = await self.async_client.get(self.url, headers=self.headers)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(response.json()['data']['doctor_profile'])
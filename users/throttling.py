@@ -0,0 +1,179 @@
+"""
+Token-bucket throttling shared by every worker.
+
+A scope's rate from DEFAULT_THROTTLE_RATES, say "10/min", is read as a bucket
+of 10 tokens that refills evenly over the minute: a client may burst up to
+the full rate and then continues at the average. Buckets are kept per user,
+or per client IP for anonymous requests.
+
+With the Redis cache a bucket is a hash that a Lua script refills and debits
+in one step on the server, by the server's clock, so two workers can never
+both spend the last token. Other cache backends (the local-memory cache in
+tests and development) run the same arithmetic under a process-wide lock.
+If Redis cannot be reached, requests are let through.
+
+Views that mix in RateLimitHeadersMixin report the most constrained bucket
+in RateLimit-Limit, RateLimit-Remaining and RateLimit-Reset headers; refused
+requests also carry Retry-After.
+"""
+import logging
+import math
+import threading
+import time
+from typing import NamedTuple
+
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django_redis import get_redis_connection
+from django_redis.cache import RedisCache
+from redis.exceptions import ConnectionError, TimeoutError
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+logger = logging.getLogger(__name__)
+
+CACHE_ALIAS = 'default'
+
+# KEYS[1]: bucket; ARGV: capacity, tokens per second.
+# Returns {allowed, tokens left} with the tokens as a string, since Lua
+# numbers are truncated to integers on the way out.
+TAKE_TOKEN_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'at')
+local tokens = capacity
+if bucket[1] then
+    tokens = math.min(capacity, tonumber(bucket[1]) + math.max(0, now - tonumber(bucket[2])) * rate)
+end
+local allowed = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'at', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate * 1000) + 1000)
+return {allowed, tostring(tokens)}
+"""
+
+_script = None
+_local_lock = threading.Lock()
+
+
+class ThrottleState(NamedTuple):
+    limit: int
+    remaining: int
+    # Seconds until the bucket is full again.
+    reset: int
+    # Seconds until the next token, for a refused request.
+    wait: float
+
+
+def take_token(key, capacity, rate):
+    """
+    Spend one token from the bucket under key and return (allowed, tokens
+    left), or None if the cache could not be reached.
+    """
+    backend = caches[CACHE_ALIAS]
+    if isinstance(backend, RedisCache):
+        return take_token_from_redis(backend, key, capacity, rate)
+    return take_token_locally(backend, key, capacity, rate)
+
+
+def take_token_from_redis(backend, key, capacity, rate):
+    global _script
+    client = get_redis_connection(CACHE_ALIAS)
+    if _script is None:
+        # Runs by EVALSHA, falling back to EVAL when the server lacks it.
+        _script = client.register_script(TAKE_TOKEN_SCRIPT)
+    try:
+        allowed, tokens = _script(keys=[backend.make_key(key)], args=[capacity, rate], client=client)
+    except (ConnectionError, TimeoutError) as e:
+        logger.warning(f"Throttling skipped, cache unavailable: {e}")
+        return None
+    return bool(allowed), float(tokens)
+
+
+def take_token_locally(backend, key, capacity, rate):
+    with _local_lock:
+        now = time.time()
+        tokens, at = backend.get(key) or (capacity, now)
+        tokens = min(capacity, tokens + max(0, now - at) * rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        backend.set(key, (tokens, now), math.ceil((capacity - tokens) / rate) + 1)
+    return allowed, tokens
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    cache_format = 'throttle:%(scope)s:%(ident)s'
+
+    def get_rate(self):
+        # Read at request time, not import time, so that changed settings apply.
+        try:
+            return api_settings.DEFAULT_THROTTLE_RATES[self.scope]
+        except KeyError:
+            raise ImproperlyConfigured(f"No default throttle rate set for '{self.scope}' scope")
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = self.get_ident(request)
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+    def allow_request(self, request, view):
+        self.state = None
+        if self.rate is None:
+            return True
+        key = self.get_cache_key(request, view)
+        if key is None:
+            return True
+
+        rate = self.num_requests / self.duration
+        taken = take_token(key, self.num_requests, rate)
+        if taken is None:
+            return True
+        allowed, tokens = taken
+        self.state = ThrottleState(
+            limit=self.num_requests,
+            remaining=int(tokens),
+            reset=math.ceil((self.num_requests - tokens) / rate),
+            wait=0 if allowed else (1 - tokens) / rate,
+        )
+        request.throttle_states = getattr(request, 'throttle_states', []) + [self.state]
+        return allowed
+
+    def wait(self):
+        return self.state.wait if self.state else None
+
+
+class LoginThrottle(TokenBucketThrottle):
+    scope = 'login'
+
+
+class RegistrationThrottle(TokenBucketThrottle):
+    scope = 'register'
+
+
+class PasswordResetThrottle(TokenBucketThrottle):
+    scope = 'password_reset'
+
+
+class BookingThrottle(TokenBucketThrottle):
+    scope = 'booking'
+
+
+class RateLimitHeadersMixin:
+    """Add the state of the most constrained throttle bucket to responses."""
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        states = getattr(request, 'throttle_states', None)
+        if states:
+            state = min(states, key=lambda state: (state.remaining, -state.reset))
+            response['RateLimit-Limit'] = str(state.limit)
+            response['RateLimit-Remaining'] = str(state.remaining)
+            response['RateLimit-Reset'] = str(state.reset)
+        return response
@@ -0,0 +1,65 @@
+"""
+Refresh tokens with a cached revocation check.
+
+simplejwt checks the BlacklistedToken table on every refresh. Here each
+answer is kept in the cache under the token's jti until the token expires,
+after which the token is rejected on its exp claim anyway. Blacklisting and
+un-blacklisting write through to the cache after commit (see signals.py), so
+a cached answer is authoritative and only a miss reaches the database.
+
+A "not revoked" answer is stored with cache.add, never cache.set: a lookup
+that raced with a logout must not overwrite the revocation.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt import serializers, tokens
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+
+def revocation_key(jti):
+    return f'users:auth:revoked:{jti}'
+
+
+def remember_revocation(jti, expires_at, revoked):
+    timeout = int(expires_at - time.time())
+    if timeout <= 0:
+        return
+    if revoked:
+        cache.set(revocation_key(jti), True, timeout)
+    else:
+        cache.add(revocation_key(jti), False, timeout)
+
+
+def revoke_on_commit(jti, expires_at):
+    transaction.on_commit(lambda: remember_revocation(jti, expires_at, True))
+
+
+def forget_revocation_on_commit(jti):
+    transaction.on_commit(lambda: cache.delete(revocation_key(jti)))
+
+
+def is_revoked(jti, expires_at):
+    revoked = cache.get(revocation_key(jti))
+    if revoked is None:
+        revoked = BlacklistedToken.objects.filter(token__jti=jti).exists()
+        remember_revocation(jti, expires_at, revoked)
+    return revoked
+
+
+class RefreshToken(tokens.RefreshToken):
+    def check_blacklist(self):
+        if is_revoked(self.payload[api_settings.JTI_CLAIM], self.payload['exp']):
+            raise TokenError(_("Token is blacklisted"))
+
+
+class TokenObtainPairSerializer(serializers.TokenObtainPairSerializer):
+    token_class = RefreshToken
+
+
+class TokenRefreshSerializer(serializers.TokenRefreshSerializer):
+    token_class = RefreshToken
@@ -1,16 +1,20 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import RequestPasswordResetView, PasswordResetConfirmView, EmailVerificationView
-from .viewsets import UserViewSet, DoctorProfileViewSet, PatientProfileViewSet
+from .viewsets import UserViewSet, DoctorProfileViewSet, PatientProfileViewSet, DoctorDirectoryViewSet
+from config.asyncapi import async_action
 
 router = DefaultRouter()
 router.register(r'users', UserViewSet)
 router.register(r'patients', PatientProfileViewSet)
 router.register(r'doctors', DoctorProfileViewSet)
+router.register(r'directory', DoctorDirectoryViewSet, basename='doctor-directory')
 
 urlpatterns = [
     path('', include(router.urls)),
     path('password-reset/', RequestPasswordResetView.as_view(), name='password_reset'),
     path('password-reset-confirm/<uidb64>/<token>/', PasswordResetConfirmView.as_view(), name='password_reset_confirm'),
     path('verify-email/<uidb64>/<token>/', EmailVerificationView.as_view(), name='verify-email'),
+    # Async version of users/profile/, for ASGI deployments.
+    path('async/users/profile/', async_action(UserViewSet, 'profile', 'user'), name='async-user-profile'),
 ]
@@ -2,7 +2,7 @@
 import logging
 from django.contrib.auth import get_user_model
 from django.contrib.auth.tokens import default_token_generator
-from django.core.mail import send_mail
+from django.db import transaction
 from django.http import JsonResponse
 from django.shortcuts import redirect
 from django.urls import reverse
@@ -16,15 +16,18 @@ from rest_framework import generics, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated
-from rest_framework_simplejwt.tokens import RefreshToken
-from google.auth.transport import requests as google_requests
-from google.oauth2 import id_token
 from google_auth_oauthlib.flow import Flow
 from .serializers import UserSerializer, serializers
 from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt import views as jwt_views
 import jwt
 from .serializers import PasswordResetSerializer
 from .serializers import UserProfileSerializer
+from notifications.outbox import enqueue_email
+from .google_auth import verify_google_id_token
+from .tokens import RefreshToken
+from .services import ROLES, assign_role, get_or_provision_google_user
+from .throttling import LoginThrottle, PasswordResetThrottle, RateLimitHeadersMixin, RegistrationThrottle
 
 User = get_user_model()
 logger = logging.getLogger(__name__)
@@ -34,30 +37,34 @@ class ProfileSelectionSerializer(serializers.Serializer):
 
 
 
-class UserRegistrationView(generics.CreateAPIView):
+class TokenObtainPairView(RateLimitHeadersMixin, jwt_views.TokenObtainPairView):
+    throttle_classes = [LoginThrottle]
+
+
+class UserRegistrationView(RateLimitHeadersMixin, generics.CreateAPIView):
     serializer_class = UserSerializer
     permission_classes = [AllowAny]
+    throttle_classes = [RegistrationThrottle]
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        user = serializer.save()
+        # The verification email is queued in the same transaction as the user.
+        with transaction.atomic():
+            user = serializer.save()
 
-        uid = urlsafe_base64_encode(force_bytes(user.pk))
-        token = default_token_generator.make_token(user)
-        verification_url = request.build_absolute_uri(
-            reverse('verify-email', kwargs={'uidb64': uid, 'token': token})
-        )
+            uid = urlsafe_base64_encode(force_bytes(user.pk))
+            token = default_token_generator.make_token(user)
+            verification_url = request.build_absolute_uri(
+                reverse('verify-email', kwargs={'uidb64': uid, 'token': token})
+            )
+
+            enqueue_email(
+                'Email Verification',
+                f'Click the link to verify your email: {verification_url}',
+                [user.email],
+            )
 
-        send_mail(
-            'Email Verification',
-            f'Click the link to verify your email: {verification_url}',
-            settings.DEFAULT_FROM_EMAIL,
-            [user.email],
-            fail_silently=False,
-        )
-        
-        user.refresh_from_db()
         headers = self.get_success_headers(serializer.data)
         return Response({"message": "User created successfully. Please check your email to verify your account.", "data": serializer.data}, status=status.HTTP_201_CREATED, headers=headers)
 
@@ -65,8 +72,9 @@ class UserRegistrationView(generics.CreateAPIView):
 
 
 
-class RequestPasswordResetView(APIView):
+class RequestPasswordResetView(RateLimitHeadersMixin, APIView):
     permission_classes = [AllowAny]
+    throttle_classes = [PasswordResetThrottle]
     serializer_class = PasswordResetSerializer
 
     def post(self, request):
@@ -83,19 +91,9 @@ class RequestPasswordResetView(APIView):
 
             subject = 'Password Reset Request'
             message = f'Click the link to reset your password: {reset_url}'
-            from_email = settings.DEFAULT_FROM_EMAIL
-            recipient_list = [email]
-
-            logger.info(f"Attempting to send password reset email to {email}")
-            try:
-                send_mail(subject, message, from_email, recipient_list, fail_silently=False)
-                logger.info(f"Password reset email sent successfully to {email}")
-            except Exception as e:
-                logger.error(f"Failed to send password reset email to {email}. Error: {str(e)}")
-                return Response(
-                    {"detail": "Failed to send password reset email. Please try again later."},
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                )
+
+            enqueue_email(subject, message, [email])
+            logger.info(f"Password reset email queued for {email}")
         else:
             logger.info(f"Password reset requested for non-existent email: {email}")
 
@@ -196,7 +194,7 @@ class GoogleSignInView(APIView):
 
         try:
             # Verify the token
-            idinfo = id_token.verify_oauth2_token(token, google_requests.Request(), settings.GOOGLE_CLIENT_ID)
+            idinfo = verify_google_id_token(token)
 
             # ID token is valid. Get the user's Google Account ID from the decoded token.
             userid = idinfo['sub']
@@ -204,14 +202,7 @@ class GoogleSignInView(APIView):
             first_name = idinfo.get('given_name', '')
             last_name = idinfo.get('family_name', '')
 
-            user, created = User.objects.get_or_create(email=email)
-            
-            if created:
-                user.username = email
-                user.first_name = first_name
-                user.last_name = last_name
-                user.email_verified = True
-                user.save()
+            user, created = get_or_provision_google_user(email, first_name, last_name)
 
             # Check if the user already has a role (patient or doctor)
             if not user.is_patient and not user.is_doctor:
@@ -254,27 +245,18 @@ class SetUserRoleView(APIView):
 
         try:
             # Verify the token
-            idinfo = id_token.verify_oauth2_token(token, google_requests.Request(), settings.GOOGLE_CLIENT_ID)
+            idinfo = verify_google_id_token(token)
 
-            # Get user email from the verified token
-            email = idinfo['email']
-
-            # Fetch or create the user
-            user, created = User.objects.get_or_create(email=email)
-            
             # Check if a role is provided
             role = request.data.get('role')
-            if not role or role not in ['patient', 'doctor']:
+            if not role or role not in ROLES:
                 return Response({"detail": "Valid role ('patient' or 'doctor') is required."}, status=status.HTTP_400_BAD_REQUEST)
 
-            # Assign the role to the user
-            if role == 'patient':
-                user.is_patient = True
-                user.is_doctor = False
-            else:
-                user.is_doctor = True
-                user.is_patient = False
-            user.save()
+            # Fetch or create the user from the verified token and assign the role
+            user, created = get_or_provision_google_user(
+                idinfo['email'], idinfo.get('given_name', ''), idinfo.get('family_name', ''),
+            )
+            assign_role(user, role)
 
             return Response({"detail": "Role updated successfully.", "role": role}, status=status.HTTP_200_OK)
 
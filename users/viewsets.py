@@ -3,17 +3,22 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.contrib.auth import get_user_model
 from .models import PatientProfile, DoctorProfile
-from .serializers import UserSerializer, PatientProfileSerializer, DoctorProfileSerializer, UserProfileSerializer
+from .serializers import UserSerializer, PatientProfileSerializer, DoctorProfileSerializer, UserProfileSerializer, DoctorDirectorySerializer
+from .directory import DoctorDirectoryPagination, cached_directory_response
+from .services import aload_profile, assign_role
 from .permissions import IsOwnerOrReadOnly, IsDoctorOrReadOnly
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAuthenticated, AllowAny
+from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.parsers import JSONParser, MultiPartParser, FormParser
+from appointments import conditional
+from config.asyncapi import AsyncReadMixin
 import logging
 
 
 User = get_user_model()
 logger = logging.getLogger(__name__)
 
-class UserViewSet(viewsets.ModelViewSet):
+class UserViewSet(AsyncReadMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated, IsOwnerOrReadOnly]
@@ -32,6 +37,22 @@ class UserViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def profile(self, request):
         user = request.user
+        etag = conditional.make_etag(request, [(user.pk, user.updated_at)])
+        response = conditional.not_modified(request, etag, user.updated_at)
+        if response is None:
+            response = self.profile_response(user)
+        return conditional.set_validators(response, etag, user.updated_at)
+
+    async def aprofile(self, request):
+        user = request.user
+        etag = conditional.make_etag(request, [(user.pk, user.updated_at)])
+        response = conditional.not_modified(request, etag, user.updated_at)
+        if response is None:
+            await aload_profile(user)
+            response = self.profile_response(user)
+        return conditional.set_validators(response, etag, user.updated_at)
+
+    def profile_response(self, user):
         serializer = self.get_serializer(user)
         return Response({"message": "Profile retrieved successfully", "data": serializer.data})
 
@@ -59,16 +80,7 @@ class UserViewSet(viewsets.ModelViewSet):
         if (role == "patient" and user.is_doctor) or (role == "doctor" and user.is_patient):
             return Response({"error": "You cannot change your role once it's set."}, status=status.HTTP_400_BAD_REQUEST)
 
-        if role == "patient":
-            user.is_patient = True
-            user.is_doctor = False
-            PatientProfile.objects.get_or_create(user=user)
-        elif role == "doctor":
-            user.is_doctor = True
-            user.is_patient = False
-            DoctorProfile.objects.get_or_create(user=user)
-        
-        user.save()
+        assign_role(user, role)
         return Response({"message": "Role updated successfully", "role": role})
 
 
@@ -133,4 +145,21 @@ class DoctorProfileViewSet(viewsets.ModelViewSet):
             return Response({"message": "Doctor profile updated successfully", "data": serializer.data})
 
 
-
+class DoctorDirectoryViewSet(viewsets.ReadOnlyModelViewSet):
+    """Public listing of doctors, filterable by specialization and availability."""
+    queryset = DoctorProfile.objects.filter(user__is_doctor=True, user__is_active=True).select_related('user', 'user__rating_stats')
+    serializer_class = DoctorDirectorySerializer
+    # Anonymous on purpose: every caller gets the same, shared cached page.
+    authentication_classes = []
+    permission_classes = [AllowAny]
+    pagination_class = DoctorDirectoryPagination
+    filter_backends = [DjangoFilterBackend]
+    filterset_fields = ['specialization', 'availability']
+
+    @cached_directory_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cached_directory_response
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)